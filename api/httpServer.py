@@ -0,0 +1,352 @@
+"""
+HTTP JSON API for signup, login and vault access.
+
+Serves many users at once from one process:
+
+    python -m api.httpServer --host 127.0.0.1 --port 8080
+
+Run from the repository root. Endpoints (JSON in and out; vault endpoints
+need an "Authorization: Bearer <token>" header from /login):
+
+    POST   /signup         {"username", "email", "password"}
+    POST   /login          {"username", "password"} -> {"token", ...}  (429 while locked out)
+    POST   /logout
+    GET    /vault          ?page=0&page_size=20&reveal=0
+    GET    /vault/search   ?q=...&limit=10&reveal=0
+    GET    /vault/item     ?service=...&username=...
+    PUT    /vault/item     {"service", "username", "password", "email", "replace"}
+    DELETE /vault/item     ?service=...&username=...
+    GET    /health
+    GET    /metrics        Prometheus text (with NAITEVARNASSE_TELEMETRY=1)
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from telemetry import metrics
+from user.userHandling import RegistrationError, UserHandling
+from vault.keyGeneration import StaleVaultKeyError
+from vault.vaultManager import VAULT_COLUMNS, VaultManager
+from .sessions import Session, SessionStore
+from .vaultPool import VaultPool
+
+MAX_BODY = 64 * 1024
+MAX_PAGE_SIZE = 500
+
+
+class ApiError(Exception):
+    """An error returned to the client as {"error": message} with an HTTP status."""
+
+    def __init__(self, status: int, message: str, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+
+class VaultApi:
+    """
+    Request handling behind the HTTP server, independent of the transport.
+
+    Signup and login run the password KDF, which is deliberately slow, on a
+    small bounded pool (kdf_workers threads, at most kdf_queue waiting).
+    When that pool is full further logins get 503 at once instead of
+    queueing, so a burst of logins cannot tie up every request thread and
+    session requests, which never touch the KDF, keep being served.
+    """
+
+    def __init__(self, users_dir: str = 'users', users_file: str = 'users.json',
+                 vault_dir: str = 'userApps', storage: str = 'json',
+                 kdf_workers: Optional[int] = None, kdf_queue: int = 16,
+                 session_ttl: float = 900, max_open_vaults: int = 64,
+                 breach_corpus_file: Optional[str] = 'breached_passwords.nvbc'):
+        """
+        Args:
+            users_dir (str): User store directory
+            users_file (str): Legacy user file imported on first use
+            vault_dir (str): Base directory for user vaults
+            storage (str): Vault storage engine
+            kdf_workers (int): Concurrent KDF runs (default: half the CPUs, at least 1)
+            kdf_queue (int): Signups/logins allowed to wait for a KDF worker
+            session_ttl (float): Seconds a session may stay unused
+            max_open_vaults (int): Idle vault handles kept open
+            breach_corpus_file (str): Offline breach corpus used at signup
+        """
+        self.user_handling = UserHandling(users_file=users_file, users_dir=users_dir,
+                                          breach_corpus_file=breach_corpus_file)
+        self.sessions = SessionStore(idle_ttl=session_ttl)
+        self.vaults = VaultPool(vault_dir, storage, max_open_vaults)
+        self.kdf_workers = kdf_workers or max(1, (os.cpu_count() or 2) // 2)
+        self._kdf_pool = ThreadPoolExecutor(self.kdf_workers, thread_name_prefix='kdf')
+        self._kdf_slots = threading.BoundedSemaphore(self.kdf_workers + kdf_queue)
+        self.routes: Dict[Tuple[str, str], Callable] = {
+            ('POST', '/signup'): self.signup,
+            ('POST', '/login'): self.login,
+            ('POST', '/logout'): self.logout,
+            ('GET', '/vault'): self.list_vault,
+            ('GET', '/vault/search'): self.search_vault,
+            ('GET', '/vault/item'): self.get_item,
+            ('PUT', '/vault/item'): self.put_item,
+            ('DELETE', '/vault/item'): self.delete_item,
+            ('GET', '/health'): self.health,
+        }
+
+    def close(self) -> None:
+        self._kdf_pool.shutdown(wait=True)
+        self.vaults.close()
+        self.user_handling.login_limiter.flush()
+
+    def _run_kdf(self, function: Callable, *args):
+        """Run a KDF-bound call on the KDF pool, or reject it if the pool is saturated."""
+        if not self._kdf_slots.acquire(blocking=False):
+            metrics.increment('api.kdf_rejected')
+            raise ApiError(503, "Server busy, retry shortly", retry_after=1)
+        try:
+            return self._kdf_pool.submit(function, *args).result()
+        finally:
+            self._kdf_slots.release()
+
+    def _session(self, headers) -> Tuple[str, Session]:
+        scheme, _, token = (headers.get('Authorization') or '').partition(' ')
+        session = self.sessions.get(token) if scheme.lower() == 'bearer' and token else None
+        if session is None:
+            raise ApiError(401, "Missing or expired session token")
+        return token, session
+
+    @contextmanager
+    def _vault(self, token: str, session: Session) -> Iterator[VaultManager]:
+        """Borrow the session's vault; a session from before a master password change ends."""
+        try:
+            with self.vaults.vault(session.username, session.master_key) as vault_manager:
+                yield vault_manager
+        except StaleVaultKeyError as e:
+            self.sessions.revoke(token)
+            raise ApiError(401, str(e))
+
+    # Handlers: (body, query, headers, client address) -> (status, payload)
+
+    def signup(self, body: Dict, query: Dict, headers, client: str) -> Tuple[int, Dict]:
+        try:
+            user = self._run_kdf(self.user_handling.register_user, _text(body, 'username'),
+                                 _text(body, 'email'), _text(body, 'password'))
+        except RegistrationError as e:
+            raise ApiError(400, str(e), errors=e.errors)
+        return 201, user
+
+    def login(self, body: Dict, query: Dict, headers, client: str) -> Tuple[int, Dict]:
+        username = _text(body, 'username')
+        password = _text(body, 'password')
+        # Locked out attempts are refused here, without taking a KDF slot
+        retry_after = self.user_handling.login_limiter.retry_after(username, client)
+        if retry_after > 0:
+            raise ApiError(429, "Too many failed logins", retry_after=math.ceil(retry_after))
+        master_key = self._run_kdf(self.user_handling.verify_login, username, password, client)
+        if master_key is None:
+            retry_after = self.user_handling.login_limiter.retry_after(username, client)
+            if retry_after > 0:
+                raise ApiError(429, "Too many failed logins", retry_after=math.ceil(retry_after))
+            raise ApiError(401, "Invalid username or master password")
+        # Sessions and vault handles are keyed by the stored spelling of the name
+        username = self.user_handling.store.get_user(username)["username"]
+        self.sessions.purge()
+        token = self.sessions.create(username, master_key)
+        return 200, {"token": token, "username": username, "expires_in": self.sessions.idle_ttl}
+
+    def logout(self, body: Dict, query: Dict, headers, client: str) -> Tuple[int, Dict]:
+        token, session = self._session(headers)
+        self.sessions.revoke(token)
+        if session.username not in self.sessions.active_users():
+            self.vaults.release(session.username)
+        return 200, {"logged_out": True}
+
+    def list_vault(self, body: Dict, query: Dict, headers, client: str) -> Tuple[int, Dict]:
+        token, session = self._session(headers)
+        page = _int(query, 'page', 0)
+        page_size = min(max(_int(query, 'page_size', 20), 1), MAX_PAGE_SIZE)
+        with self._vault(token, session) as vault_manager:
+            rows, total_pages = vault_manager.get_page(page, page_size, not _flag(query, 'reveal'))
+        return 200, {"items": [dict(zip(VAULT_COLUMNS, row)) for row in rows],
+                     "page": min(max(page, 0), total_pages - 1), "total_pages": total_pages}
+
+    def search_vault(self, body: Dict, query: Dict, headers, client: str) -> Tuple[int, Dict]:
+        token, session = self._session(headers)
+        limit = min(max(_int(query, 'limit', 10), 1), MAX_PAGE_SIZE)
+        with self._vault(token, session) as vault_manager:
+            rows = vault_manager.search(_text(query, 'q'), limit, not _flag(query, 'reveal'))
+        return 200, {"items": [dict(zip(VAULT_COLUMNS, row)) for row in rows]}
+
+    def get_item(self, body: Dict, query: Dict, headers, client: str) -> Tuple[int, Dict]:
+        token, session = self._session(headers)
+        service, username = _text(query, 'service'), _text(query, 'username')
+        with self._vault(token, session) as vault_manager:
+            cred = vault_manager.get_credentials(service, username)
+        if cred is None:
+            raise ApiError(404, f"No credentials for {service} / {username}")
+        return 200, cred
+
+    def put_item(self, body: Dict, query: Dict, headers, client: str) -> Tuple[int, Dict]:
+        token, session = self._session(headers)
+        service, username = _text(body, 'service'), _text(body, 'username')
+        if not service or not username:
+            raise ApiError(400, "service and username are required")
+        with self._vault(token, session) as vault_manager:
+            exists = vault_manager.storage.get(service, username) is not None
+            if exists and not body.get('replace'):
+                raise ApiError(409, f"Credentials for {service} / {username} exist; set replace to overwrite")
+            if not vault_manager.add_credentials(username, _text(body, 'password'),
+                                                 _text(body, 'email'), service):
+                raise ApiError(500, "Failed to save credentials")
+        return (200 if exists else 201), {"service": service, "username": username}
+
+    def delete_item(self, body: Dict, query: Dict, headers, client: str) -> Tuple[int, Dict]:
+        token, session = self._session(headers)
+        service, username = _text(query, 'service'), _text(query, 'username')
+        with self._vault(token, session) as vault_manager:
+            if not vault_manager.delete_credentials(service, username):
+                raise ApiError(404, f"No credentials for {service} / {username}")
+        return 200, {"deleted": True}
+
+    def health(self, body: Dict, query: Dict, headers, client: str) -> Tuple[int, Dict]:
+        return 200, {"status": "ok", "sessions": len(self.sessions), "open_vaults": len(self.vaults)}
+
+
+def _text(source: Dict, name: str) -> str:
+    value = source.get(name, '')
+    if isinstance(value, list):  # query strings parse to lists
+        value = value[0] if value else ''
+    if not isinstance(value, str):
+        raise ApiError(400, f"{name} must be a string")
+    return value
+
+
+def _int(query: Dict, name: str, default: int) -> int:
+    try:
+        return int(_text(query, name) or default)
+    except ValueError:
+        raise ApiError(400, f"{name} must be an integer")
+
+
+def _flag(query: Dict, name: str) -> bool:
+    return _text(query, name).lower() in ('1', 'true', 'yes')
+
+
+class ApiRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so clients can reuse connections
+    disable_nagle_algorithm = True  # headers and body go out as separate writes
+    server: 'ApiServer'
+
+    def do_GET(self):
+        self._dispatch()
+
+    def do_POST(self):
+        self._dispatch()
+
+    def do_PUT(self):
+        self._dispatch()
+
+    def do_DELETE(self):
+        self._dispatch()
+
+    def _read_body(self) -> Dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY:
+            raise ApiError(413, "Request body too large")
+        if length == 0:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            raise ApiError(400, "Request body is not valid JSON")
+        if not isinstance(body, dict):
+            raise ApiError(400, "Request body must be a JSON object")
+        return body
+
+    def _dispatch(self) -> None:
+        url = urlsplit(self.path)
+        api = self.server.api
+        extra_headers = {}
+        try:
+            if self.command == 'GET' and url.path == '/metrics':
+                self._send(200, metrics.prometheus_text().encode(), 'text/plain; version=0.0.4')
+                return
+            handler = api.routes.get((self.command, url.path))
+            if handler is None:
+                known = any(path == url.path for _, path in api.routes)
+                raise ApiError(405 if known else 404, "Method not allowed" if known else "Not found")
+            body = self._read_body()
+            with metrics.timed(f'api.{self.command.lower()}{url.path.replace("/", ".")}'):
+                status, payload = handler(body, parse_qs(url.query), self.headers, self.client_address[0])
+        except ApiError as e:
+            status, payload = e.status, {"error": str(e), **e.extra}
+            if 'retry_after' in e.extra:
+                extra_headers['Retry-After'] = str(e.extra['retry_after'])
+        except Exception as e:
+            logging.error(f"Error handling {self.command} {url.path}: {str(e)}")
+            status, payload = 500, {"error": "Internal server error"}
+        self._send(status, json.dumps(payload).encode(), 'application/json', extra_headers)
+
+    def _send(self, status: int, data: bytes, content_type: str, headers: Optional[Dict] = None) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Cache-Control', 'no-store')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug(f"{self.address_string()} {format % args}")
+
+
+class ApiServer(ThreadingHTTPServer):
+    """Threaded HTTP server, one thread per connection, sharing one VaultApi."""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], api: VaultApi):
+        super().__init__(address, ApiRequestHandler)
+        self.api = api
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.api.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--users-dir', default='users')
+    parser.add_argument('--users-file', default='users.json')
+    parser.add_argument('--vault-dir', default='userApps')
+    parser.add_argument('--storage', default='json')
+    parser.add_argument('--kdf-workers', type=int, help="concurrent KDF runs (default: half the CPUs)")
+    parser.add_argument('--kdf-queue', type=int, default=16, help="logins allowed to wait for a KDF worker")
+    parser.add_argument('--session-ttl', type=float, default=900, help="idle seconds before a session expires")
+    parser.add_argument('--max-open-vaults', type=int, default=64)
+    args = parser.parse_args(argv)
+
+    api = VaultApi(args.users_dir, args.users_file, args.vault_dir, args.storage, args.kdf_workers,
+                   args.kdf_queue, args.session_ttl, args.max_open_vaults)
+    server = ApiServer((args.host, args.port), api)
+    print(f"Serving on http://{server.server_address[0]}:{server.server_address[1]}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import hashlib
+import secrets
+import threading
+import time
+from typing import Dict, Optional
+
+
+class Session:
+    __slots__ = ('username', 'master_key', 'created', 'last_used')
+
+    def __init__(self, username: str, master_key: str):
+        self.username = username
+        self.master_key = master_key
+        self.created = self.last_used = time.monotonic()
+
+
+class SessionStore:
+    """
+    Bearer-token sessions for the API server.
+
+    A login hands out a random token; the session behind it holds the derived
+    vault key so later requests skip the KDF. Only a SHA-256 digest of each
+    token is kept as the lookup key. Sessions end after idle_ttl seconds
+    without use or max_age seconds after login, whichever comes first.
+    """
+
+    def __init__(self, idle_ttl: float = 900, max_age: float = 12 * 3600):
+        """
+        Args:
+            idle_ttl (float): Seconds a session may go unused
+            max_age (float): Seconds a session lives at most
+        """
+        self.idle_ttl = idle_ttl
+        self.max_age = max_age
+        self._sessions: Dict[bytes, Session] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def _expired(self, session: Session, now: float) -> bool:
+        return now - session.last_used > self.idle_ttl or now - session.created > self.max_age
+
+    def create(self, username: str, master_key: str) -> str:
+        """Start a session and return its token."""
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._sessions[self._digest(token)] = Session(username, master_key)
+        return token
+
+    def get(self, token: str) -> Optional[Session]:
+        """The live session for a token, refreshing its idle timer, or None."""
+        digest = self._digest(token)
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(digest)
+            if session is None:
+                return None
+            if self._expired(session, now):
+                del self._sessions[digest]
+                return None
+            session.last_used = now
+            return session
+
+    def revoke(self, token: str) -> Optional[Session]:
+        with self._lock:
+            return self._sessions.pop(self._digest(token), None)
+
+    def active_users(self) -> set:
+        with self._lock:
+            return {session.username for session in self._sessions.values()}
+
+    def purge(self) -> int:
+        """Drop expired sessions; returns how many were removed."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [digest for digest, session in self._sessions.items() if self._expired(session, now)]
+            for digest in expired:
+                del self._sessions[digest]
+        return len(expired)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
@@ -0,0 +1,139 @@
+import hmac
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator
+
+from telemetry import metrics
+from vault.keyGeneration import StaleVaultKeyError
+from vault.vaultManager import VaultManager
+
+
+class _Handle:
+    __slots__ = ('vault_manager', 'master_key', 'lock', 'users', 'retired')
+
+    def __init__(self, vault_manager: VaultManager, master_key: str):
+        self.vault_manager = vault_manager
+        self.master_key = master_key
+        self.lock = threading.RLock()
+        self.users = 0
+        self.retired = False  # dropped from the pool; closed by its last user
+
+
+class VaultPool:
+    """
+    Open VaultManagers shared between API requests, one per user.
+
+    Opening a vault parses its file and builds the cipher, so handles are
+    kept open and reused by every session of the same user. Requests for one
+    user are serialised on that handle's lock (the field cache and search
+    index are not thread-safe); different users run in parallel. At most
+    max_open idle handles stay open, least recently used closed first.
+
+    After a master password change the user's handle is dropped, and a
+    request with a key other than the vault's current one is refused with
+    StaleVaultKeyError, so sessions from before the change end.
+    """
+
+    def __init__(self, base_dir: str = 'userApps', storage: str = 'json', max_open: int = 64):
+        """
+        Args:
+            base_dir (str): Base directory for user vaults
+            storage (str): Vault storage engine
+            max_open (int): Handles kept open before idle ones are closed
+        """
+        self.base_dir = base_dir
+        self.storage = storage
+        self.max_open = max_open
+        self._handles: 'OrderedDict[str, _Handle]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def vault(self, username: str, master_key: str) -> Iterator[VaultManager]:
+        """
+        Borrow the user's VaultManager for the duration of a request.
+
+        Args:
+            username (str): Vault owner, as stored in the user store
+            master_key (str): The owner's derived vault key
+
+        Raises:
+            StaleVaultKeyError: If master_key was replaced by a master password change
+        """
+        handle = self._acquire(username, master_key)
+        try:
+            with handle.lock:
+                yield handle.vault_manager
+        finally:
+            with self._lock:
+                handle.users -= 1
+                if handle.retired and handle.users == 0:
+                    handle.vault_manager.close()
+                self._evict()
+
+    def _retire(self, username: str) -> None:
+        """Drop a user's handle from the pool (pool lock held); it closes once unused."""
+        handle = self._handles.pop(username)
+        handle.retired = True
+        if handle.users == 0:
+            handle.vault_manager.close()
+        logging.info(f"Dropped vault handle for {username} after a master password change")
+
+    def _acquire(self, username: str, master_key: str) -> _Handle:
+        with self._lock:
+            handle = self._handles.get(username)
+            if handle is not None and not handle.vault_manager.key_is_current():
+                self._retire(username)
+                handle = None
+            if handle is not None:
+                if not hmac.compare_digest(handle.master_key, master_key):
+                    # The open handle has the current key, so this one is outdated
+                    raise StaleVaultKeyError("The master password was changed; log in again")
+                self._handles.move_to_end(username)
+                handle.users += 1
+                metrics.increment('vault_pool.hit')
+                return handle
+        # Open outside the pool lock; a concurrent open of the same vault loses the race below
+        metrics.increment('vault_pool.miss')
+        opened = _Handle(VaultManager(master_key, username, base_dir=self.base_dir, storage=self.storage), master_key)
+        with self._lock:
+            handle = self._handles.setdefault(username, opened)
+            if handle is opened or hmac.compare_digest(handle.master_key, master_key):
+                self._handles.move_to_end(username)
+                handle.users += 1
+        if handle is not opened:
+            opened.vault_manager.close()
+            if handle.master_key != master_key:
+                raise StaleVaultKeyError("The master password was changed; log in again")
+        return handle
+
+    def _evict(self) -> None:
+        """Close least recently used idle handles beyond max_open (pool lock held)."""
+        excess = len(self._handles) - self.max_open
+        for username in list(self._handles):
+            if excess <= 0:
+                break
+            handle = self._handles[username]
+            if handle.users == 0:
+                del self._handles[username]
+                handle.vault_manager.close()
+                logging.info(f"Closed idle vault for {username}")
+                excess -= 1
+
+    def release(self, username: str) -> None:
+        """Close a user's vault once no request is using it, e.g. after their last logout."""
+        with self._lock:
+            handle = self._handles.get(username)
+            if handle is not None and handle.users == 0:
+                del self._handles[username]
+                handle.vault_manager.close()
+
+    def close(self) -> None:
+        with self._lock:
+            for handle in self._handles.values():
+                handle.vault_manager.close()
+            self._handles.clear()
+
+    def __len__(self) -> int:
+        return len(self._handles)
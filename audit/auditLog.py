@@ -0,0 +1,405 @@
+"""
+Structured audit log of security events (signups, logins, vault changes).
+
+Records are JSON lines, one per event, with at least "ts" (epoch seconds),
+"event" and "user". record() only puts the event on a bounded queue; a
+background listener thread writes it to <directory>/current.jsonl. When that
+file reaches max_bytes or is older than rotate_seconds it is sealed into a
+gzip-compressed segment, and index.json records which users and events
+each segment holds and its time range, so a query opens only the segments
+that can match:
+
+    python -m audit.auditLog --user alice --event login --since 7d
+
+Several processes may share one directory; writes and rotation take a file
+lock. The directory is created private to its owner (0700) and every file
+in it 0600. The directory is NAITEVARNASSE_AUDIT_DIR (default "audit"); set it
+to an empty string to turn auditing off.
+"""
+import argparse
+import atexit
+import glob
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import shutil
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional
+
+from telemetry import metrics
+from vault.fileLock import FileLock
+
+CURRENT_FILE = 'current.jsonl'
+INDEX_FILE = 'index.json'
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+# Events a full queue waits for instead of dropping
+KEPT_EVENTS = frozenset({'login', 'lockout'})
+
+
+def _open_private(path: str, flags: int):
+    """Open path for writing in binary mode, creating it readable by its owner only."""
+    return open(os.open(path, os.O_WRONLY | os.O_CREAT | flags, 0o600), 'wb')
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Does not block the caller for routine events: when the queue is full the
+    record is counted and dropped. Events in KEPT_EVENTS wait for room instead.
+    """
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.audit["event"] in KEPT_EVENTS:
+                metrics.increment('audit.blocked')
+                self.queue.put(record)
+            else:
+                metrics.increment('audit.dropped')
+
+
+class _AuditListener(logging.handlers.QueueListener):
+    """QueueListener whose stop() waits for room in a full queue instead of raising queue.Full."""
+
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)
+
+
+class AuditFileHandler(logging.Handler):
+    """
+    Appends audit records to current.jsonl and seals it into indexed segments.
+
+    Runs on the listener thread only. A full current.jsonl is renamed to
+    sealed-*.jsonl under the write lock, then indexed and compressed under
+    the separate index lock, so other writers wait only for the rename.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, rotate_seconds: float, compress: bool):
+        super().__init__()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.compress = compress
+        self.path = os.path.join(directory, CURRENT_FILE)
+        self.file_lock = FileLock(self.path)
+        self.index_lock = FileLock(os.path.join(directory, INDEX_FILE))
+        self._file = None
+        self._started: Optional[float] = None  # time of the current file's first record
+        for leftover in sorted(glob.glob(os.path.join(directory, 'sealed-*.jsonl'))):
+            self._finish_segment(leftover)
+
+    def _open(self) -> None:
+        """(Re)open current.jsonl, e.g. after another process rotated it."""
+        if self._file is not None:
+            if os.path.exists(self.path) and os.path.samestat(os.fstat(self._file.fileno()), os.stat(self.path)):
+                return
+            self._file.close()
+        self._file = _open_private(self.path, os.O_APPEND)
+        self._started = None
+        with open(self.path, 'rb') as f:
+            first = f.readline()
+        if first.endswith(b'\n'):
+            self._started = json.loads(first)["ts"]
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            entry = record.audit
+            line = (json.dumps(entry, separators=(',', ':')) + '\n').encode()
+            sealed = None
+            with self.file_lock:
+                self._open()
+                if self._started is None:
+                    self._started = entry["ts"]
+                self._file.write(line)
+                self._file.flush()
+                size = self._file.tell()
+                if size >= self.max_bytes or entry["ts"] - self._started >= self.rotate_seconds:
+                    sealed = self._seal()
+            if sealed:
+                self._finish_segment(sealed)
+        except Exception:
+            self.handleError(record)
+
+    def _seal(self) -> str:
+        """Move current.jsonl aside (lock held); returns the sealed file's path."""
+        sealed = os.path.join(self.directory, f'sealed-{time.time_ns()}-{os.getpid()}.jsonl')
+        os.replace(self.path, sealed)
+        self._file.close()
+        self._file = None
+        return sealed
+
+    def _finish_segment(self, sealed: str) -> None:
+        """Index a sealed file, compress it and add it to index.json."""
+        # The index lock also keeps two processes from finishing the same leftover
+        with self.index_lock, metrics.timed('audit.rotate'):
+            if not os.path.exists(sealed):
+                return
+            entry = {"start": None, "end": None, "records": 0, "users": {}, "events": {}}
+            with open(sealed, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        continue
+                    item = json.loads(line)
+                    ts = item["ts"]
+                    entry["start"] = ts if entry["start"] is None else min(entry["start"], ts)
+                    entry["end"] = ts if entry["end"] is None else max(entry["end"], ts)
+                    entry["records"] += 1
+                    user = item.get("user") or ''
+                    events = entry["users"].setdefault(user, [])
+                    if item["event"] not in events:
+                        events.append(item["event"])
+                    entry["events"][item["event"]] = entry["events"].get(item["event"], 0) + 1
+            if entry["records"] == 0:
+                os.remove(sealed)
+                return
+            name = 'segment-{}-{}.jsonl'.format(
+                datetime.fromtimestamp(entry["start"], timezone.utc).strftime('%Y%m%dT%H%M%S'),
+                os.path.basename(sealed)[len('sealed-'):-len('.jsonl')]
+            )
+            if self.compress:
+                name += '.gz'
+                with open(sealed, 'rb') as source, \
+                        _open_private(os.path.join(self.directory, name), os.O_TRUNC) as raw, \
+                        gzip.GzipFile(filename='', mode='wb', fileobj=raw) as target:
+                    shutil.copyfileobj(source, target)
+            else:
+                os.replace(sealed, os.path.join(self.directory, name))
+            index = load_index(self.directory)
+            index[name] = entry
+            _write_index(self.directory, index)
+            if os.path.exists(sealed):
+                os.remove(sealed)
+            logging.info(f"Sealed audit segment {name} ({entry['records']} records)")
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        super().close()
+
+
+def load_index(directory: str) -> Dict:
+    try:
+        with open(os.path.join(directory, INDEX_FILE), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_index(directory: str, index: Dict) -> None:
+    path = os.path.join(directory, INDEX_FILE)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with _open_private(tmp_path, os.O_TRUNC) as f:
+        f.write(json.dumps(index).encode())
+    os.replace(tmp_path, path)
+
+
+class AuditLog:
+    """
+    Non-blocking writer and indexed reader of one audit directory.
+
+    record() hands the event to a logging QueueHandler; a QueueListener
+    thread runs AuditFileHandler. If the writer falls queue_size records
+    behind, new records are dropped and counted as audit.dropped rather
+    than slowing down the caller; login and lockout records wait for the
+    writer instead, so an attack cannot push them out.
+    """
+
+    def __init__(self, directory: str = 'audit', max_bytes: int = 8 * 1024 * 1024,
+                 rotate_seconds: float = 86400, compress: bool = True, queue_size: int = 10000):
+        """
+        Args:
+            directory (str): Where current.jsonl, the segments and index.json live
+            max_bytes (int): Size at which current.jsonl is sealed
+            rotate_seconds (float): Age at which current.jsonl is sealed
+            compress (bool): gzip sealed segments
+            queue_size (int): Records waiting for the writer before routine ones are dropped
+        """
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self.handler = AuditFileHandler(directory, max_bytes, rotate_seconds, compress)
+        self._queue = queue.Queue(queue_size)
+        self._logger = logging.Logger(f'naitevarnasse.audit.{directory}')
+        self._logger.addHandler(_DroppingQueueHandler(self._queue))
+        self._listener = _AuditListener(self._queue, self.handler)
+        self._listener.start()
+        self._closed = False
+
+    def record(self, event: str, user: Optional[str] = None, **fields) -> None:
+        """Queue one audit record; returns without waiting for the disk."""
+        entry = {"ts": round(time.time(), 3), "event": event, "user": user.strip().lower() if user else None}
+        entry.update((name, value) for name, value in fields.items() if value is not None)
+        self._logger.info(event, extra={"audit": entry})
+
+    def flush(self) -> None:
+        """Wait until every queued record is written."""
+        if not self._closed:
+            self._listener.stop()
+            self._listener.start()
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._listener.stop()
+            self.handler.close()
+
+    def query(self, user: Optional[str] = None, event: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None) -> Iterator[Dict]:
+        """Records matching every given filter, oldest segment first."""
+        return query(self.directory, user, event, since, until)
+
+
+def _segment_matches(entry: Dict, user: Optional[str], event: Optional[str],
+                     since: Optional[float], until: Optional[float]) -> bool:
+    if since is not None and entry["end"] < since:
+        return False
+    if until is not None and entry["start"] > until:
+        return False
+    if user is not None:
+        events = entry["users"].get(user)
+        return events is not None and (event is None or event in events)
+    return event is None or event in entry["events"]
+
+
+def _read_lines(path: str) -> Iterator[Dict]:
+    opener = gzip.open if path.endswith('.gz') else open
+    try:
+        with opener(path, 'rb') as f:
+            for line in f:
+                if line.endswith(b'\n'):
+                    yield json.loads(line)
+    except FileNotFoundError:
+        return  # sealed or removed meanwhile
+
+
+def query(directory: str, user: Optional[str] = None, event: Optional[str] = None,
+          since: Optional[float] = None, until: Optional[float] = None) -> Iterator[Dict]:
+    """
+    Read matching audit records from a directory.
+
+    Only indexed segments whose users, events and time range can match are
+    opened; sealed files not indexed yet and current.jsonl are scanned.
+
+    Args:
+        directory (str): Audit directory
+        user (str): Only records of this user
+        event (str): Only records of this event
+        since (float): Only records at or after this epoch time
+        until (float): Only records at or before this epoch time
+    """
+    user = user.strip().lower() if user else None
+    index = load_index(directory)
+    paths = [os.path.join(directory, name)
+             for name, entry in sorted(index.items(), key=lambda item: item[1]["start"])
+             if _segment_matches(entry, user, event, since, until)]
+    paths += sorted(glob.glob(os.path.join(directory, 'sealed-*.jsonl')))
+    paths.append(os.path.join(directory, CURRENT_FILE))
+    metrics.increment('audit.query_files', len(paths))
+    for path in paths:
+        for item in _read_lines(path):
+            if user is not None and item.get("user") != user:
+                continue
+            if event is not None and item["event"] != event:
+                continue
+            if since is not None and item["ts"] < since:
+                continue
+            if until is not None and item["ts"] > until:
+                continue
+            yield item
+
+
+_audit_log: Optional[AuditLog] = None
+_configured = False
+
+
+def configure(directory: Optional[str] = 'audit', **options) -> Optional[AuditLog]:
+    """Send record() to an AuditLog in directory (None or '' turns auditing off)."""
+    global _audit_log, _configured
+    if _audit_log is not None:
+        _audit_log.close()
+    _audit_log = AuditLog(directory, **options) if directory else None
+    _configured = True
+    return _audit_log
+
+
+def record(event: str, user: Optional[str] = None, **fields) -> None:
+    """Record an audit event in the configured audit log (see configure)."""
+    if not _configured:
+        configure(os.environ.get('NAITEVARNASSE_AUDIT_DIR', 'audit'))
+    if _audit_log is not None:
+        _audit_log.record(event, user, **fields)
+
+
+def flush() -> None:
+    if _audit_log is not None:
+        _audit_log.flush()
+
+
+@atexit.register
+def _close() -> None:
+    if _audit_log is not None:
+        _audit_log.close()
+
+
+_logging_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging(log_file: str = 'users.log', level: int = logging.INFO) -> None:
+    """
+    Send the application log to log_file through a background writer thread.
+
+    Replaces logging.basicConfig in the modules, which only took effect for
+    whichever module called it first. Like basicConfig it does nothing if
+    the root logger already has handlers.
+    """
+    global _logging_listener
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    file_handler = logging.FileHandler(log_file)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    log_queue = queue.Queue()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+    _logging_listener = logging.handlers.QueueListener(log_queue, file_handler)
+    _logging_listener.start()
+    atexit.register(_logging_listener.stop)
+
+
+def _parse_time(value: str) -> float:
+    """'7d', '12h', '30m' before now, or an ISO date/time."""
+    match = re.fullmatch(r'(\d+)([dhm])', value)
+    if match:
+        unit = {'d': 'days', 'h': 'hours', 'm': 'minutes'}[match.group(2)]
+        return (datetime.now() - timedelta(**{unit: int(match.group(1))})).timestamp()
+    return datetime.fromisoformat(value).timestamp()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dir', default=os.environ.get('NAITEVARNASSE_AUDIT_DIR') or 'audit')
+    parser.add_argument('--user')
+    parser.add_argument('--event')
+    parser.add_argument('--since', type=_parse_time, help="e.g. 7d, 12h or 2024-05-01")
+    parser.add_argument('--until', type=_parse_time)
+    parser.add_argument('--json', action='store_true', help="print raw JSON lines")
+    args = parser.parse_args(argv)
+
+    for item in query(args.dir, args.user, args.event, args.since, args.until):
+        if args.json:
+            print(json.dumps(item))
+            continue
+        extra = ' '.join(f'{k}={v}' for k, v in item.items() if k not in ('ts', 'event', 'user'))
+        when = datetime.fromtimestamp(item["ts"]).isoformat(sep=' ', timespec='seconds')
+        print(f"{when}  {item['event']:<20} {item['user'] or '-':<16} {extra}".rstrip())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
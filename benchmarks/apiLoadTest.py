@@ -0,0 +1,228 @@
+"""
+Load test for the HTTP API server.
+
+Starts api.httpServer on a free localhost port with fresh data directories,
+signs up and logs in --users users, then has every user issue a mix of vault
+requests (get, list, search, add) over its own keep-alive connection for
+--duration seconds. Optional --login-storm threads keep calling /login with
+wrong passwords at the same time, to show that failed logins do not hold up
+session requests. Once the login limiter locks the storm's users and its
+source address, further attempts are answered with 429 without any KDF
+work; both kinds of reply are reported:
+
+    python -m benchmarks.apiLoadTest --users 16 --duration 10 --login-storm 4
+
+Run from the repository root. Reports throughput and p50/p90/p99 latency
+per request type; exits non-zero if any request failed unexpectedly.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from tabulate import tabulate
+
+from benchmarks.benchmarkSuite import summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'Load-Test-Passw0rd!x'
+# Share of each request type in the session workload
+MIX = (('get', 0.4), ('list', 0.2), ('search', 0.2), ('add', 0.2))
+
+
+class Client:
+    """One keep-alive connection to the server."""
+
+    def __init__(self, host: str, port: int):
+        self.connection = http.client.HTTPConnection(host, port, timeout=60)
+        self.token: Optional[str] = None
+
+    def call(self, method: str, path: str, body: Optional[Dict] = None) -> Tuple[int, Dict]:
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        self.connection.request(method, path, json.dumps(body).encode() if body is not None else None, headers)
+        response = self.connection.getresponse()
+        return response.status, json.loads(response.read() or b'{}')
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def start_server(data_dir: str, kdf_workers: Optional[int]) -> Tuple[subprocess.Popen, int]:
+    """Run the server in its own process, so client threads do not share its GIL."""
+    command = [sys.executable, '-m', 'api.httpServer', '--port', '0',
+               '--users-dir', os.path.join(data_dir, 'users'),
+               '--users-file', os.path.join(data_dir, 'users.json'),
+               '--vault-dir', os.path.join(data_dir, 'userApps')]
+    if kdf_workers:
+        command += ['--kdf-workers', str(kdf_workers)]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    process = subprocess.Popen(command, cwd=data_dir, env=env, stderr=subprocess.PIPE)
+    line = process.stderr.readline().decode()
+    match = re.search(r':(\d+)$', line.strip())
+    if not match:
+        process.kill()
+        raise RuntimeError(f"API server did not start: {line}")
+    return process, int(match.group(1))
+
+
+def session_worker(client: Client, username: str, deadline: float, seed: int,
+                   latencies: Dict[str, List[float]], errors: List[str]) -> None:
+    rng = random.Random(seed)
+    services = []
+    kinds, weights = zip(*MIX)
+    while time.perf_counter() < deadline:
+        kind = rng.choices(kinds, weights)[0] if services else 'add'
+        if kind == 'add':
+            service = f"service-{len(services)}.example.com"
+            request = ('PUT', '/vault/item', {"service": service, "username": username,
+                                              "password": f"pw-{rng.random()}", "email": f"{username}@example.com"})
+            services.append(service)
+        elif kind == 'get':
+            request = ('GET', f'/vault/item?service={rng.choice(services)}&username={username}', None)
+        elif kind == 'list':
+            request = ('GET', '/vault?page_size=20', None)
+        else:
+            request = ('GET', f'/vault/search?q={rng.choice(services)[:9]}', None)
+        start = time.perf_counter()
+        status, reply = client.call(*request)
+        latencies[kind].append(time.perf_counter() - start)
+        if status >= 400:
+            errors.append(f"{kind} {username}: {status} {reply}")
+    client.close()
+
+
+def login_storm_worker(port: int, usernames: List[str], deadline: float, latencies: List[float],
+                       locked_latencies: List[float], rejected: List[int], errors: List[str]) -> None:
+    client = Client('127.0.0.1', port)
+    i = 0
+    while time.perf_counter() < deadline:
+        # A fresh wrong password each time, so the server's derived-key cache never hits
+        guess = {"username": usernames[i % len(usernames)], "password": f"{PASSWORD}-{i}-{random.random()}"}
+        start = time.perf_counter()
+        status, reply = client.call('POST', '/login', guess)
+        if status == 503:
+            rejected.append(1)
+            time.sleep(0.05)
+        elif status == 401:
+            latencies.append(time.perf_counter() - start)
+        elif status == 429:
+            locked_latencies.append(time.perf_counter() - start)
+        else:
+            errors.append(f"login storm: {status} {reply}")
+        i += 1
+    client.close()
+
+
+def run(users: int, duration: float, login_storm: int, kdf_workers: Optional[int], seed: int) -> Dict:
+    data_dir = tempfile.mkdtemp(prefix='naitevarnasse-api-')
+    process, port = start_server(data_dir, kdf_workers)
+    try:
+        usernames = [f"loaduser{i:03d}" for i in range(users)]
+        setup = Client('127.0.0.1', port)
+        signup_latencies = []
+        for username in usernames:
+            start = time.perf_counter()
+            status, reply = setup.call('POST', '/signup', {"username": username, "password": PASSWORD,
+                                                           "email": f"{username}@example.com"})
+            signup_latencies.append(time.perf_counter() - start)
+            if status != 201:
+                raise RuntimeError(f"signup failed: {status} {reply}")
+        setup.close()
+
+        # Log everyone in first; the storm locks out the shared source address
+        clients = []
+        for username in usernames:
+            client = Client('127.0.0.1', port)
+            status, reply = client.call('POST', '/login', {"username": username, "password": PASSWORD})
+            if status != 200:
+                raise RuntimeError(f"login failed: {status} {reply}")
+            client.token = reply["token"]
+            clients.append(client)
+
+        latencies: Dict[str, List[float]] = {kind: [] for kind, _ in MIX}
+        login_latencies: List[float] = []
+        locked_latencies: List[float] = []
+        rejected: List[int] = []
+        errors: List[str] = []
+        deadline = time.perf_counter() + duration
+        threads = [threading.Thread(target=session_worker,
+                                    args=(clients[i], username, deadline, seed + i, latencies, errors))
+                   for i, username in enumerate(usernames)]
+        threads += [threading.Thread(target=login_storm_worker,
+                                     args=(port, usernames, deadline, login_latencies, locked_latencies,
+                                           rejected, errors))
+                    for _ in range(login_storm)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    results = [summarize('signup', signup_latencies)]
+    if login_latencies:
+        results.append(summarize('failed login (storm)', login_latencies))
+    if locked_latencies:
+        results.append(summarize('locked out login (storm)', locked_latencies))
+    for kind, samples in latencies.items():
+        if samples:
+            results.append(summarize(kind, samples))
+    all_session = [s for samples in latencies.values() for s in samples]
+    if all_session:
+        results.append(summarize('all session requests', all_session))
+    return {
+        "users": users,
+        "duration_s": round(elapsed, 2),
+        "login_storm_threads": login_storm,
+        "session_requests": len(all_session),
+        "session_requests_per_second": round(len(all_session) / elapsed, 1),
+        "logins_rejected_503": len(rejected),
+        "logins_locked_429": len(locked_latencies),
+        "errors": errors[:20],
+        "error_count": len(errors),
+        "results": results,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=16, help="concurrent users, one connection each")
+    parser.add_argument('--duration', type=float, default=10, help="seconds of session traffic")
+    parser.add_argument('--login-storm', type=int, default=0, help="extra threads calling /login throughout")
+    parser.add_argument('--kdf-workers', type=int, help="passed to the server")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help="also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    report = run(args.users, args.duration, args.login_storm, args.kdf_workers, args.seed)
+    columns = ("name", "samples", "p50_ms", "p90_ms", "p99_ms", "max_ms")
+    print(tabulate([[r[c] for c in columns] for r in report["results"]], headers=columns))
+    print(f"\n{report['session_requests']} session requests from {report['users']} users in "
+          f"{report['duration_s']} s: {report['session_requests_per_second']} req/s; "
+          f"{report['logins_rejected_503']} logins rejected with 503, "
+          f"{report['logins_locked_429']} locked out with 429")
+    for error in report["errors"]:
+        print(f"error: {error}", file=sys.stderr)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if report["error_count"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,335 @@
+"""
+Benchmark suite for the KDF, crypto, storage and validation hot paths.
+
+Builds synthetic vaults and user stores of each requested size, measures
+latency percentiles and throughput for login, vault open, encrypt/decrypt,
+add, delete, display, search, validate and generate, and writes the results
+as JSON so runs can be compared across commits with compareResults:
+
+    python -m benchmarks.benchmarkSuite --sizes 1 100 1000 10000 --out before.json
+    python -m benchmarks.benchmarkSuite --sizes 1 100 1000 10000 --out after.json
+    python -m benchmarks.compareResults before.json after.json
+
+Run from the repository root. All data is generated from --seed, so two
+runs with the same arguments do the same work.
+"""
+import argparse
+import base64
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+from cryptography.fernet import Fernet
+from tabulate import tabulate
+
+from audit import auditLog
+from user.keyDerivation import key_cache, derive_key, key_check, new_kdf_params, MIN_ITERATIONS
+from user.passwordGenerator import PasswordGenerator
+from user.userHandling import UserHandling
+from vault.vaultManager import VaultManager, STORAGE_BACKENDS, VAULT_COLUMNS
+
+BENCH_USER = 'benchuser'
+BENCH_PASSWORD = 'Bench-Master-Passw0rd!'
+SCHEMA_VERSION = 1
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of already sorted samples."""
+    return samples[max(0, min(len(samples) - 1, math.ceil(fraction * len(samples)) - 1))]
+
+
+def summarize(name: str, samples: List[float], ops_per_sample: int = 1, **labels) -> Dict:
+    """Latency percentiles (milliseconds per sample) and throughput (ops/s)."""
+    samples = sorted(samples)
+    total = sum(samples)
+    return {
+        "name": name,
+        **labels,
+        "samples": len(samples),
+        "ops_per_sample": ops_per_sample,
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 4),
+        "p90_ms": round(percentile(samples, 0.90) * 1000, 4),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 4),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 4),
+        "min_ms": round(samples[0] * 1000, 4),
+        "max_ms": round(samples[-1] * 1000, 4),
+        "ops_per_second": round(len(samples) * ops_per_sample / total, 1) if total else None,
+    }
+
+
+def measure(fn: Callable[[int], None], repeat: int, warmup: int = 1) -> List[float]:
+    """Time repeat calls of fn(i), after warmup untimed calls."""
+    for i in range(warmup):
+        fn(-1 - i)
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+class SyntheticData:
+    """Deterministic service names, usernames and passwords."""
+
+    def __init__(self, seed: int):
+        self.random = random.Random(seed)
+        self.words = [
+            ''.join(self.random.choices(string.ascii_lowercase, k=self.random.randint(4, 9)))
+            for _ in range(2000)
+        ]
+
+    def credential(self, i: int) -> Dict:
+        return {
+            "service": f"{self.random.choice(self.words)}-{self.random.choice(self.words)}.com",
+            "username": f"{self.random.choice(self.words)}{i}",
+            "password": self.password(),
+            "email": f"{self.random.choice(self.words)}{i}@example.com",
+        }
+
+    def password(self) -> str:
+        """A mix of weak, dictionary-like and strong passwords."""
+        kind = self.random.random()
+        if kind < 0.3:
+            return self.random.choice(self.words) + str(self.random.randint(0, 9999))
+        if kind < 0.5:
+            return self.random.choice(self.words).capitalize() + '!' + str(self.random.randint(10, 99))
+        alphabet = string.ascii_letters + string.digits + '!@#$%^&*'
+        return ''.join(self.random.choices(alphabet, k=self.random.randint(12, 20)))
+
+
+def build_user_store(directory: str, size: int, iterations: int) -> UserHandling:
+    """
+    A user store with size users, one of which (BENCH_USER) can log in.
+
+    The users are written as a legacy users.json so UserStore imports them
+    in one pass instead of one signup at a time.
+    """
+    params = new_kdf_params(iterations)
+    params["key_check"] = key_check(derive_key(BENCH_PASSWORD, base64.b64decode(params["salt"]), iterations))
+    users = {BENCH_USER: {"email": f"{BENCH_USER}@example.com", "kdf": params}}
+    for i in range(size - 1):
+        users[f"user{i}"] = {"email": f"user{i}@example.com", "kdf": dict(params, key_check='0' * 64)}
+    legacy_file = os.path.join(directory, 'users.json')
+    with open(legacy_file, 'w') as f:
+        json.dump({"users": users}, f)
+    return UserHandling(
+        users_file=legacy_file,
+        users_dir=os.path.join(directory, 'users'),
+        breach_corpus_file=None
+    )
+
+
+def build_vault(directory: str, size: int, storage: str, data: SyntheticData) -> VaultManager:
+    """An open vault holding size synthetic credentials."""
+    vault_manager = VaultManager(Fernet.generate_key().decode(), BENCH_USER,
+                                 base_dir=directory, storage=storage)
+    fernet = vault_manager.fernet
+    records = []
+    for i in range(size):
+        cred = data.credential(i)
+        cred["password"] = fernet.encrypt(cred["password"].encode()).decode()
+        cred["email"] = fernet.encrypt(cred["email"].encode()).decode()
+        records.append(cred)
+    vault_manager.storage.put_many(records)
+    return vault_manager
+
+
+def bench_users(size: int, args, data: SyntheticData) -> List[Dict]:
+    results = []
+    directory = tempfile.mkdtemp(prefix='bench-users-')
+    try:
+        handler = build_user_store(directory, size, args.kdf_iterations)
+        labels = {"size": size, "storage": "users"}
+
+        def login(_):
+            key_cache.clear()
+            assert handler.verify_login(BENCH_USER, BENCH_PASSWORD) is not None
+
+        results.append(summarize("login", measure(login, args.kdf_repeat), **labels))
+        results.append(summarize(
+            "login_cached", measure(lambda _: handler.verify_login(BENCH_USER, BENCH_PASSWORD), args.repeat),
+            **labels
+        ))
+        results.append(summarize(
+            "user_lookup", measure(lambda i: handler.store.get_user(f"user{abs(i) % max(size - 1, 1)}"), args.repeat),
+            **labels
+        ))
+    finally:
+        key_cache.clear()
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def bench_crypto(args, data: SyntheticData) -> List[Dict]:
+    results = []
+    directory = tempfile.mkdtemp(prefix='bench-crypto-')
+    try:
+        labels = {"size": 0, "storage": "-"}
+
+        def open_vault(_):
+            key_cache.clear()
+            VaultManager(BENCH_PASSWORD, BENCH_USER, base_dir=directory).close()
+
+        results.append(summarize("open_vault_passphrase", measure(open_vault, args.kdf_repeat), **labels))
+
+        fernet = Fernet(Fernet.generate_key())
+        plaintexts = [data.password().encode() for _ in range(args.repeat)]
+        tokens = [fernet.encrypt(p) for p in plaintexts]
+        results.append(summarize("encrypt", measure(lambda i: fernet.encrypt(plaintexts[i]), args.repeat), **labels))
+        results.append(summarize("decrypt", measure(lambda i: fernet.decrypt(tokens[i]), args.repeat), **labels))
+    finally:
+        key_cache.clear()
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def bench_vault(size: int, storage: str, args, data: SyntheticData) -> List[Dict]:
+    results = []
+    directory = tempfile.mkdtemp(prefix='bench-vault-')
+    vault_manager = None
+    try:
+        vault_manager = build_vault(directory, size, storage, data)
+        labels = {"size": size, "storage": storage}
+        new = [data.credential(size + i) for i in range(args.ops)]
+
+        def add(i):
+            if i >= 0:
+                cred = new[i]
+                assert vault_manager.add_credentials(cred["username"], cred["password"], cred["email"], cred["service"])
+
+        def delete(i):
+            if i >= 0:
+                assert vault_manager.delete_credentials(new[i]["service"], new[i]["username"])
+
+        results.append(summarize("add", measure(add, args.ops), **labels))
+        results.append(summarize("delete", measure(delete, args.ops), **labels))
+
+        page_size = 20
+        pages = max(1, -(-size // page_size))
+
+        def display(i):
+            vault_manager.field_cache.wipe()  # measure the decrypting path, not cache hits
+            rows, _ = vault_manager.get_page(abs(i) * 7 % pages, page_size)
+            tabulate(rows, headers=list(VAULT_COLUMNS), tablefmt="grid")
+
+        results.append(summarize("display_page", measure(display, args.repeat), **labels))
+
+        vault_manager.search_index  # built once, outside the timed loop
+        queries = [data.random.choice(data.words)[:data.random.randint(3, 6)] for _ in range(args.repeat + 1)]
+        results.append(summarize("search", measure(lambda i: vault_manager.search_index.search(queries[i]), args.repeat), **labels))
+    finally:
+        if vault_manager is not None:
+            vault_manager.close()
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def bench_passwords(args, data: SyntheticData) -> List[Dict]:
+    results = []
+    directory = tempfile.mkdtemp(prefix='bench-passwords-')
+    try:
+        validator = UserHandling(
+            users_file=None, users_dir=os.path.join(directory, 'users'), breach_corpus_file=None
+        ).password_validator
+        labels = {"size": args.batch, "storage": "-"}
+        passwords = [data.password() for _ in range(args.batch)]
+
+        results.append(summarize("validate", measure(lambda i: validator.validate(passwords[i % len(passwords)]), args.repeat), size=1, storage="-"))
+        results.append(summarize(
+            "validate_many", measure(lambda _: validator.validate_many(passwords), max(3, args.repeat // 100)),
+            ops_per_sample=len(passwords), **labels
+        ))
+        generator = PasswordGenerator(validator, length=(12, 16))
+        results.append(summarize(
+            "generate", measure(lambda _: generator.generate(args.batch), max(3, args.repeat // 100)),
+            ops_per_sample=args.batch, **labels
+        ))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(args) -> Dict:
+    data = SyntheticData(args.seed)
+    results = bench_crypto(args, data) + bench_passwords(args, data)
+    for size in args.sizes:
+        results.extend(bench_users(size, args, data))
+        for storage in args.storage:
+            print(f"  {storage} vault, {size} entries...", file=sys.stderr)
+            results.extend(bench_vault(size, storage, args, data))
+    return {
+        "schema": SCHEMA_VERSION,
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+
+
+def scaling_table(report: Dict, metric: str = 'p50_ms') -> str:
+    """One row per benchmark/storage, one column per data size."""
+    sizes = sorted({r["size"] for r in report["results"]})
+    rows: Dict = {}
+    for r in report["results"]:
+        rows.setdefault((r["name"], r["storage"]), {})[r["size"]] = r[metric]
+    table = [[name, storage] + [cells.get(size, '') for size in sizes]
+             for (name, storage), cells in rows.items()]
+    return tabulate(table, headers=['Benchmark', 'Storage'] + [str(s) for s in sizes], tablefmt="grid")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1, 100, 1000, 10000],
+                        help="vault and user store sizes (1 to 100000)")
+    parser.add_argument('--storage', nargs='+', default=['json', 'journal', 'sqlite'], choices=list(STORAGE_BACKENDS))
+    parser.add_argument('--repeat', type=int, default=200, help="samples per fast benchmark")
+    parser.add_argument('--ops', type=int, default=20, help="adds/deletes per vault size")
+    parser.add_argument('--kdf-repeat', type=int, default=5, help="samples per KDF-bound benchmark")
+    parser.add_argument('--kdf-iterations', type=int, default=MIN_ITERATIONS)
+    parser.add_argument('--batch', type=int, default=1000, help="passwords per validate_many/generate call")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', default='benchmark-results.json')
+    args = parser.parse_args(argv)
+    if any(not 1 <= size <= 100000 for size in args.sizes):
+        parser.error("sizes must be between 1 and 100000")
+
+    # Keep the modules' INFO logging and audit records out of the timings and the working directory
+    logging.basicConfig(handlers=[logging.NullHandler()], level=logging.WARNING)
+    auditLog.configure(None)
+
+    report = run(args)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(scaling_table(report))
+    print(f"Wrote {len(report['results'])} results to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
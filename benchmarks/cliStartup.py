@@ -0,0 +1,82 @@
+"""
+Startup-time benchmark for the command-line entry point.
+
+Times fresh interpreter runs of cli.py commands that need no vault, compares
+them with a bare interpreter and with importing main.py, and lists the
+slowest imports of each command (python -X importtime):
+
+    python -m benchmarks.cliStartup --runs 20
+
+Run from the repository root.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = {
+    'python': ['-c', 'pass'],
+    'import main': ['-c', 'import main'],
+    'cli --help': ['cli.py', '--help'],
+    'cli gen': ['cli.py', 'gen'],
+    'cli check': ['cli.py', 'check', '--breach-corpus', ''],
+}
+
+
+def time_command(args: List[str], runs: int, stdin: bytes = b'') -> List[float]:
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=ROOT, input=stdin,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def slowest_imports(args: List[str], top: int, stdin: bytes = b'') -> List[Dict]:
+    """The top cumulative import times (microseconds) reported by -X importtime."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', *args], cwd=ROOT, input=stdin,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    imports = []
+    for line in result.stderr.decode(errors='replace').splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):  # top-level imports only
+            imports.append({"module": name.strip(), "cumulative_us": int(cumulative)})
+    return sorted(imports, key=lambda i: i["cumulative_us"], reverse=True)[:top]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--top', type=int, default=5, help="slowest imports listed per command")
+    parser.add_argument('--out', help="also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    stdin = b'Correct-Horse-Battery-9\n'
+    results = {}
+    for name, command in COMMANDS.items():
+        samples = sorted(time_command(command, args.runs, stdin))
+        results[name] = {
+            "median_ms": round(statistics.median(samples) * 1000, 1),
+            "min_ms": round(samples[0] * 1000, 1),
+            "imports": slowest_imports(command, args.top, stdin),
+        }
+        print(f"{name:12} median {results[name]['median_ms']:7.1f} ms   min {results[name]['min_ms']:7.1f} ms")
+        for entry in results[name]["imports"]:
+            print(f"{'':14}{entry['module']:36} {entry['cumulative_us'] / 1000:7.1f} ms")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
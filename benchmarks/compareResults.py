@@ -0,0 +1,72 @@
+"""
+Compare two benchmarkSuite result files.
+
+Matches results by (benchmark, storage, size) and reports the change in a
+latency metric, flagging anything slower than the threshold:
+
+    python -m benchmarks.compareResults before.json after.json --threshold 10
+
+Exits with 1 when --fail-on-regression is given and a regression is found.
+"""
+import argparse
+import json
+import sys
+from typing import Dict, List, Tuple
+
+from tabulate import tabulate
+
+
+def _load(path: str) -> Dict[Tuple, Dict]:
+    with open(path, 'r') as f:
+        report = json.load(f)
+    return {(r["name"], r["storage"], r["size"]): r for r in report["results"]}
+
+
+def compare(baseline: Dict[Tuple, Dict], current: Dict[Tuple, Dict], metric: str = 'p50_ms',
+            threshold: float = 10.0) -> Tuple[List[List], int]:
+    """
+    Build comparison rows and count regressions.
+
+    Args:
+        baseline: Results of the reference run
+        current: Results of the run being checked
+        metric (str): Latency field to compare
+        threshold (float): Percent slowdown reported as a regression
+    """
+    rows = []
+    regressions = 0
+    for key in sorted(baseline.keys() | current.keys(), key=lambda k: (k[0], k[1], k[2])):
+        before = baseline.get(key, {}).get(metric)
+        after = current.get(key, {}).get(metric)
+        if before is None or after is None:
+            rows.append([*key, before, after, '', 'only in ' + ('baseline' if after is None else 'current')])
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        status = ''
+        if change > threshold:
+            status = 'REGRESSION'
+            regressions += 1
+        elif change < -threshold:
+            status = 'improved'
+        rows.append([*key, before, after, f"{change:+.1f}%", status])
+    return rows, regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--metric', default='p50_ms', choices=['p50_ms', 'p90_ms', 'p99_ms', 'mean_ms', 'min_ms'])
+    parser.add_argument('--threshold', type=float, default=10.0, help="percent slowdown counted as a regression")
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args(argv)
+
+    rows, regressions = compare(_load(args.baseline), _load(args.current), args.metric, args.threshold)
+    headers = ['Benchmark', 'Storage', 'Size', f'Before {args.metric}', f'After {args.metric}', 'Change', '']
+    print(tabulate(rows, headers=headers, tablefmt="grid"))
+    print(f"{regressions} regression(s) above {args.threshold}%")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""
+Delta-sync cost benchmark.
+
+Creates two replicas of one vault with --size entries and a directory sync
+server, runs the initial full sync, then measures what a one-record edit,
+a one-record delete and a no-op cost to push from replica A and pull into
+replica B: protocol messages, bytes exchanged and records transferred:
+
+    python -m benchmarks.syncDelta --size 50000
+
+Run from the repository root.
+"""
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from cryptography.fernet import Fernet
+from tabulate import tabulate
+
+from audit import auditLog
+from benchmarks.benchmarkSuite import SyntheticData
+from vault.sync import DirectorySyncServer, VaultReplica
+from vault.vaultManager import VaultManager, STORAGE_BACKENDS
+
+
+def timed_sync(replica: VaultReplica, server, step: str, side: str) -> Dict:
+    start = time.perf_counter()
+    result = replica.sync(server)
+    return {"step": step, "replica": side, **result, "records": result["pulled"] + result["pushed"],
+            "seconds": round(time.perf_counter() - start, 3)}
+
+
+def run(size: int, storage: str, seed: int) -> List[Dict]:
+    directory = tempfile.mkdtemp(prefix='bench-sync-')
+    try:
+        key = Fernet.generate_key().decode()
+        data = SyntheticData(seed)
+        vault_a = VaultManager(key, 'syncuser', base_dir=f'{directory}/a', storage=storage)
+        vault_b = VaultManager(key, 'syncuser', base_dir=f'{directory}/b', storage=storage)
+        vault_a.store_credentials([data.credential(i) for i in range(size)])
+        server = DirectorySyncServer(f'{directory}/server')
+        replica_a, replica_b = VaultReplica(vault_a), VaultReplica(vault_b)
+
+        results = [timed_sync(replica_a, server, 'initial', 'A'), timed_sync(replica_b, server, 'initial', 'B')]
+
+        first = next(vault_a.storage.iter_credentials(size // 2, 1))
+        vault_a.add_credentials(first["username"], 'Edited-Passw0rd!', 'edited@example.com', first["service"])
+        results += [timed_sync(replica_a, server, 'edit 1', 'A'), timed_sync(replica_b, server, 'edit 1', 'B')]
+        assert vault_b.get_credentials(first["service"], first["username"])["password"] == 'Edited-Passw0rd!'
+
+        second = next(vault_a.storage.iter_credentials(0, 1))
+        vault_a.delete_credentials(second["service"], second["username"])
+        results += [timed_sync(replica_a, server, 'delete 1', 'A'), timed_sync(replica_b, server, 'delete 1', 'B')]
+        assert vault_b.get_credentials(second["service"], second["username"]) is None
+
+        results += [timed_sync(replica_a, server, 'no change', 'A'), timed_sync(replica_b, server, 'no change', 'B')]
+        server.close()
+        vault_a.close()
+        vault_b.close()
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=50000)
+    parser.add_argument('--storage', default='binary', choices=list(STORAGE_BACKENDS))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help="also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    auditLog.configure(None)  # keep audit records out of the working directory
+    results = run(args.size, args.storage, args.seed)
+    columns = ("step", "replica", "local_changes", "pushed", "pulled", "messages", "bytes", "seconds")
+    print(tabulate([[r[c] for c in columns] for r in results], headers=columns))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({"size": args.size, "storage": args.storage, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""
+Concurrent-writer stress test for the vault storage engines.
+
+Runs N processes x M threads that all add (and then delete a share of)
+credentials in the same vault, checks that no update was lost, and
+compares throughput with and without group commit:
+
+    python -m benchmarks.vaultWriteStress --processes 4 --threads 8 --ops 50
+
+Run from the repository root. Exits non-zero if any update was lost.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from vault.storage import JsonStorage
+from vault.journalStorage import JournalStorage
+from vault.sqliteStorage import SQLiteStorage
+
+ENGINES = {
+    'json': (JsonStorage, 'vault.json'),
+    'journal': (JournalStorage, 'vault.journal'),
+    'sqlite': (SQLiteStorage, 'vault.db'),
+}
+
+
+def _open(engine: str, path: str, group_commit: bool):
+    storage_class = ENGINES[engine][0]
+    if storage_class is SQLiteStorage:
+        return storage_class(path)
+    return storage_class(path, group_commit=group_commit)
+
+
+def _writer_process(engine: str, path: str, group_commit: bool, process_id: int,
+                    threads: int, ops: int, delete_every: int) -> None:
+    storage = _open(engine, path, group_commit)
+
+    def writer(thread_id: int) -> None:
+        for i in range(ops):
+            service = f"svc-{process_id}-{thread_id}-{i}"
+            storage.put({"service": service, "username": "user", "password": "x" * 100, "email": "y" * 100})
+            if delete_every and i % delete_every == 0:
+                storage.delete(service, "user")
+
+    workers = [threading.Thread(target=writer, args=(t,)) for t in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    storage.close()
+
+
+def run(engine: str, processes: int, threads: int, ops: int, group_commit: bool,
+        delete_every: int = 5) -> dict:
+    """Run one stress round and return throughput and lost-update counts."""
+    directory = tempfile.mkdtemp(prefix='vault-stress-')
+    path = os.path.join(directory, ENGINES[engine][1])
+    try:
+        _open(engine, path, group_commit).close()
+        start = time.perf_counter()
+        workers = [
+            multiprocessing.Process(
+                target=_writer_process,
+                args=(engine, path, group_commit, p, threads, ops, delete_every)
+            )
+            for p in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        deleted_per_thread = len(range(0, ops, delete_every)) if delete_every else 0
+        expected = processes * threads * (ops - deleted_per_thread)
+        storage = _open(engine, path, group_commit)
+        actual = len(storage)
+        storage.close()
+        operations = processes * threads * (ops + deleted_per_thread)
+        return {
+            "engine": engine,
+            "group_commit": group_commit,
+            "writers": processes * threads,
+            "operations": operations,
+            "seconds": round(elapsed, 3),
+            "ops_per_second": round(operations / elapsed, 1),
+            "expected_records": expected,
+            "actual_records": actual,
+            "lost_updates": expected - actual,
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=50, help="adds per writer thread")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for engine in args.engines:
+        modes = [True] if engine == 'sqlite' else [False, True]
+        for group_commit in modes:
+            result = run(engine, args.processes, args.threads, args.ops, group_commit)
+            print(
+                f"{engine:8} group_commit={str(group_commit):5} writers={result['writers']:3} "
+                f"{result['ops_per_second']:>9} ops/s  lost={result['lost_updates']}"
+            )
+            failed = failed or result["lost_updates"] != 0
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
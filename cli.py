@@ -0,0 +1,475 @@
+"""
+Scriptable command-line interface to the password manager.
+
+    python cli.py -u alice --password-fd 3 get github.com 3< master.txt
+    printf '%s\\n%s\\n' "$MASTER" "$SECRET" | python cli.py -u alice --password-stdin add example.org bob --secret-stdin
+    python cli.py gen --length 20 --count 5
+    python cli.py check < candidates.txt
+    python cli.py -u alice agent unlock        # later get/add/rm/list skip the KDF
+    python cli.py -u alice passwd              # change the master password
+
+Secrets are never taken from the command line: the master password and new
+credential passwords are read from a file descriptor, from stdin (one line
+each, master password first) or from a terminal prompt.
+
+Only the standard library is imported at startup. The vault, crypto and
+validator modules are imported by the commands that need them, so --help
+and gen never load the vault, and short scripts pay as little as possible
+per call. When a vault agent (vault/agentServer.py) is running and
+unlocked, get/add/rm/list are served by it without a master password.
+"""
+import argparse
+import os
+import sys
+from typing import Optional
+
+EXIT_OK = 0
+EXIT_FAILURE = 1  # not found, invalid password, refused overwrite
+EXIT_USAGE = 2  # argparse's own exit code
+EXIT_AUTH = 3
+
+DEFAULT_BREACH_CORPUS = 'breached_passwords.nvbc'
+
+
+class CliError(Exception):
+    def __init__(self, message: str, code: int = EXIT_FAILURE):
+        super().__init__(message)
+        self.code = code
+
+
+def read_secret(fd: Optional[int] = None, use_stdin: bool = False, prompt: str = 'Password: ') -> str:
+    """
+    Read one secret line from a file descriptor, stdin or the terminal.
+
+    Args:
+        fd (int): Descriptor to read the first line from
+        use_stdin (bool): Read the next line from stdin
+        prompt (str): Prompt for the interactive fallback
+    """
+    if fd is not None:
+        with os.fdopen(fd, 'r', closefd=False) as file:
+            line = file.readline()
+    elif use_stdin:
+        line = sys.stdin.readline()
+    elif sys.stdin.isatty():
+        import getpass
+        return getpass.getpass(prompt)
+    else:
+        raise CliError("no terminal to prompt on; use --password-fd or --password-stdin", EXIT_USAGE)
+    if not line:
+        raise CliError("no secret provided on input", EXIT_USAGE)
+    return line.rstrip('\r\n')
+
+
+def _agent_client(args):
+    from vault.agentClient import AgentClient
+    return AgentClient(args.agent_socket)
+
+
+def agent_for(args):
+    """An AgentClient if an agent is unlocked for args.user (or any user if none is given)."""
+    if args.no_agent:
+        return None
+    from vault.agentClient import AgentError
+    client = _agent_client(args)
+    try:
+        status = client.status()
+    except AgentError:
+        return None
+    if status["locked"]:
+        return None
+    if args.user and args.user.strip().lower() != status["username"].lower():
+        return None
+    return client
+
+
+def _agent_call(method, *params, **options):
+    """Call an AgentClient method, turning agent errors into CLI errors."""
+    from vault.agentClient import AgentError, NOT_FOUND, AUTH_FAILED, BAD_REQUEST
+    try:
+        return method(*params, **options)
+    except AgentError as e:
+        if e.code == AUTH_FAILED:
+            raise CliError(str(e), EXIT_AUTH)
+        if e.code in (NOT_FOUND, BAD_REQUEST):
+            raise CliError(str(e))
+        raise CliError(f"vault agent: {e}")
+
+
+def _login_failure(user_handling, username: str) -> str:
+    retry_after = user_handling.login_limiter.retry_after(username)
+    if retry_after > 0:
+        return f"too many failed logins; try again in {int(retry_after // 60) + 1} minutes"
+    return "invalid username or master password"
+
+
+def login(args):
+    """Check the master password; returns (stored username, vault key)."""
+    if not args.user:
+        raise CliError("no user given; use --user or NAITEVARNASSE_USER", EXIT_USAGE)
+    master_password = read_secret(args.password_fd, args.password_stdin, 'Master password: ')
+
+    from user.userHandling import UserHandling
+
+    user_handling = UserHandling(users_file=args.users_file, users_dir=args.users_dir,
+                                 breach_corpus_file=None)
+    master_key = user_handling.verify_login(args.user, master_password)
+    if master_key is None:
+        raise CliError(_login_failure(user_handling, args.user), EXIT_AUTH)
+    return user_handling.store.get_user(args.user)["username"], master_key
+
+
+def open_vault(args):
+    """Log in with the master password and return an open VaultManager."""
+    username, master_key = login(args)
+    from vault.vaultManager import VaultManager
+    return VaultManager(master_key, username, base_dir=args.vault_dir, storage=args.storage)
+
+
+def _find_credential(vault_manager, service: str, username: Optional[str]):
+    """Decrypted credential for service, resolving a missing username if it is unique."""
+    if username is None:
+        usernames = [c["username"] for c in vault_manager.storage.iter_credentials() if c["service"] == service]
+        if len(usernames) > 1:
+            raise CliError(f"several accounts for {service} ({', '.join(usernames)}); give a username")
+        username = usernames[0] if usernames else ''
+    cred = vault_manager.get_credentials(service, username)
+    if cred is None:
+        raise CliError(f"no credentials for {service}" + (f" / {username}" if username else ''))
+    return cred
+
+
+def cmd_get(args) -> int:
+    agent = agent_for(args)
+    if agent is not None:
+        cred = _agent_call(agent.get, args.service, args.username)
+    else:
+        vault_manager = open_vault(args)
+        try:
+            cred = _find_credential(vault_manager, args.service, args.username)
+        finally:
+            vault_manager.close()
+    value = cred[args.field]
+    sys.stdout.write(value if args.no_newline else value + '\n')
+    return EXIT_OK
+
+
+def _generator(args, validator=None):
+    from user.passwordGenerator import PasswordGenerator
+    length = (args.min_length, args.max_length) if args.min_length else args.length
+    return PasswordGenerator(validator, length=length, exclude_ambiguous=args.no_ambiguous)
+
+
+def _new_password(args) -> str:
+    if args.generate:
+        from user.passwordValidator import PasswordValidator
+        return _generator(args, PasswordValidator()).generate(1)[0]
+    return read_secret(args.secret_fd, args.secret_stdin, 'Service password: ')
+
+
+def cmd_add(args) -> int:
+    agent = agent_for(args)
+    if agent is not None:
+        password = _new_password(args)
+        _agent_call(agent.add, args.service, args.username, password, args.email, args.force)
+        if args.generate:
+            print(password)
+        return EXIT_OK
+
+    vault_manager = open_vault(args)
+    try:
+        if not args.force and vault_manager.storage.get(args.service, args.username) is not None:
+            raise CliError(f"credentials for {args.service} / {args.username} exist; use --force to replace")
+        password = _new_password(args)
+        if not vault_manager.add_credentials(args.username, password, args.email, args.service):
+            raise CliError("failed to add credentials")
+        if args.generate:
+            print(password)
+        return EXIT_OK
+    finally:
+        vault_manager.close()
+
+
+def cmd_rm(args) -> int:
+    agent = agent_for(args)
+    if agent is not None:
+        _agent_call(agent.delete, args.service, args.username)
+        return EXIT_OK
+
+    vault_manager = open_vault(args)
+    try:
+        if not vault_manager.delete_credentials(args.service, args.username):
+            raise CliError(f"no credentials for {args.service} / {args.username}")
+        return EXIT_OK
+    finally:
+        vault_manager.close()
+
+
+def cmd_list(args) -> int:
+    agent = agent_for(args)
+    if agent is not None:
+        keys = [(c["service"], c["username"]) for c in _agent_call(agent.list, args.query, args.limit)]
+    else:
+        vault_manager = open_vault(args)
+        try:
+            if args.query:
+                keys = [(s, u) for s, u, _ in vault_manager.search_index.search(args.query, args.limit)]
+            else:
+                keys = [(c["service"], c["username"]) for c in vault_manager.storage.iter_credentials(0, args.limit)]
+        finally:
+            vault_manager.close()
+    for service, username in keys:
+        print(f"{service}\t{username}")
+    return EXIT_OK
+
+
+def cmd_gen(args) -> int:
+    validator = None
+    if not args.no_validate:
+        from user.passwordValidator import PasswordValidator
+        validator = PasswordValidator()
+    for password in _generator(args, validator).generate(args.count):
+        print(password)
+    return EXIT_OK
+
+
+def cmd_check(args) -> int:
+    from user.passwordValidator import PasswordValidator
+    breach_corpus = None
+    if args.breach_corpus and os.path.exists(args.breach_corpus):
+        from user.breachCorpus import BreachCorpus
+        breach_corpus = BreachCorpus(args.breach_corpus)
+    validator = PasswordValidator(breach_corpus=breach_corpus)
+
+    source = os.fdopen(args.secret_fd, 'r', closefd=False) if args.secret_fd is not None else sys.stdin
+    passwords = [line.rstrip('\r\n') for line in source]
+    failed = 0
+    for number, (is_valid, errors) in enumerate(validator.validate_many(passwords), 1):
+        if not is_valid:
+            failed += 1
+        if not args.quiet:
+            print(f"{number}\t{'ok' if is_valid else 'weak'}\t{'; '.join(errors)}".rstrip('\t'))
+    return EXIT_FAILURE if failed else EXIT_OK
+
+
+def start_agent(args, wait: float = 10.0):
+    """Start a detached agent with this invocation's settings and wait for its socket."""
+    import subprocess
+    import time
+    client = _agent_client(args)
+    if client.is_running():
+        return client
+    command = [
+        sys.executable, '-m', 'vault.agentServer', '--socket', client.path,
+        '--idle-timeout', str(args.idle_timeout), '--users-dir', args.users_dir,
+        '--users-file', args.users_file, '--vault-dir', args.vault_dir, '--storage', args.storage,
+    ]
+    subprocess.Popen(command, cwd=os.getcwd(), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, start_new_session=True,
+                     env={**os.environ, 'PYTHONPATH': os.pathsep.join(
+                         filter(None, [os.path.dirname(os.path.abspath(__file__)), os.environ.get('PYTHONPATH')])
+                     )})
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        if client.is_running():
+            return client
+        time.sleep(0.05)
+    raise CliError("vault agent did not start")
+
+
+def cmd_agent(args) -> int:
+    from vault.agentClient import AgentError
+    client = _agent_client(args)
+    if args.action == 'start':
+        start_agent(args)
+        print(client.path)
+    elif args.action == 'unlock':
+        if not args.user:
+            raise CliError("no user given; use --user or NAITEVARNASSE_USER", EXIT_USAGE)
+        password = read_secret(args.password_fd, args.password_stdin, 'Master password: ')
+        result = _agent_call(start_agent(args).unlock, args.user, password)
+        print(f"Unlocked {result['username']} ({result['entries']} entries)")
+    elif args.action == 'status':
+        try:
+            status = client.status()
+        except AgentError:
+            print("not running")
+            return EXIT_FAILURE
+        state = 'locked' if status["locked"] else f"unlocked for {status['username']} ({status['entries']} entries)"
+        print(f"running, {state}, idle {status['idle_seconds']}s of {status['idle_timeout']}s")
+    elif args.action in ('lock', 'stop'):
+        if not client.is_running():
+            print("not running")
+            return EXIT_FAILURE
+        _agent_call(client.lock if args.action == 'lock' else client.stop)
+    return EXIT_OK
+
+
+def cmd_convert(args) -> int:
+    """Convert the user's vault.json to the binary format or back; the source is kept."""
+    username, master_key = login(args)
+    from vault.binaryStorage import convert_binary_to_json, convert_json_to_binary
+    from vault.vaultManager import STORAGE_BACKENDS
+
+    user_dir = os.path.join(args.vault_dir, username)
+    json_path = os.path.join(user_dir, STORAGE_BACKENDS['json'][1])
+    binary_path = os.path.join(user_dir, STORAGE_BACKENDS['binary'][1])
+    if args.to == 'binary':
+        count = convert_json_to_binary(json_path, binary_path, master_key.encode(), args.cipher)
+        target = binary_path
+    else:
+        count = convert_binary_to_json(binary_path, json_path, master_key.encode())
+        target = json_path
+    print(f"converted {count} credentials to {target}; use --storage {args.to}")
+    return EXIT_OK
+
+
+def cmd_sync(args) -> int:
+    """Exchange changed records with a sync directory (a shared or mounted folder)."""
+    from vault.sync import DirectorySyncServer, VaultReplica
+
+    vault_manager = open_vault(args)
+    server = DirectorySyncServer(args.directory)
+    try:
+        result = VaultReplica(vault_manager).sync(server)
+    finally:
+        server.close()
+        vault_manager.close()
+    print(f"pushed {result['pushed']}, pulled {result['pulled']} in {result['messages']} messages")
+    return EXIT_OK
+
+
+def cmd_passwd(args) -> int:
+    """Change the master password, re-encrypting the vault; rerun with the same passwords to resume."""
+    if not args.user:
+        raise CliError("no user given; use --user or NAITEVARNASSE_USER", EXIT_USAGE)
+    old_password = read_secret(args.password_fd, args.password_stdin, 'Master password: ')
+    new_password = read_secret(args.new_password_fd, args.password_stdin, 'New master password: ')
+    if args.new_password_fd is None and not args.password_stdin:
+        if read_secret(prompt='Repeat new master password: ') != new_password:
+            raise CliError("passwords do not match", EXIT_USAGE)
+
+    from user.userHandling import UserHandling
+    from vault.keyRotation import rotate_master_password
+
+    client = agent_for(args)
+    if client is not None:
+        _agent_call(client.lock)
+    user_handling = UserHandling(users_file=args.users_file, users_dir=args.users_dir,
+                                 breach_corpus_file=None)
+    if user_handling.verify_login(args.user, old_password) is None:
+        raise CliError(_login_failure(user_handling, args.user), EXIT_AUTH)
+    username = user_handling.store.get_user(args.user)["username"]
+    result = rotate_master_password(user_handling, username, old_password, new_password,
+                                    vault_dir=args.vault_dir, storage=args.storage,
+                                    workers=args.workers, use_processes=args.processes)
+    print(f"master password changed; re-encrypted {result['records']} credentials")
+    return EXIT_OK
+
+
+def _add_generator_options(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--length', type=int, default=16)
+    parser.add_argument('--min-length', type=int, help="random length range (with --max-length)")
+    parser.add_argument('--max-length', type=int)
+    parser.add_argument('--no-ambiguous', action='store_true', help="avoid look-alike characters")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='cli.py', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('-u', '--user', default=os.environ.get('NAITEVARNASSE_USER'))
+    secret = parser.add_mutually_exclusive_group()
+    secret.add_argument('--password-fd', type=int, metavar='FD', help="read the master password from FD")
+    secret.add_argument('--password-stdin', action='store_true', help="read the master password from stdin")
+    parser.add_argument('--users-dir', default='users')
+    parser.add_argument('--users-file', default='users.json', help="legacy user file imported on first use")
+    parser.add_argument('--vault-dir', default='userApps')
+    parser.add_argument('--storage', default='json', help="vault storage engine (json, journal, sqlite or binary)")
+    parser.add_argument('--agent-socket', help="vault agent socket (default: per-user runtime directory)")
+    parser.add_argument('--no-agent', action='store_true', help="do not use a running vault agent")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    get = commands.add_parser('get', help="print a stored password (or other field)")
+    get.add_argument('service')
+    get.add_argument('username', nargs='?')
+    get.add_argument('--field', choices=['password', 'email', 'username'], default='password')
+    get.add_argument('-n', '--no-newline', action='store_true')
+    get.set_defaults(handler=cmd_get)
+
+    add = commands.add_parser('add', help="store credentials")
+    add.add_argument('service')
+    add.add_argument('username')
+    add.add_argument('--email', default='')
+    source = add.add_mutually_exclusive_group()
+    source.add_argument('--secret-fd', type=int, metavar='FD', help="read the password from FD")
+    source.add_argument('--secret-stdin', action='store_true', help="read the password from stdin")
+    source.add_argument('--generate', action='store_true', help="generate the password and print it")
+    add.add_argument('--force', action='store_true', help="replace existing credentials")
+    _add_generator_options(add)
+    add.set_defaults(handler=cmd_add)
+
+    rm = commands.add_parser('rm', help="delete credentials")
+    rm.add_argument('service')
+    rm.add_argument('username')
+    rm.set_defaults(handler=cmd_rm)
+
+    list_ = commands.add_parser('list', help="list services and usernames, optionally matching QUERY")
+    list_.add_argument('query', nargs='?')
+    list_.add_argument('--limit', type=int)
+    list_.set_defaults(handler=cmd_list)
+
+    gen = commands.add_parser('gen', help="generate passwords")
+    gen.add_argument('--count', type=int, default=1)
+    gen.add_argument('--no-validate', action='store_true', help="skip the password validator")
+    _add_generator_options(gen)
+    gen.set_defaults(handler=cmd_gen)
+
+    check = commands.add_parser('check', help="validate passwords read one per line from stdin")
+    check.add_argument('--secret-fd', type=int, metavar='FD', help="read passwords from FD instead of stdin")
+    check.add_argument('--breach-corpus', default=DEFAULT_BREACH_CORPUS)
+    check.add_argument('-q', '--quiet', action='store_true', help="only set the exit status")
+    check.set_defaults(handler=cmd_check)
+
+    agent = commands.add_parser('agent', help="control the vault agent (start, unlock, lock, status, stop)")
+    agent.add_argument('action', choices=['start', 'unlock', 'lock', 'status', 'stop'])
+    agent.add_argument('--idle-timeout', type=float, default=900, help="seconds before the agent locks itself")
+    agent.set_defaults(handler=cmd_agent)
+
+    convert = commands.add_parser('convert', help="convert the vault between vault.json and the binary format")
+    convert.add_argument('--to', choices=['binary', 'json'], required=True)
+    convert.add_argument('--cipher', choices=['aes-gcm', 'chacha20-poly1305'], default='aes-gcm')
+    convert.set_defaults(handler=cmd_convert)
+
+    sync = commands.add_parser('sync', help="sync the vault with a sync directory")
+    sync.add_argument('directory')
+    sync.set_defaults(handler=cmd_sync)
+
+    passwd = commands.add_parser('passwd', help="change the master password and re-encrypt the vault")
+    passwd.add_argument('--new-password-fd', type=int, metavar='FD', help="read the new master password from FD")
+    passwd.add_argument('--workers', type=int, default=4, help="re-encryption workers")
+    passwd.add_argument('--processes', action='store_true', help="re-encrypt on processes instead of threads")
+    passwd.set_defaults(handler=cmd_passwd)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.command == 'list' and args.limit is None and args.query:
+        args.limit = 10
+    if getattr(args, 'min_length', None) and not args.max_length:
+        args.max_length = args.min_length
+    try:
+        return args.handler(args)
+    except CliError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return e.code
+    except (ValueError, OSError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_FAILURE
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())
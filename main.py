@@ -1,5 +1,10 @@
+import logging
 from user.userHandling import UserHandling
 from vault.vaultManager import VaultManager
+from vault.transfer import import_credentials, export_credentials
+from vault.healthAudit import audit_vault, format_report
+from vault.keyRotation import rotate_master_password
+from vault.agentClient import AgentClient, AgentError, LOCKED
 
 class PasswordManager:
     def __init__(self):
@@ -7,17 +12,31 @@ class PasswordManager:
         self.vault_manager = None
         self.logged_in = False
         self.current_user = None
+        self.agent = AgentClient()
+
+    def _agent_session(self):
+        """Username of the vault the agent holds unlocked, if any."""
+        try:
+            status = self.agent.status()
+        except AgentError:
+            return None
+        return None if status["locked"] else status["username"]
 
     def main_menu(self):
         while True:
+            agent_user = self._agent_session()
             print("\n=== Password Manager ===")
             print("[S]ignup")
             print("[L]ogin")
+            if agent_user:
+                print(f"[A]gent session ({agent_user})")
             print("[E]xit")
             
             choice = input("Choice: ").lower()
             
-            if choice == 'l':
+            if choice == 'a' and agent_user:
+                self.agent_menu(agent_user)
+            elif choice == 'l':
                 self.login()
             elif choice == 's':
                 self.signup()
@@ -37,14 +56,68 @@ class PasswordManager:
             master_key = self.user_handling.verify_login(username, password)
             if master_key:
                 self.logged_in = True
-                self.current_user = username
-                self.vault_manager = VaultManager(master_key, f'vault_{username}.json')
+                # Use the registered spelling so the vault directory is stable
+                self.current_user = self.user_handling.store.get_user(username)["username"]
+                self.vault_manager = VaultManager(master_key, self.current_user)
+                self._share_with_agent(master_key)
                 self.vault_menu()
                 break
             
+            retry_after = self.user_handling.login_limiter.retry_after(username)
+            if retry_after > 0:
+                print(f"Too many failed logins. Try again in {int(retry_after // 60) + 1} minutes.")
+                break
             attempts -= 1
             print(f"Invalid credentials! {attempts} attempts remaining.")
 
+    def agent_menu(self, agent_user):
+        """Use the vault the agent holds unlocked through its requests; the vault key stays in the agent."""
+        while True:
+            print(f"\n=== Agent Session ({agent_user}) ===")
+            print("[G]et Credentials")
+            print("[L]ist / Search Vault")
+            print("[A]dd New Credentials")
+            print("[R]emove Credentials")
+            print("[B]ack")
+
+            choice = input("Choice: ").lower()
+
+            try:
+                if choice == 'g':
+                    service = input("Service Name: ")
+                    cred = self.agent.get(service, input("Service Username (blank if only one): ") or None)
+                    print(f"Service: {cred['service']}\nUsername: {cred['username']}\n"
+                          f"Password: {cred['password']}\nEmail: {cred['email']}")
+                elif choice == 'l':
+                    entries = self.agent.list(input("Search (blank for all): ").strip() or None)
+                    for entry in entries:
+                        print(f"{entry['service']}  {entry['username']}")
+                    if not entries:
+                        print("No matching credentials.")
+                elif choice == 'a':
+                    self.agent.add(input("Service Name: "), input("Service Username: "),
+                                   input("Service Password: "), input("Service Email: "))
+                    print("Credentials added successfully!")
+                elif choice == 'r':
+                    self.agent.delete(input("Service Name: "), input("Service Username: "))
+                    print("Credentials removed successfully!")
+                elif choice == 'b':
+                    break
+                else:
+                    print("Invalid choice!")
+            except AgentError as e:
+                print(f"Error: {str(e)}")
+                if e.code in (LOCKED, 'unavailable'):
+                    break
+
+    def _share_with_agent(self, master_key):
+        """Hand the derived key to a running agent so CLI calls skip the KDF too."""
+        try:
+            if self.agent.is_running():
+                self.agent.unlock(self.current_user, key=master_key)
+        except AgentError as e:
+            logging.warning(f"Could not unlock vault agent: {str(e)}")
+
     def signup(self):
         user_data = self.user_handling.create_user()
         if user_data:
@@ -54,10 +127,22 @@ class PasswordManager:
 
     def vault_menu(self):
         while self.logged_in:
+            if not self.vault_manager.key_is_current():
+                print("\nThe master password was changed elsewhere. Please log in again.")
+                self.logged_in = False
+                self.current_user = None
+                self.vault_manager.close()
+                self.vault_manager = None
+                break
             print(f"\n=== Vault Menu ({self.current_user}) ===")
             print("[D]isplay Vault")
+            print("[S]earch Vault")
             print("[A]dd New Credentials")
             print("[R]emove Credentials")
+            print("[I]mport Credentials")
+            print("E[x]port Credentials")
+            print("[H]ealth Audit")
+            print("[C]hange Master Password")
             print("[L]ogout")
             print("[E]xit")
             
@@ -65,14 +150,25 @@ class PasswordManager:
             
             try:
                 if choice == 'd':
-                    self.vault_manager.display_vault()
+                    self.browse_vault()
+                elif choice == 's':
+                    self.search_vault()
                 elif choice == 'a':
                     self.add_new_credentials()
                 elif choice == 'r':
                     self.remove_credentials()
+                elif choice == 'i':
+                    self.import_credentials()
+                elif choice == 'x':
+                    self.export_credentials()
+                elif choice == 'h':
+                    self.health_audit()
+                elif choice == 'c':
+                    self.change_master_password()
                 elif choice == 'l':
                     self.logged_in = False
                     self.current_user = None
+                    self.vault_manager.close()
                     self.vault_manager = None
                 elif choice == 'e':
                     self.logged_in = False
@@ -83,6 +179,32 @@ class PasswordManager:
                 print(f"Error: {str(e)}")
                 logging.error(f"Error in vault menu: {str(e)}")
 
+    def browse_vault(self):
+        page = 0
+        mask_passwords = True
+        while True:
+            total_pages = self.vault_manager.display_vault(mask_passwords, page)
+            choice = input("[N]ext, [P]revious, [T]oggle passwords, [B]ack: ").lower()
+            if choice == 'n' and page < total_pages - 1:
+                page += 1
+            elif choice == 'p' and page > 0:
+                page -= 1
+            elif choice == 't':
+                mask_passwords = not mask_passwords
+            elif choice == 'b':
+                break
+
+    def search_vault(self):
+        print("\n=== Search Vault ===")
+        query = input("Search for service or username: ").strip()
+        if not query:
+            return
+        if self.vault_manager.display_search(query) == 0:
+            print("No matching credentials.")
+            return
+        if input("Show passwords? (y/n): ").lower() == 'y':
+            self.vault_manager.display_search(query, mask_passwords=False)
+
     def add_new_credentials(self):
         print("\n=== Add New Credentials ===")
         try:
@@ -117,6 +239,71 @@ class PasswordManager:
             print("An error occurred while removing credentials.")
             logging.error(f"Error removing credentials: {str(e)}")
 
+    def import_credentials(self):
+        print("\n=== Import Credentials ===")
+        try:
+            path = input("File to import (.csv or .json): ").strip()
+            fmt = input("Format [csv/json/native] (blank to guess): ").strip().lower() or None
+            result = import_credentials(
+                self.vault_manager, path, fmt,
+                progress=lambda done: print(f"\rProcessed {done} records...", end='')
+            )
+            print(f"\nImported {result['imported']} credentials "
+                  f"({result['duplicates']} duplicates skipped, {result['invalid']} invalid).")
+        except Exception as e:
+            print(f"Import failed: {str(e)}")
+            logging.error(f"Error importing credentials: {str(e)}")
+
+    def export_credentials(self):
+        print("\n=== Export Credentials ===")
+        try:
+            path = input("Export to file: ").strip()
+            fmt = input("Format [csv/json/native]: ").strip().lower() or 'csv'
+            if fmt != 'native':
+                print("Warning: csv and json exports contain your passwords in plaintext.")
+                if input("Continue? (y/n): ").lower() != 'y':
+                    return
+            count = export_credentials(self.vault_manager, path, fmt)
+            print(f"Exported {count} credentials to {path}.")
+        except Exception as e:
+            print(f"Export failed: {str(e)}")
+            logging.error(f"Error exporting credentials: {str(e)}")
+
+    def health_audit(self):
+        print("\n=== Password Health Audit ===")
+        report = audit_vault(self.vault_manager, self.user_handling.password_validator)
+        print(format_report(report))
+
+    def change_master_password(self):
+        print("\n=== Change Master Password ===")
+        old_password = input("Current master password: ")
+        new_password = input("New master password: ")
+        if input("Repeat new master password: ") != new_password:
+            print("Passwords do not match.")
+            return
+        # The rotation replaces the vault file, so the open vault is reopened afterwards
+        self.vault_manager.close()
+        try:
+            result = rotate_master_password(
+                self.user_handling, self.current_user, old_password, new_password,
+                progress=lambda done, total: print(f"\rRe-encrypted {done}/{total} records...", end='')
+            )
+            print(f"\nMaster password changed; {result['records']} credentials re-encrypted.")
+            password = new_password
+        except Exception as e:
+            print(f"\nMaster password not changed: {str(e)}")
+            logging.error(f"Error changing master password: {str(e)}")
+            password = old_password
+        master_key = self.user_handling.verify_login(self.current_user, password)
+        if master_key is None:
+            # Wrong current password: leave the vault menu rather than keep a closed vault
+            self.logged_in = False
+            self.current_user = None
+            self.vault_manager = None
+            return
+        self.vault_manager = VaultManager(master_key, self.current_user)
+        self._share_with_agent(master_key)
+
 if __name__ == "__main__":
     try:
         manager = PasswordManager()
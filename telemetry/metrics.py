@@ -0,0 +1,238 @@
+import atexit
+import bisect
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+from .tracing import Tracer
+
+# Upper bounds (seconds) of the latency histogram buckets: 10us .. ~40s
+DEFAULT_BUCKETS = tuple(1e-5 * 2 ** i for i in range(23))
+METRIC_PREFIX = 'naitevarnasse'
+
+_enabled = os.environ.get('NAITEVARNASSE_TELEMETRY', '') not in ('', '0', 'false')
+_tracer: Optional[Tracer] = None
+
+
+class Histogram:
+    """Cumulative latency histogram with fixed buckets."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.bounds = list(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)  # last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, fraction: float) -> float:
+        """Estimate a quantile as the upper bound of the bucket it falls in."""
+        with self._lock:
+            counts, total, largest = list(self.counts), self.count, self.max
+        if total == 0:
+            return 0.0
+        rank = fraction * total
+        seen = 0
+        for bound, count in zip(self.bounds, counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, largest)
+        return largest
+
+    def snapshot(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.quantile(0.50),
+            "p90": self.quantile(0.90),
+            "p99": self.quantile(0.99),
+        }
+
+
+class MetricsRegistry:
+    """Named counters and latency histograms, safe to update from any thread."""
+
+    def __init__(self):
+        self.counters: Dict[str, float] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, amount: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def histogram(self, name: str) -> Histogram:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def observe(self, name: str, seconds: float) -> None:
+        self.histogram(name).observe(seconds)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def snapshot(self) -> Dict:
+        """Plain-dict copy of every counter and histogram summary."""
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+        return {
+            "counters": counters,
+            "histograms": {name: h.snapshot() for name, h in sorted(histograms.items())},
+        }
+
+    def prometheus_text(self, prefix: str = METRIC_PREFIX) -> str:
+        """Render the registry in the Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        lines: List[str] = []
+        for name, value in counters:
+            metric = _metric_name(prefix, name) + '_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {value}')
+        for name, histogram in histograms:
+            metric = _metric_name(prefix, name) + '_seconds'
+            with histogram._lock:
+                counts, total, count = list(histogram.counts), histogram.sum, histogram.count
+            lines.append(f'# TYPE {metric} histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.bounds, counts):
+                cumulative += bucket_count
+                lines.append(f'{metric}_bucket{{le="{bound:.6g}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {count}')
+            lines.append(f'{metric}_sum {total}')
+            lines.append(f'{metric}_count {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _metric_name(prefix: str, name: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', f'{prefix}_{name}')
+
+
+registry = MetricsRegistry()
+
+
+class _NullTimer:
+    """Returned by timed() while telemetry is off: entering and leaving do nothing."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ('name', 'attributes', 'start', 'span', 'tracer')
+
+    def __init__(self, name: str, attributes: Dict):
+        self.name = name
+        self.attributes = attributes
+        self.span = None
+        self.tracer = None
+
+    def __enter__(self):
+        # Keep the tracer that started the span: set_tracer() may swap it before __exit__
+        self.tracer = _tracer
+        if self.tracer is not None:
+            self.span = self.tracer.start_span(self.name, self.attributes)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        if _enabled:
+            registry.observe(self.name, elapsed)
+            if exc_type is not None:
+                registry.increment(self.name + '.errors')
+        if self.span is not None:
+            self.tracer.end_span(self.span, elapsed, exc)
+        return False
+
+
+def timed(name: str, **attributes):
+    """
+    Context manager recording the latency of an operation.
+
+    The duration goes to the histogram called name and, when a tracer is
+    installed, to a span. With telemetry disabled and no tracer this returns
+    a shared no-op object.
+    """
+    if not _enabled and _tracer is None:
+        return _NULL_TIMER
+    return _Timer(name, attributes)
+
+
+def increment(name: str, amount: float = 1) -> None:
+    """Add to a counter (no-op while telemetry is disabled)."""
+    if _enabled:
+        registry.increment(name, amount)
+
+
+def observe(name: str, seconds: float) -> None:
+    """Record a duration measured elsewhere (no-op while telemetry is disabled)."""
+    if _enabled:
+        registry.observe(name, seconds)
+
+
+def enable() -> None:
+    global _enabled
+    _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def set_tracer(tracer: Optional[Tracer]) -> None:
+    """Install a tracer that receives a span for every timed operation (None to remove)."""
+    global _tracer
+    _tracer = tracer
+
+
+def snapshot() -> Dict:
+    return registry.snapshot()
+
+
+def prometheus_text() -> str:
+    return registry.prometheus_text()
+
+
+def write_prometheus(path: str) -> None:
+    """Write the Prometheus text dump atomically, e.g. for a node_exporter textfile collector."""
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as file:
+        file.write(registry.prometheus_text())
+    os.replace(tmp_path, path)
+
+
+if _enabled and os.environ.get('NAITEVARNASSE_METRICS_FILE'):
+    atexit.register(write_prometheus, os.environ['NAITEVARNASSE_METRICS_FILE'])
@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+
+class Span:
+    """One timed operation, optionally nested inside another."""
+
+    __slots__ = ('name', 'attributes', 'parent', 'start', 'duration', 'error')
+
+    def __init__(self, name: str, attributes: Dict, parent: Optional['Span']):
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.start = time.time()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "parent": self.parent.name if self.parent is not None else None,
+            "start": self.start,
+            "duration": self.duration,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class Tracer:
+    """
+    Base class for pluggable tracers.
+
+    Install one with telemetry.metrics.set_tracer(); every timed operation
+    then calls start_span on entry and end_span on exit. Subclasses can
+    forward spans to any tracing backend.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def current_span(self) -> Optional[Span]:
+        stack = getattr(self._local, 'stack', None)
+        return stack[-1] if stack else None
+
+    def start_span(self, name: str, attributes: Dict) -> Span:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        span = Span(name, attributes, stack[-1] if stack else None)
+        stack.append(span)
+        return span
+
+    def end_span(self, span: Span, duration: float, error: Optional[BaseException] = None) -> None:
+        span.duration = duration
+        if error is not None:
+            span.error = type(error).__name__
+        stack = getattr(self._local, 'stack', None)
+        if stack and stack[-1] is span:
+            stack.pop()
+        self.export(span)
+
+    def export(self, span: Span) -> None:
+        """Called with every finished span."""
+
+
+class RecordingTracer(Tracer):
+    """Keeps the most recent finished spans in memory."""
+
+    def __init__(self, max_spans: int = 10000):
+        super().__init__()
+        self.spans: Deque[Span] = deque(maxlen=max_spans)
+
+    def export(self, span: Span) -> None:
+        self.spans.append(span)
+
+    def finished(self, name: Optional[str] = None) -> List[Dict]:
+        return [span.to_dict() for span in list(self.spans) if name is None or span.name == name]
@@ -0,0 +1,99 @@
+from typing import List, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # falls back to one validate() call per password
+    np = None
+
+_ASCII_WHITESPACE = [9, 10, 11, 12, 13, 28, 29, 30, 31, 32]
+
+
+def _has_run(mask, length: int):
+    """Rows of a boolean matrix that contain `length` consecutive True values."""
+    if length <= 0:
+        return np.ones(mask.shape[0], dtype=bool)
+    if mask.shape[1] < length:
+        return np.zeros(mask.shape[0], dtype=bool)
+    sums = np.cumsum(mask, axis=1, dtype=np.int32)
+    sums = np.concatenate([np.zeros((mask.shape[0], 1), dtype=np.int32), sums], axis=1)
+    return ((sums[:, length:] - sums[:, :-length]) == length).any(axis=1)
+
+
+def structural_errors(passwords: Sequence[str], validator) -> List[List[str]]:
+    """
+    Validate many passwords at once.
+
+    ASCII passwords are packed into a padded code-point matrix and every
+    character-class, length, repeat and digit-run rule is evaluated as a
+    NumPy mask over the whole batch; only the pattern automaton runs per
+    password. Passwords with non-ASCII characters (whose Unicode class rules
+    do not vectorise cleanly) and environments without NumPy fall back to
+    PasswordValidator.validate. The result matches validate() entry for entry.
+    """
+    if np is None or not passwords:
+        return [validator.validate(p)[1] for p in passwords]
+
+    results: List[Optional[List[str]]] = [None] * len(passwords)
+    ascii_rows = [i for i, p in enumerate(passwords) if p.isascii()]
+    for i, password in enumerate(passwords):
+        if not password.isascii():
+            results[i] = validator.validate(password)[1]
+    if not ascii_rows:
+        return results
+
+    batch = [passwords[i] for i in ascii_rows]
+    lengths = np.fromiter((len(p) for p in batch), dtype=np.int64, count=len(batch))
+    width = max(int(lengths.max()), 1)
+    packed = ''.join(p.ljust(width, '\0') for p in batch).encode('ascii')
+    codes = np.frombuffer(packed, dtype=np.uint8).reshape(len(batch), width)
+    valid = np.arange(width) < lengths[:, None]
+
+    upper = ((codes >= 65) & (codes <= 90) & valid).any(axis=1)
+    lower = ((codes >= 97) & (codes <= 122) & valid).any(axis=1)
+    digits = (codes >= 48) & (codes <= 57) & valid
+    has_digit = digits.any(axis=1)
+    special_codes = np.frombuffer(validator.special_chars.encode('ascii', 'ignore'), dtype=np.uint8)
+    special = (np.isin(codes, special_codes) & valid).any(axis=1)
+    space = (np.isin(codes, _ASCII_WHITESPACE) & valid).any(axis=1)
+
+    repeats = validator.max_repeated_chars
+    if repeats <= 0:
+        repeated = np.ones(len(batch), dtype=bool)
+    elif repeats == 1:
+        repeated = lengths >= 1
+    else:
+        same = (codes[:, 1:] == codes[:, :-1]) & valid[:, 1:]
+        repeated = _has_run(same, repeats - 1)
+    digit_run = _has_run(digits, validator.min_digit_run)
+
+    too_short = lengths < validator.min_length
+    too_long = lengths > validator.max_length
+    corpus = validator.breach_corpus
+
+    for row, i in enumerate(ascii_rows):
+        password = batch[row]
+        common, keyboard_rows = validator.pattern_matches(password)
+        errors = []
+        if too_short[row]:
+            errors.append(f"Password must be at least {validator.min_length} characters")
+        if too_long[row]:
+            errors.append(f"Password must not exceed {validator.max_length} characters")
+        if not upper[row]:
+            errors.append("Must contain uppercase letter")
+        if not lower[row]:
+            errors.append("Must contain lowercase letter")
+        if not has_digit[row]:
+            errors.append("Must contain number")
+        if not special[row]:
+            errors.append("Must contain special character")
+        if space[row]:
+            errors.append("Must not contain whitespace characters")
+        if repeated[row]:
+            errors.append(f"Cannot repeat the same character more than {validator.max_repeated_chars} times")
+        if common or digit_run[row]:
+            errors.append("Contains common password pattern")
+        errors.extend(["Contains keyboard pattern"] * keyboard_rows)
+        if corpus is not None and corpus.contains(password):
+            errors.append("Password appears in a known data breach")
+        results[i] = errors
+    return results
@@ -0,0 +1,207 @@
+import argparse
+import hashlib
+import heapq
+import logging
+import math
+import mmap
+import os
+import struct
+import tempfile
+from typing import Iterable, Iterator, List, Optional
+
+# magic, version, hash bytes, bloom hash count, bloom bits, entry count
+_HEADER = struct.Struct('<4sHHIQQ')
+_MAGIC = b'NVBC'
+_VERSION = 1
+_MASK64 = (1 << 64) - 1
+
+
+def _bloom_positions(prefix: bytes, bits: int, hashes: int) -> Iterator[int]:
+    """Double hashing over the (at least 8 byte) truncated SHA-1."""
+    h1 = int.from_bytes(prefix[:8], 'big')
+    h2 = ((h1 * 0x9E3779B97F4A7C15) & _MASK64) >> 17 | 1
+    for i in range(hashes):
+        yield (h1 + i * h2) % bits
+
+
+def _parse_line(line: bytes, hash_bytes: int) -> Optional[bytes]:
+    """
+    Turn one corpus line into a truncated SHA-1.
+
+    Lines of the form ``<40 hex chars>[:count]`` (HIBP) are taken as hashes;
+    anything else is a plaintext password (SecLists wordlists).
+    """
+    line = line.rstrip(b'\r\n')
+    if not line:
+        return None
+    head = line.split(b':', 1)[0]
+    if len(head) == 40:
+        try:
+            return bytes.fromhex(head.decode())[:hash_bytes]
+        except ValueError:
+            pass
+    return hashlib.sha1(line).digest()[:hash_bytes]
+
+
+def _write_run(run: List[bytes], directory: str) -> str:
+    run.sort()
+    fd, path = tempfile.mkstemp(suffix='.run', dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(b''.join(run))
+    return path
+
+
+def _read_run(path: str, hash_bytes: int) -> Iterator[bytes]:
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(hash_bytes * 65536)
+            if not block:
+                return
+            for i in range(0, len(block), hash_bytes):
+                yield block[i:i + hash_bytes]
+
+
+def build_corpus(sources: Iterable[str], out_path: str, false_positive_rate: float = 0.001,
+                 hash_bytes: int = 8, run_size: int = 5_000_000) -> int:
+    """
+    Preprocess wordlists / HIBP hash files into a compact lookup file.
+
+    Input is hashed and sorted in bounded runs on disk, then merged and
+    de-duplicated straight into the output while the Bloom filter bits are
+    set through an mmap of the same file, so memory use stays flat for
+    corpora of hundreds of millions of entries.
+
+    Returns:
+        int: Number of distinct hashes written
+    """
+    if not 8 <= hash_bytes <= 20:
+        raise ValueError("hash_bytes must be between 8 and 20 (a SHA-1 digest)")
+    directory = os.path.dirname(os.path.abspath(out_path))
+    runs = []
+    run: List[bytes] = []
+    try:
+        for source in sources:
+            with open(source, 'rb') as f:
+                for line in f:
+                    digest = _parse_line(line, hash_bytes)
+                    if digest is not None:
+                        run.append(digest)
+                        if len(run) >= run_size:
+                            runs.append(_write_run(run, directory))
+                            run = []
+        if run:
+            runs.append(_write_run(run, directory))
+        run = []
+
+        # Upper bound of distinct entries; duplicates only make the filter sparser.
+        total = sum(os.path.getsize(path) for path in runs) // hash_bytes
+        bits = max(64, int(-max(total, 1) * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        bits = (bits + 7) // 8 * 8
+        hashes = max(1, round(bits / max(total, 1) * math.log(2)))
+        bloom_offset = _HEADER.size
+        array_offset = bloom_offset + bits // 8
+
+        count = 0
+        with open(out_path + '.tmp', 'w+b') as out:
+            out.truncate(array_offset)
+            out.seek(array_offset)
+            with mmap.mmap(out.fileno(), array_offset) as view:
+                previous = None
+                for digest in heapq.merge(*(_read_run(path, hash_bytes) for path in runs)):
+                    if digest == previous:
+                        continue
+                    previous = digest
+                    out.write(digest)
+                    count += 1
+                    for position in _bloom_positions(digest, bits, hashes):
+                        view[bloom_offset + (position >> 3)] |= 1 << (position & 7)
+                view[0:_HEADER.size] = _HEADER.pack(_MAGIC, _VERSION, hash_bytes, hashes, bits, count)
+                view.flush()
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(out_path + '.tmp', out_path)
+    finally:
+        for path in runs:
+            os.remove(path)
+
+    logging.info(f"Built breach corpus {out_path} with {count} hashes")
+    return count
+
+
+class BreachCorpus:
+    """
+    Memory-mapped breached-password lookup.
+
+    A Bloom filter answers most negatives with a handful of bit probes; a
+    positive is confirmed by binary search over the sorted array of truncated
+    SHA-1 hashes. Nothing is loaded into memory beyond the pages touched.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._view = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.hash_bytes, self.bloom_hashes, self.bloom_bits, self.count = \
+            _HEADER.unpack_from(self._view, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self.close()
+            raise ValueError(f"Not a breach corpus file: {path}")
+        if not 8 <= self.hash_bytes <= 20:
+            self.close()
+            raise ValueError(f"Unsupported hash width {self.hash_bytes} in breach corpus: {path}")
+        self._bloom_offset = _HEADER.size
+        self._array_offset = self._bloom_offset + self.bloom_bits // 8
+
+    def _maybe_contains(self, prefix: bytes) -> bool:
+        view = self._view
+        offset = self._bloom_offset
+        for position in _bloom_positions(prefix, self.bloom_bits, self.bloom_hashes):
+            if not view[offset + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def contains_sha1(self, digest: bytes) -> bool:
+        """Look up a raw 20 byte SHA-1 digest."""
+        prefix = digest[:self.hash_bytes]
+        if not self._maybe_contains(prefix):
+            return False
+        view = self._view
+        width = self.hash_bytes
+        base = self._array_offset
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            start = base + mid * width
+            entry = view[start:start + width]
+            if entry < prefix:
+                low = mid + 1
+            elif entry > prefix:
+                high = mid
+            else:
+                return True
+        return False
+
+    def contains(self, password: str) -> bool:
+        return self.contains_sha1(hashlib.sha1(password.encode()).digest())
+
+    def close(self) -> None:
+        self._view.close()
+        self._file.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Build an offline breached-password corpus")
+    parser.add_argument('output', help="corpus file to write")
+    parser.add_argument('sources', nargs='+', help="SecLists wordlists or HIBP SHA-1 files")
+    parser.add_argument('--fp-rate', type=float, default=0.001, help="Bloom filter false positive rate")
+    parser.add_argument('--hash-bytes', type=int, default=8, help="bytes of SHA-1 kept per entry")
+    args = parser.parse_args(argv)
+    count = build_corpus(args.sources, args.output, args.fp_rate, args.hash_bytes)
+    print(f"Wrote {count} hashes to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+from telemetry import metrics
+
+KDF_ALGORITHM = 'pbkdf2_sha256'
+MIN_ITERATIONS = 100000
+
+# Parameters VaultManager used before per-user salts existed
+LEGACY_SALT = b'salt_'
+LEGACY_ITERATIONS = 100000
+
+# Salt of the decoy derivation run for logins to unknown users
+DECOY_SALT = b'naitevarnasse-decoy'
+
+_calibrated: Dict[float, int] = {}
+
+
+def derive_key(password: str, salt: bytes, iterations: int) -> bytes:
+    """Stretch a password into a urlsafe-base64 Fernet key."""
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        iterations=iterations,
+    )
+    with metrics.timed('kdf.derive', iterations=iterations):
+        return base64.urlsafe_b64encode(kdf.derive(password.encode()))
+
+
+def calibrate_iterations(target_seconds: float = 0.25, probe_iterations: int = 20000) -> int:
+    """
+    Pick a PBKDF2 iteration count that takes about target_seconds on this host.
+
+    The probe is run once per process and target; the result is never below
+    MIN_ITERATIONS.
+    """
+    if target_seconds in _calibrated:
+        return _calibrated[target_seconds]
+    start = time.perf_counter()
+    derive_key('calibration', os.urandom(16), probe_iterations)
+    elapsed = max(time.perf_counter() - start, 1e-6)
+    iterations = int(probe_iterations * target_seconds / elapsed)
+    iterations = max(MIN_ITERATIONS, iterations // 1000 * 1000)
+    _calibrated[target_seconds] = iterations
+    return iterations
+
+
+def new_kdf_params(iterations: int) -> Dict:
+    """Fresh per-user KDF parameters with a random salt."""
+    return {
+        "algorithm": KDF_ALGORITHM,
+        "salt": base64.b64encode(os.urandom(16)).decode(),
+        "iterations": iterations
+    }
+
+
+def key_check(key: bytes) -> str:
+    """Verifier stored next to the KDF parameters; reveals nothing about the key."""
+    return hmac.new(key, b'naitevarnasse-key-check', hashlib.sha256).hexdigest()
+
+
+def is_fernet_key(value: str) -> bool:
+    """True if value is already a urlsafe-base64 encoded 32 byte key."""
+    try:
+        return len(value) == 44 and len(base64.urlsafe_b64decode(value.encode())) == 32
+    except (ValueError, TypeError):
+        return False
+
+
+class DerivedKeyCache:
+    """
+    In-process LRU cache of derived keys with a time-to-live.
+
+    Entries are looked up by an HMAC of (salt, iterations, password) under a
+    per-process random secret, so neither the password nor a fast hash of it
+    is kept. Keys are held in bytearrays and overwritten with zeros when they
+    are evicted, expire or the cache is cleared.
+    """
+
+    def __init__(self, max_entries: int = 32, ttl_seconds: float = 900):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._secret = os.urandom(32)
+        self._entries: "OrderedDict[bytes, Tuple[bytearray, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cache_key(self, password: str, salt: bytes, iterations: int) -> bytes:
+        message = salt + iterations.to_bytes(8, 'big') + password.encode()
+        return hmac.new(self._secret, message, hashlib.sha256).digest()
+
+    @staticmethod
+    def _wipe(key: bytearray) -> None:
+        for i in range(len(key)):
+            key[i] = 0
+
+    def _evict(self, cache_key: bytes) -> None:
+        key, _ = self._entries.pop(cache_key)
+        self._wipe(key)
+
+    def get(self, password: str, salt: bytes, iterations: int) -> Optional[bytes]:
+        cache_key = self._cache_key(password, salt, iterations)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                self._evict(cache_key)
+                return None
+            self._entries.move_to_end(cache_key)
+            return bytes(entry[0])
+
+    def put(self, password: str, salt: bytes, iterations: int, key: bytes) -> None:
+        cache_key = self._cache_key(password, salt, iterations)
+        with self._lock:
+            if cache_key in self._entries:
+                self._evict(cache_key)
+            self._entries[cache_key] = (bytearray(key), time.monotonic() + self.ttl_seconds)
+            while len(self._entries) > self.max_entries:
+                self._evict(next(iter(self._entries)))
+
+    def derive(self, password: str, salt: bytes, iterations: int,
+               verify: Optional[Callable[[bytes], bool]] = None) -> bytes:
+        """
+        Return the derived key, running the KDF only on a cache miss.
+
+        With verify, a freshly derived key is cached only if verify(key) is
+        true, so wrong passwords never push correct keys out of the cache.
+        """
+        key = self.get(password, salt, iterations)
+        metrics.increment('kdf.cache_miss' if key is None else 'kdf.cache_hit')
+        if key is None:
+            key = derive_key(password, salt, iterations)
+            if verify is None or verify(key):
+                self.put(password, salt, iterations, key)
+        return key
+
+    def purge_expired(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for cache_key in [k for k, (_, expires) in self._entries.items() if expires < now]:
+                self._evict(cache_key)
+
+    def clear(self) -> None:
+        """Wipe and drop every cached key."""
+        with self._lock:
+            for cache_key in list(self._entries):
+                self._evict(cache_key)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Shared by UserHandling and VaultManager
+key_cache = DerivedKeyCache()
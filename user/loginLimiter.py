@@ -0,0 +1,241 @@
+import atexit
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from telemetry import metrics
+from vault.fileLock import FileLock
+
+Key = Tuple[str, str]  # ('user', normalized username) or ('source', client address)
+
+
+class LoginLimiter:
+    """
+    Sliding-window counters of failed logins, per user and per source.
+
+    Every key remembers the times of its recent failures (at most as many as
+    its limit, so memory per key is bounded). A failure that makes the
+    count within the window reach the limit locks the key for lockout
+    seconds. Keys are expired through a min-heap of (expiry, key) entries;
+    an entry whose key was touched again since it was pushed is skipped.
+
+    The counters live in memory and are written to snapshot_path at most
+    every snapshot_interval seconds, at once when a lockout starts and at
+    interpreter exit, so a stream of failed logins does not turn into a
+    stream of disk writes and lockouts survive a restart. Processes sharing
+    the snapshot merge it into their counters under a file lock before
+    writing it, and re-read it whenever it changed, so failures and
+    lockouts counted by one process apply in all of them.
+    """
+
+    def __init__(self, snapshot_path: Optional[str] = None, max_attempts: int = 5,
+                 window: float = 900, lockout: float = 900, max_source_attempts: int = 20,
+                 snapshot_interval: float = 30, clock: Callable[[], float] = time.time):
+        """
+        Args:
+            snapshot_path (str): JSON file the counters are saved to (None keeps them in memory only)
+            max_attempts (int): Failures per user within window before a lockout
+            window (float): Seconds a failure is counted for
+            lockout (float): Seconds a locked user or source is refused
+            max_source_attempts (int): Failures per source within window before a lockout
+            snapshot_interval (float): Seconds between snapshots while counters change
+            clock (callable): Wall clock in seconds, so snapshots stay valid across restarts
+        """
+        self.snapshot_path = snapshot_path
+        self.limits = {"user": max_attempts, "source": max_source_attempts}
+        self.window = window
+        self.lockout = lockout
+        self.snapshot_interval = snapshot_interval
+        self.clock = clock
+        self._failures: Dict[Key, Deque[float]] = {}
+        self._locked: Dict[Key, float] = {}
+        self._heap: List[Tuple[float, Key]] = []
+        self._cleared: Dict[Key, float] = {}  # key -> time of its last successful login, until the next snapshot
+        self._snapshot_stamp: Optional[Tuple] = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = clock()
+        self._file_lock = FileLock(snapshot_path) if snapshot_path else None
+        if snapshot_path:
+            self._refresh()
+            atexit.register(self._flush_if_dirty)  # short-lived processes (cli.py) keep their counts
+
+    def _keys(self, username: Optional[str], source: Optional[str]) -> List[Key]:
+        keys = []
+        if username:
+            keys.append(("user", username.strip().lower()))
+        if source:
+            keys.append(("source", source))
+        return keys
+
+    def _expiry(self, key: Key) -> float:
+        failures = self._failures.get(key)
+        last_failure = failures[-1] + self.window if failures else 0.0
+        return max(self._locked.get(key, 0.0), last_failure)
+
+    def _expire(self, now: float) -> None:
+        while self._heap and self._heap[0][0] <= now:
+            _, key = heapq.heappop(self._heap)
+            if self._expiry(key) <= now:
+                self._failures.pop(key, None)
+                self._locked.pop(key, None)
+
+    def _retry_after(self, keys: List[Key], now: float) -> float:
+        return max([self._locked.get(key, now) - now for key in keys] + [0.0])
+
+    def retry_after(self, username: Optional[str], source: Optional[str] = None) -> float:
+        """
+        Seconds until a login for username from source may be tried; 0 if allowed now.
+
+        Args:
+            username (str): Username of the attempt
+            source (str): Client address of the attempt, if known
+        """
+        self._refresh()
+        now = self.clock()
+        with self._lock:
+            self._expire(now)
+            return self._retry_after(self._keys(username, source), now)
+
+    def record_failure(self, username: Optional[str], source: Optional[str] = None) -> float:
+        """Count a failed login; returns the seconds the attempt's user or source is now locked for (0 if none)."""
+        now = self.clock()
+        locked = False
+        with self._lock:
+            self._expire(now)
+            for key in self._keys(username, source):
+                failures = self._failures.setdefault(key, deque(maxlen=self.limits[key[0]]))
+                while failures and failures[0] <= now - self.window:
+                    failures.popleft()
+                failures.append(now)
+                if len(failures) >= self.limits[key[0]]:
+                    del self._failures[key]
+                    self._locked[key] = now + self.lockout
+                    heapq.heappush(self._heap, (now + self.lockout, key))
+                    metrics.increment(f'login_limiter.{key[0]}_locked')
+                    logging.warning(f"Login locked for {key[0]} {key[1]} for {self.lockout:.0f} seconds")
+                    locked = True
+                else:
+                    heapq.heappush(self._heap, (now + self.window, key))
+            self._dirty = True
+            retry_after = self._retry_after(self._keys(username, source), now)
+        self._maybe_snapshot(now, force=locked)
+        return retry_after
+
+    def record_success(self, username: Optional[str], source: Optional[str] = None) -> None:
+        """Forget the user's failures after a successful login; the source keeps its count."""
+        now = self.clock()
+        with self._lock:
+            for key in self._keys(username, None):
+                if self._failures.pop(key, None) is not None:
+                    self._cleared[key] = now
+                    self._dirty = True
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._failures.keys() | self._locked.keys())
+
+    def _maybe_snapshot(self, now: float, force: bool = False) -> None:
+        if self.snapshot_path and self._dirty and (force or now - self._saved_at >= self.snapshot_interval):
+            self.flush()
+
+    def _flush_if_dirty(self) -> None:
+        if self._dirty:
+            self.flush()
+
+    def flush(self) -> None:
+        """Merge the counters with the snapshot file and write the result back."""
+        if not self.snapshot_path:
+            return
+        try:
+            directory = os.path.dirname(self.snapshot_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._write_lock, self._file_lock:
+                data = self._read_snapshot()
+                now = self.clock()
+                with self._lock:
+                    if data:
+                        self._merge(data, now)
+                    self._expire(now)
+                    data = {
+                        "failures": {f'{kind}:{name}': list(times) for (kind, name), times in self._failures.items()},
+                        "lockouts": {f'{kind}:{name}': until for (kind, name), until in self._locked.items()},
+                    }
+                    self._cleared.clear()
+                    self._dirty = False
+                    self._saved_at = now
+                tmp_path = f'{self.snapshot_path}.{os.getpid()}.tmp'
+                with metrics.timed('login_limiter.snapshot'):
+                    with open(tmp_path, 'w') as f:
+                        json.dump(data, f)
+                    os.replace(tmp_path, self.snapshot_path)
+                self._snapshot_stamp = self._stamp()
+        except Exception as e:
+            self._dirty = True
+            logging.error(f"Error saving login limiter snapshot: {str(e)}")
+
+    def _stamp(self) -> Optional[Tuple]:
+        try:
+            stat = os.stat(self.snapshot_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _read_snapshot(self) -> Optional[Dict]:
+        try:
+            with open(self.snapshot_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.error(f"Error reading login limiter snapshot: {str(e)}")
+            return None
+
+    def _refresh(self) -> None:
+        """Merge the snapshot file if another process rewrote it since it was last read or written here."""
+        if not self.snapshot_path:
+            return
+        stamp = self._stamp()
+        if stamp is None or stamp == self._snapshot_stamp:
+            return
+        data = self._read_snapshot()
+        self._snapshot_stamp = stamp
+        if data:
+            now = self.clock()
+            with self._lock:
+                self._merge(data, now)
+
+    def _merge(self, data: Dict, now: float) -> None:
+        """Fold a snapshot into the counters: failure times are united and the later lockout wins."""
+        for name, until in data.get("lockouts", {}).items():
+            kind, _, value = name.partition(':')
+            key = (kind, value)
+            if kind in self.limits and until > max(now, self._locked.get(key, 0.0)):
+                self._failures.pop(key, None)
+                self._locked[key] = until
+                heapq.heappush(self._heap, (until, key))
+        for name, times in data.get("failures", {}).items():
+            kind, _, value = name.partition(':')
+            key = (kind, value)
+            if kind not in self.limits or key in self._locked:
+                continue
+            # Failures before this process saw the user log in stay forgotten
+            since = max(now - self.window, self._cleared.get(key, float('-inf')))
+            merged = sorted({t for t in [*times, *self._failures.get(key, ())] if t > since})
+            merged = merged[-self.limits[kind]:]
+            if not merged:
+                continue
+            if len(merged) >= self.limits[kind]:
+                self._failures.pop(key, None)
+                self._locked[key] = merged[-1] + self.lockout
+                heapq.heappush(self._heap, (merged[-1] + self.lockout, key))
+            else:
+                self._failures[key] = deque(merged, maxlen=self.limits[kind])
+                heapq.heappush(self._heap, (merged[-1] + self.window, key))
@@ -0,0 +1,137 @@
+import os
+import string
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+CHARACTER_CLASSES: Dict[str, str] = {
+    "lowercase": string.ascii_lowercase,
+    "uppercase": string.ascii_uppercase,
+    "digits": string.digits,
+    "special": '!@#$%^&*()-_=+[]{}|;:,.<>?/~`',
+}
+AMBIGUOUS_CHARACTERS = 'Il1O0o|`'
+
+
+class PasswordGenerator:
+    """
+    Batch password generator driven by a character policy.
+
+    Random bytes come from a buffered os.urandom stream and are mapped to
+    characters with bulk rejection sampling: bytes at or above the largest
+    multiple of the alphabet size are dropped (via bytes.translate), which
+    keeps every character equally likely. Candidates that miss a required
+    character class or fail the validator are discarded, so every password
+    returned passes PasswordValidator.validate.
+    """
+
+    def __init__(self, validator=None, length: Union[int, Tuple[int, int]] = 16,
+                 classes: Optional[Dict[str, str]] = None,
+                 required: Optional[Iterable[str]] = None,
+                 exclude_ambiguous: bool = False, buffer_size: int = 65536):
+        """
+        Args:
+            validator: PasswordValidator used to filter candidates (None to skip)
+            length: Fixed length, or an inclusive (min, max) range
+            classes: Character class name -> characters (default: CHARACTER_CLASSES,
+                with the validator's special characters when one is given)
+            required: Classes every password must contain (default: all classes)
+            exclude_ambiguous (bool): Leave out look-alike characters such as 0/O and 1/l
+            buffer_size (int): Random bytes fetched from the OS per refill
+        """
+        self.validator = validator
+        self.length_range = (length, length) if isinstance(length, int) else tuple(length)
+        if self.length_range[0] < 1 or self.length_range[0] > self.length_range[1]:
+            raise ValueError("Invalid password length")
+
+        if classes is None:
+            classes = dict(CHARACTER_CLASSES)
+            if validator is not None:
+                classes["special"] = validator.special_chars
+        if exclude_ambiguous:
+            classes = {
+                name: ''.join(c for c in chars if c not in AMBIGUOUS_CHARACTERS)
+                for name, chars in classes.items()
+            }
+        self.classes = {name: chars for name, chars in classes.items() if chars}
+        self.required = list(self.classes if required is None else required)
+        if len(self.required) > self.length_range[0]:
+            raise ValueError("Minimum length is shorter than the number of required classes")
+
+        self.alphabet = ''.join(dict.fromkeys(''.join(self.classes.values())))
+        if not self.alphabet.isascii() or not 1 < len(self.alphabet) <= 256:
+            raise ValueError("Alphabet must contain 2 to 256 ASCII characters")
+        self._required_sets = [frozenset(self.classes[name]) for name in self.required]
+        self._char_table, self._char_reject = self._sampling_table(self.alphabet)
+
+        self.buffer_size = buffer_size
+        self._buffer = b''
+        self._position = 0
+
+    @staticmethod
+    def _sampling_table(symbols: Union[str, bytes]) -> Tuple[bytes, bytes]:
+        """translate() table mapping accepted bytes to symbols, plus the bytes to reject."""
+        size = len(symbols)
+        limit = 256 - 256 % size
+        symbols = symbols.encode('ascii') if isinstance(symbols, str) else symbols
+        table = bytes(symbols[b % size] if b < limit else 0 for b in range(256))
+        return table, bytes(range(limit, 256))
+
+    def _random_bytes(self, count: int) -> bytes:
+        """Take count bytes from the buffered CSPRNG stream."""
+        if self._position + count > len(self._buffer):
+            leftover = self._buffer[self._position:]
+            self._buffer = leftover + os.urandom(max(self.buffer_size, count))
+            self._position = 0
+        chunk = self._buffer[self._position:self._position + count]
+        self._position += count
+        return chunk
+
+    def _sample(self, table: bytes, reject: bytes, count: int) -> bytes:
+        """count unbiased symbols drawn through a sampling table."""
+        out = b''
+        acceptance = (256 - len(reject)) / 256
+        while len(out) < count:
+            needed = count - len(out)
+            out += self._random_bytes(int(needed / acceptance) + 16).translate(table, reject)
+        return out[:count]
+
+    def _lengths(self, count: int) -> List[int]:
+        low, high = self.length_range
+        if low == high:
+            return [low] * count
+        table, reject = self._sampling_table(bytes(range(high - low + 1)))
+        return [low + offset for offset in self._sample(table, reject, count)]
+
+    def _candidates(self, count: int) -> List[str]:
+        lengths = self._lengths(count)
+        text = self._sample(self._char_table, self._char_reject, sum(lengths)).decode('ascii')
+        candidates = []
+        position = 0
+        for length in lengths:
+            candidates.append(text[position:position + length])
+            position += length
+        return candidates
+
+    def generate(self, count: int = 1, max_rounds: int = 100) -> List[str]:
+        """
+        Generate count passwords that satisfy the policy and the validator.
+
+        Raises:
+            ValueError: If the policy rejects (nearly) every candidate
+        """
+        results: List[str] = []
+        batch = max(count, 16)
+        for _ in range(max_rounds):
+            candidates = [
+                c for c in self._candidates(batch)
+                if all(not required.isdisjoint(c) for required in self._required_sets)
+            ]
+            if self.validator is not None and candidates:
+                checks = self.validator.validate_many(candidates)
+                candidates = [c for c, (is_valid, _) in zip(candidates, checks) if is_valid]
+            results.extend(candidates)
+            if len(results) >= count:
+                return results[:count]
+            # Grow the next batch to match the observed acceptance rate
+            accepted = max(len(candidates), 1)
+            batch = min(max(batch, (count - len(results)) * batch // accepted + 16), 1_000_000)
+        raise ValueError("Password policy rejected every generated candidate")
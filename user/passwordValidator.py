@@ -1,20 +1,184 @@
+import re
+from typing import Iterable, List, Optional, Tuple
+
+from telemetry import metrics
+from .patternMatcher import PatternAutomaton
+from .breachCorpus import BreachCorpus
+from .passwordGenerator import PasswordGenerator
+
+COMMON_PATTERNS = ['12345', 'qwerty', 'password', 'admin', 'letmein', 'welcome', 'abc123']
+KEYBOARD_ROWS = ['qwertyuiop', 'asdfghjkl', 'zxcvbnm', '1234567890']
+
+_COMMON_BIT = 1  # keyboard row i uses bit i + 1
+VECTORIZE_MIN_BATCH = 64  # smaller batches are not worth loading NumPy for
+
+
 class PasswordValidator:
-    def __init__(self):
+    def __init__(self, common_patterns: Optional[Iterable[str]] = None,
+                 keyboard_rows: Optional[Iterable[str]] = None,
+                 breach_corpus: Optional[BreachCorpus] = None):
         self.special_chars = '!@#$%^&*()-_=+[]{}|;:,.<>?/~`'
         self.min_length = 8
+        self.max_length = 128  # Adding max length for security
+        self.max_repeated_chars = 3  # Maximum times a character can be repeated consecutively
+        self.min_digit_run = 6  # 6 or more consecutive numbers count as a common pattern
+        self.keyboard_window = 4
+
+        # Literal (lowercase) substrings; regexes go in common_regexes
+        self.common_patterns = list(COMMON_PATTERNS if common_patterns is None else common_patterns)
+        self.keyboard_rows = list(KEYBOARD_ROWS if keyboard_rows is None else keyboard_rows)
+        self.common_regexes: List[str] = []
+        self.breach_corpus = breach_corpus  # offline breached-password lookup, if any
+        self._suggestion_generator: Optional[PasswordGenerator] = None
+        self._compile()
+
+    def _compile(self) -> None:
+        """Build the pattern automaton (and combined regex) once for all patterns."""
+        self._special = frozenset(self.special_chars)
+        automaton = PatternAutomaton()
+        for pattern in self.common_patterns:
+            automaton.add(pattern.lower(), _COMMON_BIT)
+        for row_index, row in enumerate(self.keyboard_rows):
+            row = row.lower()
+            for i in range(len(row) - self.keyboard_window + 1):
+                automaton.add(row[i:i + self.keyboard_window], 1 << (row_index + 1))
+        automaton.build()
+        self._automaton = automaton
+        self._keyboard_mask = ((1 << len(self.keyboard_rows)) - 1) << 1
+        self._common_regex = (
+            re.compile('|'.join(f'(?:{r})' for r in self.common_regexes))
+            if self.common_regexes else None
+        )
+
+    def add_common_patterns(self, patterns: Iterable[str], regex: bool = False) -> None:
+        """Extend the common-pattern list; literals cost nothing extra per check."""
+        if regex:
+            self.common_regexes.extend(patterns)
+        else:
+            self.common_patterns.extend(patterns)
+        self._compile()
+
+    def add_keyboard_rows(self, rows: Iterable[str]) -> None:
+        self.keyboard_rows.extend(rows)
+        self._compile()
+
+    def pattern_matches(self, password: str) -> Tuple[bool, int]:
+        """
+        Run only the common/keyboard pattern checks (not the digit-run rule).
+
+        Returns:
+            (common pattern found, number of keyboard rows matched)
+        """
+        lowered = password.lower()
+        found = self._automaton.search(lowered)
+        if self._common_regex is not None and self._common_regex.search(lowered):
+            found |= _COMMON_BIT
+        return bool(found & _COMMON_BIT), bin(found & self._keyboard_mask).count('1')
+
+    def validate(self, password: str) -> Tuple[bool, List[str]]:
+        """Check a password against every rule; returns (is_valid, errors)."""
+        with metrics.timed('validator.validate'):
+            return self._validate(password)
+
+    def _validate(self, password: str) -> Tuple[bool, List[str]]:
+        """
+        Check a password against every rule in a single pass.
+
+        Character classes, consecutive repeats, digit runs and all common and
+        keyboard patterns (through the Aho-Corasick automaton over the
+        lowercased text) are tracked in the same loop.
+        """
+        has_upper = has_lower = has_digit = has_special = has_space = False
+        repeated = False
+        found = 0
+
+        table = self._automaton.table
+        masks = self._automaton.masks
+        special = self._special
+        max_repeats = self.max_repeated_chars
+        min_digit_run = self.min_digit_run
+        state = 0
+        previous = None
+        run = 0
+        digit_run = 0
+
+        for char in password:
+            if char.isupper():
+                has_upper = True
+            if char.islower():
+                has_lower = True
+            if char.isdigit():
+                has_digit = True
+            if char in special:
+                has_special = True
+            if char.isspace():
+                has_space = True
+
+            run = run + 1 if char == previous else 1
+            previous = char
+            if run >= max_repeats:
+                repeated = True
+
+            for lowered in char.lower():
+                state = table[state].get(lowered, 0)
+                found |= masks[state]
+                if lowered.isdecimal():
+                    digit_run += 1
+                    if digit_run >= min_digit_run:
+                        found |= _COMMON_BIT
+                else:
+                    digit_run = 0
+
+        if max_repeats <= 0:
+            repeated = True
+        if self._common_regex is not None and self._common_regex.search(password.lower()):
+            found |= _COMMON_BIT
 
-    def validate(self, password):
         errors = []
-        
+
+        # Basic requirements
         if len(password) < self.min_length:
             errors.append(f"Password must be at least {self.min_length} characters")
-        if not any(char.isupper() for char in password):
+        if len(password) > self.max_length:
+            errors.append(f"Password must not exceed {self.max_length} characters")
+        if not has_upper:
             errors.append("Must contain uppercase letter")
-        if not any(char.islower() for char in password):
+        if not has_lower:
             errors.append("Must contain lowercase letter")
-        if not any(char.isdigit() for char in password):
+        if not has_digit:
             errors.append("Must contain number")
-        if not any(char in self.special_chars for char in password):
+        if not has_special:
             errors.append("Must contain special character")
-        
-        return (len(errors) == 0, errors)
\ No newline at end of file
+        if has_space:
+            errors.append("Must not contain whitespace characters")
+
+        # Advanced security checks
+        if repeated:
+            errors.append(f"Cannot repeat the same character more than {self.max_repeated_chars} times")
+        if found & _COMMON_BIT:
+            errors.append("Contains common password pattern")
+        # One error per keyboard row that matched
+        for _ in range(bin(found & self._keyboard_mask).count('1')):
+            errors.append("Contains keyboard pattern")
+        if self.breach_corpus is not None and self.breach_corpus.contains(password):
+            errors.append("Password appears in a known data breach")
+
+        return (len(errors) == 0, errors)
+
+    def validate_many(self, passwords: List[str]) -> List[Tuple[bool, List[str]]]:
+        """validate() for a whole batch, with the structural rules vectorised."""
+        with metrics.timed('validator.validate_many'):
+            if len(passwords) < VECTORIZE_MIN_BATCH:
+                return [self._validate(p) for p in passwords]
+            from .batchValidation import structural_errors  # imports NumPy
+            return [(len(errors) == 0, errors) for errors in structural_errors(passwords, self)]
+
+    def generator(self, length=16, **policy) -> PasswordGenerator:
+        """A PasswordGenerator whose output always passes this validator."""
+        return PasswordGenerator(self, length, **policy)
+
+    def suggest_password(self) -> str:
+        if self._suggestion_generator is None:
+            length = (self.min_length + 4, min(self.min_length + 8, 16))
+            self._suggestion_generator = self.generator((min(length), max(length)))
+        return self._suggestion_generator.generate(1)[0]
@@ -0,0 +1,70 @@
+from collections import deque
+from typing import Dict, List
+
+
+class PatternAutomaton:
+    """
+    Aho-Corasick automaton compiled to a dense transition table.
+
+    Every pattern carries an integer bit mask; the mask of a state is the OR
+    of the masks of all patterns that end there (including via suffix
+    links). Feeding a text one character at a time with step() and OR-ing the
+    returned masks reports every pattern occurrence in a single pass, no
+    matter how many patterns were added.
+    """
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._masks: List[int] = [0]
+        self.table: List[Dict[str, int]] = [{}]
+        self.masks: List[int] = [0]
+
+    def add(self, pattern: str, mask: int) -> None:
+        """Register a pattern; call build() before matching."""
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._masks.append(0)
+            state = next_state
+        self._masks[state] |= mask
+
+    def build(self) -> None:
+        """Compute failure links and the full state x character table."""
+        fail = [0] * len(self._goto)
+        masks = list(self._masks)
+        table: List[Dict[str, int]] = [dict() for _ in self._goto]
+        table[0] = dict(self._goto[0])
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            # BFS order guarantees the failure state's row is already final.
+            for char, child in self._goto[state].items():
+                fail[child] = table[fail[state]].get(char, 0)
+                queue.append(child)
+            masks[state] |= masks[fail[state]]
+            row = dict(table[fail[state]])
+            row.update(self._goto[state])
+            table[state] = {char: target for char, target in row.items() if target}
+
+        self.table = table
+        self.masks = masks
+
+    def step(self, state: int, char: str) -> int:
+        """Advance from state on char and return the new state."""
+        return self.table[state].get(char, 0)
+
+    def search(self, text: str) -> int:
+        """OR of the masks of every pattern occurring in text."""
+        table = self.table
+        masks = self.masks
+        state = 0
+        found = 0
+        for char in text:
+            state = table[state].get(char, 0)
+            found |= masks[state]
+        return found
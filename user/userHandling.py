@@ -1,41 +1,64 @@
 import os
 import time
 import base64
+import hashlib
 import json
 import logging
-import bcrypt
+import hmac
 import re
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict, List, Tuple
 from datetime import datetime, timedelta
 from .passwordValidator import PasswordValidator
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from .breachCorpus import BreachCorpus
+from .userStore import UserStore
+from .loginLimiter import LoginLimiter
+from .keyDerivation import (
+    DECOY_SALT, calibrate_iterations, derive_key, new_kdf_params, key_check, key_cache
+)
+from telemetry import metrics
+from audit import auditLog
+from vault.keyGeneration import write_key_generation
+
+class RegistrationError(ValueError):
+    """A signup was rejected; errors lists individual password rule failures."""
+
+    def __init__(self, message: str, errors: Optional[List[str]] = None):
+        super().__init__(message)
+        self.errors = errors or []
+
 
 class UserHandling:
-    def __init__(self, users_file: str = 'users.json'):
-        self.users_file = users_file
-        self.password_validator = PasswordValidator()
+    def __init__(self, users_file: str = 'users.json', users_dir: str = 'users',
+                 breach_corpus_file: str = 'breached_passwords.nvbc'):
+        self.users_file = users_file  # legacy monolithic store, imported once
+        self.users_dir = users_dir
+        self.password_validator = PasswordValidator(
+            breach_corpus=self._load_breach_corpus(breach_corpus_file)
+        )
         self.max_login_attempts = 5
         self.lockout_duration = timedelta(minutes=15)
+        self.kdf_target_seconds = 0.25  # KDF latency aimed for on this host
         
-        # Set up logging
-        logging.basicConfig(
-            filename='users.log',
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s'
-        )
+        # Application log; security events also go to the audit log
+        auditLog.configure_logging('users.log')
         
-        self._initialize_users_file()
-    
-    def _initialize_users_file(self) -> None:
-        if not os.path.exists(self.users_file):
-            with open(self.users_file, 'w') as f:
-                json.dump({
-                    "users": {},
-                    "email_index": {},  # New index to track email usage
-                    "failed_attempts": {},
-                    "lockouts": {}
-                }, f, indent=4)
+        self.store = UserStore(self.users_dir, legacy_file=self.users_file)
+        self.login_limiter = LoginLimiter(
+            os.path.join(self.users_dir, 'lockouts.json'),
+            max_attempts=self.max_login_attempts,
+            window=self.lockout_duration.total_seconds(),
+            lockout=self.lockout_duration.total_seconds()
+        )
+
+    def _load_breach_corpus(self, path: str) -> Optional[BreachCorpus]:
+        """Open the offline breach corpus if one has been built."""
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            return BreachCorpus(path)
+        except Exception as e:
+            logging.error(f"Error opening breach corpus {path}: {str(e)}")
+            return None
 
     def _is_valid_email(self, email: str) -> bool:
         pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
@@ -43,16 +66,137 @@ class UserHandling:
 
     def _is_email_taken(self, email: str) -> bool:
         try:
-            with open(self.users_file, 'r') as f:
-                data = json.load(f)
-            return email.lower() in data.get("email_index", {})
+            return self.store.is_email_taken(email)
         except Exception as e:
             logging.error(f"Error checking email: {str(e)}")
             return False
 
     def _normalize_username(self, username: str) -> str:
-        return username.strip().lower()
+        return UserStore.normalize_username(username)
+
+    def _generate_master_key(self, password: str) -> Dict:
+        """
+        Create the key-derivation material for a new master password.
+
+        A fresh salt is drawn and the iteration count is calibrated to
+        kdf_target_seconds on this host. Only the parameters and a key check
+        value are returned for storage; the derived key itself is cached.
+        """
+        params = new_kdf_params(calibrate_iterations(self.kdf_target_seconds))
+        key = key_cache.derive(password, base64.b64decode(params["salt"]), params["iterations"])
+        params["key_check"] = key_check(key)
+        return params
+
+    def verify_login(self, username: str, password: str, source: Optional[str] = None) -> Optional[str]:
+        """
+        Check a username and master password.
+
+        A user or source locked out by login_limiter is refused before any
+        key derivation is done.
+
+        Args:
+            username (str): Username to log in
+            password (str): Master password
+            source (str): Client address, for per-source limits
+
+        Returns:
+            The user's derived vault key on success, otherwise None
+        """
+        if self.login_limiter.retry_after(username, source) > 0:
+            logging.warning(f"Refused login for locked out user: {username}")
+            metrics.increment('user.login_locked')
+            auditLog.record('login', username, outcome='locked', source=source)
+            return None
+        with metrics.timed('user.login'):
+            key = self._check_login(username, password)
+        metrics.increment('user.login_succeeded' if key is not None else 'user.login_failed')
+        if key is None:
+            locked_for = self.login_limiter.record_failure(username, source)
+            auditLog.record('login', username, outcome='failed', source=source)
+            if locked_for > 0:
+                auditLog.record('lockout', username, seconds=round(locked_for), source=source)
+        else:
+            self.login_limiter.record_success(username, source)
+            auditLog.record('login', username, outcome='success', source=source)
+        return key
+
+    def _check_login(self, username: str, password: str) -> Optional[str]:
+        try:
+            if os.path.exists(self.rotation_checkpoint_path(username)):
+                self.finish_key_rotation(username)
+            user = self.store.get_user(username)
+            if user is None or "kdf" not in user:
+                # Spend the same KDF time as a real login (uncached), so the
+                # response time does not tell which accounts exist
+                derive_key(password, DECOY_SALT, calibrate_iterations(self.kdf_target_seconds))
+                logging.warning(f"Failed login for unknown user: {username}")
+                return None
+
+            kdf = user["kdf"]
+            matches = lambda candidate: hmac.compare_digest(key_check(candidate), kdf["key_check"])
+            key = key_cache.derive(password, base64.b64decode(kdf["salt"]), kdf["iterations"], verify=matches)
+            if not matches(key):
+                logging.warning(f"Failed login for user: {username}")
+                return None
+
+            # Re-read under the store lock: a password change since the KDF invalidates this key
+            with self.store.file_lock:
+                if self.store.get_user(username).get("kdf") != kdf:
+                    logging.warning(f"Master password of {username} changed during login")
+                    return None
+                self.store.update_user(username, last_login=datetime.now().isoformat())
+            logging.info(f"User logged in: {username}")
+            return key.decode()
+        except Exception as e:
+            logging.error(f"Error verifying login: {str(e)}")
+            return None
     
+    def rotation_checkpoint_path(self, username: str) -> str:
+        """Where vault.keyRotation keeps the checkpoint of a user's master password change."""
+        name = hashlib.sha256(self._normalize_username(username).encode()).hexdigest()[:32]
+        return os.path.join(self.users_dir, 'rotations', f'{name}.json')
+
+    def finish_key_rotation(self, username: str) -> bool:
+        """
+        Commit a master password change whose vault switch has begun.
+
+        Records the new key generation in the vault's key.json, which makes
+        processes holding the old key stop using the vault, moves the
+        re-encrypted vault and the re-sealed sync key into place if that has
+        not happened yet and replaces the user's KDF material with the new one. It needs no
+        secret, so a login runs it after a rotation was interrupted.
+
+        Returns:
+            bool: True if a rotation was committed
+        """
+        path = self.rotation_checkpoint_path(username)
+        try:
+            with open(path, 'r') as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return False
+        if checkpoint.get("phase") != "switch":
+            return False
+        new_kdf = checkpoint["new_kdf"]
+        write_key_generation(os.path.dirname(checkpoint["data_file"]), new_kdf.get("generation", 1),
+                             new_kdf["key_check"])
+        if os.path.exists(checkpoint["rotated_path"]):
+            # An SQLite log or shared-memory file of the old database must not be applied to the new one
+            for leftover in (checkpoint["data_file"] + '-wal', checkpoint["data_file"] + '-shm'):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+            os.replace(checkpoint["rotated_path"], checkpoint["data_file"])
+        sync_key_path = checkpoint.get("sync_key_path")
+        if sync_key_path and os.path.exists(sync_key_path + '.rotated'):
+            os.replace(sync_key_path + '.rotated', sync_key_path)
+        self.store.update_user(username, kdf=new_kdf)
+        for leftover in (checkpoint["shadow_path"], path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        logging.info(f"Master password changed for user: {username}")
+        auditLog.record('password_changed', username)
+        return True
+
     def clear_screen():
         time.sleep(5)
         if os.name == 'nt':
@@ -60,49 +204,77 @@ class UserHandling:
         else:
             os.system('clear')
 
+    def username_error(self, username: str) -> Optional[str]:
+        """Why a username cannot be registered, or None if it can."""
+        if len(self._normalize_username(username)) < 3:
+            return "Username must be at least 3 characters"
+        if self.store.username_exists(username):
+            return "Username already exists"
+        return None
+
+    def email_error(self, email: str) -> Optional[str]:
+        """Why an email address cannot be registered, or None if it can."""
+        if not self._is_valid_email(email):
+            return "Invalid email format"
+        if self._is_email_taken(email):
+            return "Email address is already registered"
+        return None
+
+    def register_user(self, username: str, email: str, password: str) -> Dict:
+        """
+        Register a new user without any console interaction.
+
+        Returns:
+            Dict with the registered "username" and "email"
+
+        Raises:
+            RegistrationError: If the username, email or password is rejected
+        """
+        username = username.strip()
+        email = email.strip().lower()
+        for error in (self.username_error(username), self.email_error(email)):
+            if error:
+                raise RegistrationError(error)
+        is_valid, errors = self.password_validator.validate(password)
+        if not is_valid:
+            raise RegistrationError("Password does not meet requirements", errors)
+
+        # Derive key material and save the user record and its email index entry
+        kdf = self._generate_master_key(password)
+        try:
+            self.store.add_user(username, {
+                "kdf": kdf,
+                "email": email,
+                "created_at": datetime.now().isoformat(),
+                "last_login": None
+            })
+        except ValueError as e:
+            raise RegistrationError(str(e))
+
+        logging.info(f"Created new user: {username} with email: {email}")
+        auditLog.record('signup', username)
+        return {"username": username, "email": email}
+
     def create_user(self) -> Optional[Dict]:
+        """Interactive console registration built on register_user."""
         print("\n=== User Registration ===")
         try:
-            # Username validation with normalization
             username = input("Username (min 3 characters): ").strip()
-            normalized_username = self._normalize_username(username)
-            
-            if len(normalized_username) < 3:
-                print("Username must be at least 3 characters!")
+            error = self.username_error(username)
+            if error:
+                print(f"{error}!")
                 return None
 
-            # Email validation
             while True:
                 email = input("Email address: ").strip().lower()
-                if not self._is_valid_email(email):
-                    print("Invalid email format!")
-                    if input("Try again? (y/n): ").lower() != 'y':
-                        return None
-                    continue
-                
-                if self._is_email_taken(email):
-                    print("Email address is already registered!")
+                error = self.email_error(email)
+                if error:
+                    print(f"{error}!")
                     if input("Try again? (y/n): ").lower() != 'y':
                         return None
                     continue
                 break
 
-            with open(self.users_file, 'r') as f:
-                data = json.load(f)
-
-            # Check for existing username (case-insensitive)
-            if any(self._normalize_username(existing_user) == normalized_username 
-                  for existing_user in data["users"]):
-                print("Username already exists!")    
-                time.sleep(2.5) # wait for 2.5 seconds or 5 seconds?
-                if os.name == 'nt':
-                    os.system('cls')
-                else:
-                    os.system('clear')
-                # might work?
-                return None
-
-            # Password validation
             while True:
                 password = input("Password: ")
                 is_valid, errors = self.password_validator.validate(password)
@@ -126,27 +298,11 @@ class UserHandling:
                     
                 break
 
-            # Generate master key and save user
-            master_key = self._generate_master_key(password)
-            
-            # Update user data
-            data["users"][username] = {
-                "master_key": master_key,
-                "email": email,
-                "created_at": datetime.now().isoformat(),
-                "last_login": None
-            }
-            
-            # Update email index
-            data["email_index"] = data.get("email_index", {})
-            data["email_index"][email] = username
-            
-            with open(self.users_file, 'w') as f:
-                json.dump(data, f, indent=4)
-
-            logging.info(f"Created new user: {username} with email: {email}")
-            return {"username": username, "email": email, "master_key": master_key}
+            return self.register_user(username, email, password)
 
+        except RegistrationError as e:
+            print(f"{str(e)}!")
+            return None
         except Exception as e:
             logging.error(f"Error creating user: {str(e)}")
             print("An error occurred during registration.")
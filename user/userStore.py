@@ -0,0 +1,185 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Dict, Iterator, Optional, Tuple
+
+from telemetry import metrics
+from vault.fileLock import FileLock
+
+
+class UserStore:
+    """
+    Sharded, indexed storage for user records.
+
+    User records live in ``<base_dir>/records/<shard>.json`` keyed by the
+    normalized username, and the email index lives in
+    ``<base_dir>/emails/<shard>.json``. The shard is a short hash prefix of the
+    key, so a signup only rewrites one small record shard and one small email
+    shard, and username/email checks are dict lookups in a single cached shard.
+
+    Several processes may share a store. A cached shard is re-read once its
+    file's inode, size or mtime changes, and every read-modify-write holds a
+    file lock on the store, so no process writes back a stale copy.
+    """
+
+    def __init__(self, base_dir: str = 'users', legacy_file: Optional[str] = 'users.json',
+                 shard_prefix_len: int = 2):
+        """
+        Args:
+            base_dir (str): Directory holding the record and email shards
+            legacy_file (str): Monolithic users.json to import on first use
+            shard_prefix_len (int): Hex digits of the key hash used as shard name
+        """
+        self.base_dir = base_dir
+        self.records_dir = os.path.join(base_dir, 'records')
+        self.emails_dir = os.path.join(base_dir, 'emails')
+        self.shard_prefix_len = shard_prefix_len
+        self._lock = threading.RLock()
+        self._shards: Dict[str, Tuple[Optional[Tuple], Dict]] = {}  # shard path -> (file stamp, contents)
+
+        is_new = not os.path.isdir(self.records_dir)
+        os.makedirs(self.records_dir, exist_ok=True)
+        os.makedirs(self.emails_dir, exist_ok=True)
+        self.file_lock = FileLock(os.path.join(base_dir, 'store'))
+        if is_new and legacy_file and os.path.exists(legacy_file):
+            self._import_legacy(legacy_file)
+
+    @staticmethod
+    def normalize_username(username: str) -> str:
+        return username.strip().lower()
+
+    @staticmethod
+    def normalize_email(email: str) -> str:
+        return email.strip().lower()
+
+    def _shard_path(self, directory: str, key: str) -> str:
+        shard = hashlib.sha256(key.encode()).hexdigest()[:self.shard_prefix_len]
+        return os.path.join(directory, f'{shard}.json')
+
+    @staticmethod
+    def _stamp(path: str) -> Optional[Tuple]:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _load_shard(self, path: str) -> Dict:
+        """Shard contents, re-read if the file changed since it was cached."""
+        stamp = self._stamp(path)
+        cached = self._shards.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        try:
+            with metrics.timed('userstore.shard.read'):
+                with open(path, 'r') as f:
+                    shard = json.load(f)
+        except FileNotFoundError:
+            shard = {}
+        self._shards[path] = (stamp, shard)
+        return shard
+
+    def _write_shard(self, path: str, shard: Dict) -> None:
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with metrics.timed('userstore.shard.write'):
+            with open(tmp_path, 'w') as f:
+                json.dump(shard, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        self._shards[path] = (self._stamp(path), shard)
+
+    def _import_legacy(self, legacy_file: str) -> None:
+        """Split an old monolithic users.json into shards."""
+        try:
+            with open(legacy_file, 'r') as f:
+                data = json.load(f)
+        except Exception as e:
+            logging.error(f"Error reading legacy user file {legacy_file}: {str(e)}")
+            return
+
+        with self.file_lock:
+            self._import_shards(data)
+        logging.info(f"Imported {len(data.get('users', {}))} users from {legacy_file}")
+
+    def _import_shards(self, data: Dict) -> None:
+        touched = {}
+        for username, record in data.get("users", {}).items():
+            path = self._shard_path(self.records_dir, self.normalize_username(username))
+            touched.setdefault(path, dict(self._load_shard(path)))[self.normalize_username(username)] = \
+                {"username": username, **record}
+            email = record.get("email")
+            if email:
+                path = self._shard_path(self.emails_dir, self.normalize_email(email))
+                touched.setdefault(path, dict(self._load_shard(path)))[self.normalize_email(email)] = username
+        for path, shard in touched.items():
+            self._write_shard(path, shard)
+
+    def username_exists(self, username: str) -> bool:
+        key = self.normalize_username(username)
+        with self._lock:
+            return key in self._load_shard(self._shard_path(self.records_dir, key))
+
+    def email_owner(self, email: str) -> Optional[str]:
+        """Return the username registered with this email, if any."""
+        key = self.normalize_email(email)
+        with self._lock:
+            return self._load_shard(self._shard_path(self.emails_dir, key)).get(key)
+
+    def is_email_taken(self, email: str) -> bool:
+        return self.email_owner(email) is not None
+
+    def get_user(self, username: str) -> Optional[Dict]:
+        key = self.normalize_username(username)
+        with self._lock:
+            record = self._load_shard(self._shard_path(self.records_dir, key)).get(key)
+            return dict(record) if record is not None else None
+
+    def add_user(self, username: str, record: Dict) -> None:
+        """
+        Store a new user record and index its email.
+
+        Raises:
+            ValueError: If the username or email is already registered
+        """
+        key = self.normalize_username(username)
+        email = self.normalize_email(record["email"])
+        with self._lock, self.file_lock:
+            record_path = self._shard_path(self.records_dir, key)
+            email_path = self._shard_path(self.emails_dir, email)
+            records = self._load_shard(record_path)
+            emails = self._load_shard(email_path)
+            if key in records:
+                raise ValueError("Username already exists")
+            if email in emails:
+                raise ValueError("Email address is already registered")
+
+            # Write the email index first: a dangling email entry only blocks
+            # re-use of that address, whereas an unindexed user would allow a
+            # duplicate registration.
+            self._write_shard(email_path, {**emails, email: username})
+            self._write_shard(record_path, {**records, key: {"username": username, **record}})
+
+    def update_user(self, username: str, **fields) -> None:
+        """Update fields of an existing user record, as it is on disk now."""
+        key = self.normalize_username(username)
+        with self._lock, self.file_lock:
+            path = self._shard_path(self.records_dir, key)
+            records = self._load_shard(path)
+            if key not in records:
+                raise KeyError(username)
+            self._write_shard(path, {**records, key: {**records[key], **fields}})
+
+    def iter_users(self) -> Iterator[Dict]:
+        """Yield every user record, shard by shard."""
+        with self._lock:
+            names = sorted(os.listdir(self.records_dir))
+        for name in names:
+            if name.endswith('.json'):
+                with self._lock:
+                    shard = self._load_shard(os.path.join(self.records_dir, name))
+                    records = list(shard.values())
+                for record in records:
+                    yield dict(record)
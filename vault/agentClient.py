@@ -0,0 +1,115 @@
+import json
+import os
+import socket
+import tempfile
+from typing import Any, Dict, List, Optional
+
+# Error codes returned by the agent
+LOCKED = 'locked'
+NOT_FOUND = 'not_found'
+AUTH_FAILED = 'auth_failed'
+BAD_REQUEST = 'bad_request'
+
+
+class AgentError(Exception):
+    """An error reported by the agent, or the agent not being reachable."""
+
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+def default_socket_path() -> str:
+    """
+    Where the agent listens: $NAITEVARNASSE_AGENT_SOCK, else a private
+    directory under $XDG_RUNTIME_DIR or the temp directory.
+    """
+    path = os.environ.get('NAITEVARNASSE_AGENT_SOCK')
+    if path:
+        return path
+    base = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    uid = os.getuid() if hasattr(os, 'getuid') else 0
+    return os.path.join(base, f'naitevarnasse-{uid}', 'agent.sock')
+
+
+class AgentClient:
+    """
+    Blocking client for the vault agent.
+
+    Every request opens a connection, sends one JSON line and reads one JSON
+    line back. Only the standard library is used, so callers such as cli.py
+    can talk to the agent without importing the vault or crypto modules.
+    """
+
+    def __init__(self, path: Optional[str] = None, timeout: float = 30.0):
+        """
+        Args:
+            path (str): Agent socket (default: default_socket_path())
+            timeout (float): Seconds to wait for a reply; unlocking runs the KDF
+        """
+        self.path = path or default_socket_path()
+        self.timeout = timeout
+
+    def is_running(self) -> bool:
+        if not hasattr(socket, 'AF_UNIX') or not os.path.exists(self.path):
+            return False
+        try:
+            self.request('ping')
+            return True
+        except AgentError:
+            return False
+
+    def request(self, op: str, **params) -> Any:
+        """
+        Send one request and return its result.
+
+        Raises:
+            AgentError: If the agent is unreachable or reports an error
+        """
+        if not hasattr(socket, 'AF_UNIX'):
+            raise AgentError('unavailable', "Unix domain sockets are not supported on this platform")
+        message = json.dumps({"op": op, **params}).encode() + b'\n'
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.path)
+                sock.sendall(message)
+                reply = b''
+                while not reply.endswith(b'\n'):
+                    chunk = sock.recv(65536)
+                    if not chunk:
+                        break
+                    reply += chunk
+        except OSError as e:
+            raise AgentError('unavailable', f"Vault agent not reachable at {self.path}: {e}")
+        if not reply:
+            raise AgentError('unavailable', "Vault agent closed the connection")
+        response = json.loads(reply)
+        if not response.get("ok"):
+            raise AgentError(response.get("code", BAD_REQUEST), response.get("error", "Agent request failed"))
+        return response.get("result")
+
+    def status(self) -> Dict:
+        return self.request('status')
+
+    def unlock(self, username: str, password: Optional[str] = None, key: Optional[str] = None) -> Dict:
+        """Unlock with the master password, or with a key already derived by a login."""
+        return self.request('unlock', username=username, password=password, key=key)
+
+    def lock(self) -> None:
+        self.request('lock')
+
+    def stop(self) -> None:
+        self.request('stop')
+
+    def get(self, service: str, username: Optional[str] = None) -> Dict:
+        return self.request('get', service=service, username=username)
+
+    def add(self, service: str, username: str, password: str, email: str = '', force: bool = False) -> None:
+        self.request('add', service=service, username=username, password=password, email=email, force=force)
+
+    def delete(self, service: str, username: str) -> None:
+        self.request('delete', service=service, username=username)
+
+    def list(self, query: Optional[str] = None, limit: Optional[int] = None) -> List[Dict]:
+        return self.request('list', query=query, limit=limit)
@@ -0,0 +1,370 @@
+"""
+Vault agent daemon.
+
+Holds one unlocked vault in memory and serves it over a Unix domain socket,
+in the spirit of ssh-agent, so repeated CLI calls skip the KDF and do not
+re-read the vault file:
+
+    python -m vault.agentServer --idle-timeout 900
+
+Run from the repository root, or start it with ``python cli.py agent start``.
+"""
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import os
+import signal
+import socket
+import struct
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from user.keyDerivation import key_cache, key_check
+from user.userHandling import UserHandling
+from .agentClient import AgentClient, default_socket_path, LOCKED, NOT_FOUND, AUTH_FAILED, BAD_REQUEST
+from .storage import credential_key
+from .vaultManager import VaultManager
+
+
+class AgentRequestError(Exception):
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+class VaultAgent:
+    """
+    Serves get/add/delete/list requests for one unlocked vault.
+
+    After an unlock the agent keeps the VaultManager (and with it the derived
+    key and decrypted-field cache), a parsed snapshot of the stored records
+    and the search index. The snapshot is reloaded only when the vault file's
+    size, mtime or inode changes, so lookups are dictionary reads.
+
+    Requests are newline-delimited JSON handled on the event loop thread;
+    only the KDF of an unlock runs in the default executor. The socket is
+    created mode 0600 inside a 0700 directory and connections from other
+    users are refused. The vault is locked again after idle_timeout seconds
+    without requests, and at the next request after its master password
+    was changed.
+    """
+
+    def __init__(self, socket_path: Optional[str] = None, idle_timeout: float = 900,
+                 users_dir: str = 'users', users_file: str = 'users.json',
+                 vault_dir: str = 'userApps', storage: str = 'json'):
+        """
+        Args:
+            socket_path (str): Socket to listen on (default: default_socket_path())
+            idle_timeout (float): Seconds without requests before the vault is locked
+            users_dir (str): User store directory
+            users_file (str): Legacy user file imported on first use
+            vault_dir (str): Base directory for user vaults
+            storage (str): Vault storage engine
+        """
+        self.socket_path = os.path.abspath(socket_path or default_socket_path())
+        self.idle_timeout = idle_timeout
+        self.vault_dir = vault_dir
+        self.storage = storage
+        self.user_handling = UserHandling(users_file=users_file, users_dir=users_dir,
+                                          breach_corpus_file=None)
+        self.vault_manager: Optional[VaultManager] = None
+        self.last_activity = time.monotonic()
+        self._records: Dict[Tuple[str, str], Dict] = {}
+        self._by_service: Dict[str, List[str]] = {}
+        self._stamp = None
+        self._server = None
+        self._stopped: Optional[asyncio.Event] = None
+
+    # Vault state
+
+    def _vault_stamp(self):
+        """Identity of the vault files on disk; changes whenever they are written."""
+        stamp = []
+        for path in (self.vault_manager.data_file, self.vault_manager.data_file + '-wal'):
+            try:
+                stat = os.stat(path)
+                stamp.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def _snapshot(self) -> Dict[Tuple[str, str], Dict]:
+        """The stored records, reloaded only if the vault changed on disk."""
+        stamp = self._vault_stamp()
+        if stamp != self._stamp:
+            records = {}
+            by_service: Dict[str, List[str]] = {}
+            for cred in self.vault_manager.storage.iter_credentials():
+                records[credential_key(cred["service"], cred["username"])] = cred
+                by_service.setdefault(cred["service"], []).append(cred["username"])
+            self._records, self._by_service, self._stamp = records, by_service, stamp
+            if self.vault_manager.search_index_built:
+                self.vault_manager.invalidate_search_index()
+        return self._records
+
+    def _apply_write(self, was_current: bool, service: str, username: str, record: Optional[Dict]) -> None:
+        """
+        Apply one of the agent's own writes to the snapshot instead of reloading it.
+
+        Called with the vault's file lock held across the write, so if the
+        snapshot was current before it, the only change since is this one.
+        VaultManager already updated the search index for the entry.
+        """
+        if not was_current:
+            return  # another process wrote first; the next _snapshot reloads
+        key = credential_key(service, username)
+        usernames = self._by_service.get(service, [])
+        if record is None:
+            self._records.pop(key, None)
+            if username in usernames:
+                usernames.remove(username)
+                if not usernames:
+                    del self._by_service[service]
+        else:
+            if key not in self._records:
+                self._by_service.setdefault(service, []).append(username)
+            self._records[key] = record
+        self._stamp = self._vault_stamp()
+
+    def _require_unlocked(self) -> VaultManager:
+        if self.vault_manager is None:
+            raise AgentRequestError(LOCKED, "Vault is locked")
+        if not self.vault_manager.key_is_current():
+            self.lock()
+            raise AgentRequestError(LOCKED, "The master password was changed; unlock the agent again")
+        return self.vault_manager
+
+    def _open(self, username: str, master_key: str) -> None:
+        self._close_vault()
+        self.vault_manager = VaultManager(master_key, username, base_dir=self.vault_dir, storage=self.storage)
+        self._snapshot()
+        logging.info(f"Agent unlocked vault for {username}")
+
+    def _close_vault(self) -> None:
+        if self.vault_manager is not None:
+            self.vault_manager.close()
+            logging.info(f"Agent locked vault for {self.vault_manager.username}")
+        self.vault_manager = None
+        self._records, self._by_service, self._stamp = {}, {}, None
+        key_cache.clear()
+
+    def lock(self) -> None:
+        self._close_vault()
+
+    # Request handlers
+
+    async def op_ping(self, request: Dict):
+        return "pong"
+
+    async def op_status(self, request: Dict):
+        return {
+            "locked": self.vault_manager is None,
+            "username": self.vault_manager.username if self.vault_manager else None,
+            "entries": len(self._records),
+            "idle_timeout": self.idle_timeout,
+            "idle_seconds": round(time.monotonic() - self.last_activity, 1),
+        }
+
+    async def op_unlock(self, request: Dict):
+        """Unlock with a master password (runs the KDF) or an already derived key."""
+        username = request.get("username") or ''
+        user = self.user_handling.store.get_user(username)
+        if user is None:
+            raise AgentRequestError(AUTH_FAILED, "Invalid username or master password")
+        if request.get("key"):
+            master_key = request["key"]
+            if "kdf" not in user or not hmac.compare_digest(key_check(master_key.encode()), user["kdf"]["key_check"]):
+                raise AgentRequestError(AUTH_FAILED, "Invalid username or master key")
+        else:
+            loop = asyncio.get_running_loop()
+            master_key = await loop.run_in_executor(
+                None, self.user_handling.verify_login, username, request.get("password") or ''
+            )
+            if master_key is None:
+                raise AgentRequestError(AUTH_FAILED, "Invalid username or master password")
+        self._open(user["username"], master_key)
+        return {"username": user["username"], "entries": len(self._records)}
+
+    async def op_lock(self, request: Dict):
+        self.lock()
+
+    async def op_get(self, request: Dict):
+        vault_manager = self._require_unlocked()
+        records = self._snapshot()
+        service = request.get("service") or ''
+        username = request.get("username")
+        if username is None:
+            usernames = self._by_service.get(service, [])
+            if len(usernames) > 1:
+                raise AgentRequestError(BAD_REQUEST, f"Several accounts for {service} ({', '.join(usernames)}); give a username")
+            username = usernames[0] if usernames else ''
+        cred = records.get(credential_key(service, username))
+        if cred is None:
+            raise AgentRequestError(NOT_FOUND, f"No credentials for {service}" + (f" / {username}" if username else ''))
+        return vault_manager.decrypt_credentials(cred)
+
+    async def op_add(self, request: Dict):
+        vault_manager = self._require_unlocked()
+        service, username = request.get("service") or '', request.get("username") or ''
+        # Writes run on the loop thread: they are short, and the search index
+        # they update is not shared with other threads
+        with vault_manager.storage.file_lock:
+            if not request.get("force") and credential_key(service, username) in self._snapshot():
+                raise AgentRequestError(BAD_REQUEST, f"Credentials for {service} / {username} exist; use --force to replace")
+            was_current = self._vault_stamp() == self._stamp
+            if not vault_manager.add_credentials(username, request.get("password") or '',
+                                                 request.get("email") or '', service):
+                raise AgentRequestError(BAD_REQUEST, "Failed to add credentials")
+            self._apply_write(was_current, service, username, vault_manager.storage.get(service, username))
+
+    async def op_delete(self, request: Dict):
+        vault_manager = self._require_unlocked()
+        service, username = request.get("service") or '', request.get("username") or ''
+        with vault_manager.storage.file_lock:
+            was_current = self._vault_stamp() == self._stamp
+            if not vault_manager.delete_credentials(service, username):
+                raise AgentRequestError(NOT_FOUND, f"No credentials for {service} / {username}")
+            self._apply_write(was_current, service, username, None)
+
+    async def op_list(self, request: Dict):
+        vault_manager = self._require_unlocked()
+        records = self._snapshot()
+        limit = request.get("limit")
+        if request.get("query"):
+            matches = vault_manager.search_index.search(request["query"], limit or 10)
+            return [{"service": s, "username": u} for s, u, _ in matches]
+        keys = list(records)[:limit] if limit else list(records)
+        return [{"service": s, "username": u} for s, u in keys]
+
+    async def op_stop(self, request: Dict):
+        self.lock()
+        self._stopped.set()
+
+    # Server plumbing
+
+    def _peer_allowed(self, writer: asyncio.StreamWriter) -> bool:
+        """Only accept connections from processes running as the same user."""
+        sock = writer.get_extra_info('socket')
+        if sock is None or not hasattr(socket, 'SO_PEERCRED'):
+            return True  # the 0700 directory and 0600 socket still apply
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        _, uid, _ = struct.unpack('3i', creds)
+        return uid == os.getuid()
+
+    async def _dispatch(self, line: bytes) -> Dict:
+        try:
+            request = json.loads(line)
+            handler = getattr(self, f"op_{request.get('op')}", None)
+            if handler is None:
+                raise AgentRequestError(BAD_REQUEST, f"Unknown operation: {request.get('op')}")
+            if request.get('op') not in ('ping', 'status'):
+                self.last_activity = time.monotonic()
+            return {"ok": True, "result": await handler(request)}
+        except AgentRequestError as e:
+            return {"ok": False, "code": e.code, "error": str(e)}
+        except (ValueError, AttributeError) as e:
+            return {"ok": False, "code": BAD_REQUEST, "error": f"Malformed request: {str(e)}"}
+        except Exception as e:
+            logging.error(f"Error handling agent request: {str(e)}")
+            return {"ok": False, "code": "internal", "error": str(e)}
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            if not self._peer_allowed(writer):
+                logging.warning("Refused agent connection from another user")
+                return
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self._dispatch(line)
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _watch_idle(self) -> None:
+        interval = max(0.05, min(self.idle_timeout / 4, 30))
+        while True:
+            await asyncio.sleep(interval)
+            if self.vault_manager is not None and time.monotonic() - self.last_activity >= self.idle_timeout:
+                logging.info("Agent idle timeout reached")
+                self.lock()
+
+    def _prepare_socket_path(self) -> None:
+        """
+        Create the socket's directory private to the user, or check that an
+        existing one is; a directory the agent did not create is never chmodded.
+
+        Raises:
+            RuntimeError: If the directory belongs to someone else or others can write to it
+        """
+        directory = os.path.dirname(self.socket_path)
+        try:
+            os.makedirs(directory, 0o700)
+            os.chmod(directory, 0o700)  # the mode given to makedirs is filtered by the umask
+        except FileExistsError:
+            stat = os.stat(directory)
+            if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+                raise RuntimeError(f"{directory} must belong to you and not be writable by others; "
+                                   f"choose another --socket")
+        if os.path.exists(self.socket_path):
+            if AgentClient(self.socket_path, timeout=1).is_running():
+                raise RuntimeError(f"An agent is already listening on {self.socket_path}")
+            os.remove(self.socket_path)  # stale socket from a crashed agent
+
+    async def serve(self) -> None:
+        """Listen until a stop request or SIGTERM/SIGINT arrives."""
+        self._prepare_socket_path()
+        self._stopped = asyncio.Event()
+        old_umask = os.umask(0o177)
+        try:
+            self._server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        finally:
+            os.umask(old_umask)
+        os.chmod(self.socket_path, 0o600)
+
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self._stopped.set)
+        watcher = asyncio.create_task(self._watch_idle())
+        logging.info(f"Vault agent listening on {self.socket_path}")
+        try:
+            await self._stopped.wait()
+        finally:
+            watcher.cancel()
+            self._server.close()
+            await self._server.wait_closed()
+            self.lock()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            logging.info("Vault agent stopped")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--socket', help="socket path (default: %(default)s)", default=default_socket_path())
+    parser.add_argument('--idle-timeout', type=float, default=900, help="seconds before auto-lock")
+    parser.add_argument('--users-dir', default='users')
+    parser.add_argument('--users-file', default='users.json')
+    parser.add_argument('--vault-dir', default='userApps')
+    parser.add_argument('--storage', default='json')
+    args = parser.parse_args(argv)
+
+    agent = VaultAgent(args.socket, args.idle_timeout, args.users_dir, args.users_file,
+                       args.vault_dir, args.storage)
+    try:
+        asyncio.run(agent.serve())
+    except (RuntimeError, OSError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
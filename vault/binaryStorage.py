@@ -0,0 +1,386 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import mmap
+import os
+import struct
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from telemetry import metrics
+from .fileLock import FileLock
+from .groupCommit import GroupCommitQueue
+from .storage import VaultStorage, JsonStorage
+
+MAGIC = b'NVBV'
+FORMAT_VERSION = 1
+CIPHERS = {'aes-gcm': (1, AESGCM), 'chacha20-poly1305': (2, ChaCha20Poly1305)}
+CIPHER_NAMES = {cipher_id: name for name, (cipher_id, _) in CIPHERS.items()}
+
+# magic, format version, cipher id, (pad), file id, record count,
+# order table offset, index table offset; followed by a 32 byte HMAC
+HEADER = struct.Struct('<4sHBx16sIQQ')
+MAC_SIZE = 32
+DATA_START = HEADER.size + MAC_SIZE
+LENGTH = struct.Struct('<I')
+FIELDS = struct.Struct('<IIII')  # byte lengths of service, username, password, email
+ORDER_ENTRY = struct.Struct('<Q12s')  # record offset, nonce
+INDEX_ENTRY = struct.Struct('<16sI')  # lookup tag, record number
+TAG_SIZE = 16
+NONCE_SIZE = 12
+
+
+def record_keys(vault_key: bytes) -> Tuple[bytes, bytes]:
+    """
+    Split a vault key into the record encryption key and the lookup/MAC key.
+
+    Args:
+        vault_key (bytes): The user's urlsafe-base64 vault (Fernet) key
+    """
+    material = HKDF(algorithm=hashes.SHA256(), length=64, salt=None,
+                    info=b'naitevarnasse-binary-vault-v1').derive(base64.urlsafe_b64decode(vault_key))
+    return material[:32], material[32:]
+
+
+def encode_record(record: Dict) -> bytes:
+    fields = [record[name].encode() for name in ("service", "username", "password", "email")]
+    return FIELDS.pack(*map(len, fields)) + b''.join(fields)
+
+
+def decode_record(data: bytes) -> Dict:
+    lengths = FIELDS.unpack_from(data)
+    record, position = {}, FIELDS.size
+    for name, length in zip(("service", "username", "password", "email"), lengths):
+        record[name] = data[position:position + length].decode()
+        position += length
+    return record
+
+
+class _VaultFile:
+    """
+    Read-only, memory-mapped view of one version of a binary vault file.
+
+    Layout (little-endian):
+
+        header   magic, version, cipher, file id, count, table offsets
+        mac      HMAC-SHA256 of the header and both tables
+        records  count x (u32 length, AEAD ciphertext), in insertion order
+        order    count x (u64 record offset, 12 byte nonce)
+        index    count x (16 byte lookup tag, u32 record number), sorted by tag
+
+    The lookup tag is a keyed HMAC of (service, username), so names are not
+    readable from the index. Opening checks the MAC over the header and
+    tables only; each record is authenticated by its own AEAD tag when it is
+    decrypted, with its nonce taken from the authenticated order table.
+    """
+
+    def __init__(self, path: str, aead_key: bytes, index_key: bytes):
+        with open(path, 'rb') as file:
+            self.stat = os.fstat(file.fileno())
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = self.data[:HEADER.size]
+        magic, version, cipher_id, self.file_id, self.count, self.order_offset, self.index_offset = \
+            HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a binary vault file")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported binary vault version {version} in {path}")
+        if cipher_id not in CIPHER_NAMES:
+            raise ValueError(f"Unknown cipher id {cipher_id} in {path}")
+        self.cipher = CIPHER_NAMES[cipher_id]
+        self.index_key = index_key
+        mac = hmac.new(index_key, header, hashlib.sha256)
+        mac.update(self.data[self.order_offset:self.index_offset + self.count * INDEX_ENTRY.size])
+        if not hmac.compare_digest(mac.digest(), self.data[HEADER.size:DATA_START]):
+            raise ValueError(f"Binary vault {path} failed authentication (wrong key or corrupted file)")
+        self.aead = CIPHERS[self.cipher][1](aead_key)
+        self.associated_data = header[:8] + self.file_id
+
+    def tag(self, service: str, username: str) -> bytes:
+        return lookup_tag(self.index_key, service, username)
+
+    def index_entry(self, position: int) -> Tuple[bytes, int]:
+        return INDEX_ENTRY.unpack_from(self.data, self.index_offset + position * INDEX_ENTRY.size)
+
+    def order_entry(self, number: int) -> Tuple[int, bytes]:
+        return ORDER_ENTRY.unpack_from(self.data, self.order_offset + number * ORDER_ENTRY.size)
+
+    def find(self, service: str, username: str) -> Optional[int]:
+        """Record number stored under (service, username), by binary search of the index."""
+        tag = self.tag(service, username)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset = self.index_offset + middle * INDEX_ENTRY.size
+            if self.data[offset:offset + TAG_SIZE] < tag:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count:
+            found, number = self.index_entry(low)
+            if found == tag:
+                return number
+        return None
+
+    def blob(self, number: int) -> Tuple[bytes, bytes]:
+        """Raw (nonce, length-prefixed ciphertext) of a record, for copying into a new file."""
+        offset, nonce = self.order_entry(number)
+        (length,) = LENGTH.unpack_from(self.data, offset)
+        return nonce, self.data[offset:offset + LENGTH.size + length]
+
+    def read(self, number: int) -> Dict:
+        nonce, blob = self.blob(number)
+        try:
+            with metrics.timed('crypto.decrypt'):
+                return decode_record(self.aead.decrypt(nonce, blob[LENGTH.size:], self.associated_data))
+        except InvalidTag:
+            raise ValueError(f"Vault record {number} failed authentication")
+
+    def tags(self) -> Dict[bytes, int]:
+        """Lookup tag -> record number for every record."""
+        return dict(self.index_entry(position) for position in range(self.count))
+
+
+def lookup_tag(index_key: bytes, service: str, username: str) -> bytes:
+    message = service.encode() + b'\0' + username.encode()
+    return hmac.new(index_key, message, hashlib.sha256).digest()[:TAG_SIZE]
+
+
+class BinaryStorage(VaultStorage):
+    """
+    Compact binary vault (``vault.nvb``) with whole-record encryption.
+
+    Every record is a single AES-GCM (or ChaCha20-Poly1305) ciphertext of
+    its four fields, instead of two Fernet tokens inside pretty-printed
+    JSON. The file is memory-mapped and a sorted table of keyed lookup tags
+    gives get() a binary search plus one decryption. Counting needs no
+    decryption, and listing decrypts each record once.
+
+    Writes follow JsonStorage: group commit, advisory lock, and a new file
+    renamed into place. Unchanged records are copied as ciphertext, so only
+    records that are added or replaced get encrypted. Because records are
+    encrypted here, VaultManager stores their fields as plaintext.
+    """
+
+    encrypts_records = True
+
+    def __init__(self, path: str, vault_key: bytes, cipher: str = 'aes-gcm', group_commit: bool = True):
+        """
+        Args:
+            path (str): Vault file
+            vault_key (bytes): The user's urlsafe-base64 vault key
+            cipher (str): AEAD used for new files, one of CIPHERS
+            group_commit (bool): Merge concurrent writes into shared rewrites
+        """
+        if cipher not in CIPHERS:
+            raise ValueError(f"Unknown cipher: {cipher}")
+        self.path = path
+        self.cipher = cipher
+        self.group_commit = group_commit
+        self._aead_key, self._index_key = record_keys(vault_key)
+        self._file: Optional[_VaultFile] = None
+        self.file_lock = FileLock(path)
+        self.commit_queue = GroupCommitQueue(self._commit_batch)
+        with self.file_lock:
+            if not os.path.exists(self.path):
+                self._write(os.urandom(16), cipher, [])
+                logging.info(f"Created new vault file: {self.path}")
+            self._current()
+
+    def _current(self) -> _VaultFile:
+        """The mapped file, re-opened if another writer replaced it."""
+        stat = os.stat(self.path)
+        current = self._file
+        if current is None or (stat.st_ino, stat.st_size, stat.st_mtime_ns) != \
+                (current.stat.st_ino, current.stat.st_size, current.stat.st_mtime_ns):
+            # The previous mapping stays valid for readers still holding it
+            with metrics.timed('storage.binary.open'):
+                current = _VaultFile(self.path, self._aead_key, self._index_key)
+            self._file = current
+        return current
+
+    def _write(self, file_id: bytes, cipher: str, entries: List[Tuple[bytes, bytes, bytes]]) -> None:
+        """
+        Write a complete vault file and rename it into place.
+
+        Args:
+            file_id (bytes): Identifier bound into every record's associated data
+            cipher (str): AEAD the records are encrypted with
+            entries: (lookup tag, nonce, length-prefixed ciphertext) in record order
+        """
+        order_offset = DATA_START + sum(len(blob) for _, _, blob in entries)
+        index_offset = order_offset + len(entries) * ORDER_ENTRY.size
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, CIPHERS[cipher][0], file_id, len(entries), order_offset, index_offset)
+        order, offset = bytearray(), DATA_START
+        for _, nonce, blob in entries:
+            order += ORDER_ENTRY.pack(offset, nonce)
+            offset += len(blob)
+        index = b''.join(INDEX_ENTRY.pack(tag, number)
+                         for tag, number in sorted((tag, n) for n, (tag, _, _) in enumerate(entries)))
+        mac = hmac.new(self._index_key, header + order + index, hashlib.sha256).digest()
+
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with metrics.timed('storage.binary.write'):
+            with open(tmp_path, 'wb') as file:
+                file.write(header + mac)
+                for _, _, blob in entries:
+                    file.write(blob)
+                file.write(order)
+                file.write(index)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.path)
+
+    def _commit_batch(self, operations: List[Tuple[str, list]]) -> List[int]:
+        """Apply queued puts/deletes with one locked rewrite."""
+        with self.file_lock:
+            self._guard_write()
+            current = self._current()
+            tags = current.tags()  # surviving old records
+            added: Dict[bytes, Dict] = {}
+            results = []
+            for kind, items in operations:
+                if kind == 'put':
+                    for record in items:
+                        tag = current.tag(record["service"], record["username"])
+                        tags.pop(tag, None)
+                        added.pop(tag, None)  # a replaced entry moves to the end
+                        added[tag] = record
+                    results.append(len(items))
+                else:
+                    removed = 0
+                    for service, username in items:
+                        tag = current.tag(service, username)
+                        if tags.pop(tag, None) is not None:
+                            removed += 1
+                        elif added.pop(tag, None) is not None:
+                            removed += 1
+                    results.append(removed)
+            if len(tags) == current.count and not added:
+                return results
+
+            surviving = sorted((number, tag) for tag, number in tags.items())
+            entries = [(tag, *current.blob(number)) for number, tag in surviving]
+            with metrics.timed('crypto.encrypt'):
+                for tag, record in added.items():
+                    nonce = os.urandom(NONCE_SIZE)
+                    ciphertext = current.aead.encrypt(nonce, encode_record(record), current.associated_data)
+                    entries.append((tag, nonce, LENGTH.pack(len(ciphertext)) + ciphertext))
+            self._write(current.file_id, current.cipher, entries)
+        return results
+
+    def _submit(self, operation: Tuple[str, list]) -> int:
+        if self.group_commit:
+            return self.commit_queue.submit(operation)
+        return self._commit_batch([operation])[0]
+
+    def list_credentials(self) -> List[Dict]:
+        return list(self.iter_credentials())
+
+    def iter_credentials(self, offset: int = 0, limit: Optional[int] = None) -> Iterator[Dict]:
+        current = self._current()
+        stop = current.count if limit is None else min(current.count, offset + limit)
+        for number in range(max(offset, 0), stop):
+            yield current.read(number)
+
+    def get(self, service: str, username: str) -> Optional[Dict]:
+        current = self._current()
+        number = current.find(service, username)
+        if number is None:
+            return None
+        record = current.read(number)
+        if record["service"] != service or record["username"] != username:
+            return None  # lookup tag collision
+        return record
+
+    def put(self, record: Dict) -> None:
+        self.put_many([record])
+
+    def put_many(self, records: Iterable[Dict]) -> int:
+        return self._submit(('put', list(records)))
+
+    def delete(self, service: str, username: str) -> bool:
+        return self.delete_many([(service, username)]) > 0
+
+    def delete_many(self, keys: Iterable[Tuple[str, str]]) -> int:
+        return self._submit(('delete', list(dict.fromkeys(keys))))
+
+    def close(self) -> None:
+        self._file = None
+
+    def __len__(self) -> int:
+        return self._current().count
+
+
+def convert_json_to_binary(json_path: str, binary_path: str, vault_key: bytes, cipher: str = 'aes-gcm') -> int:
+    """
+    Write the records of a vault.json file into a new binary vault.
+
+    Args:
+        json_path (str): Existing JSON vault, fields encrypted with vault_key
+        binary_path (str): Binary vault to create; must not exist yet
+        vault_key (bytes): The user's urlsafe-base64 vault key
+        cipher (str): AEAD for the new file
+
+    Returns:
+        int: Number of records converted
+    """
+    from cryptography.fernet import Fernet
+
+    if os.path.exists(binary_path):
+        raise FileExistsError(f"{binary_path} already exists")
+    fernet = Fernet(vault_key)
+    with open(json_path, 'r') as file:
+        credentials = json.load(file).get("credentials", [])
+    records = [{
+        "service": cred["service"],
+        "username": cred["username"],
+        "password": fernet.decrypt(cred["password"].encode()).decode(),
+        "email": fernet.decrypt(cred["email"].encode()).decode()
+    } for cred in credentials]
+    storage = BinaryStorage(binary_path, vault_key, cipher, group_commit=False)
+    try:
+        count = storage.put_many(records) if records else 0
+    finally:
+        storage.close()
+    logging.info(f"Converted {count} credentials from {json_path} to {binary_path}")
+    return count
+
+
+def convert_binary_to_json(binary_path: str, json_path: str, vault_key: bytes) -> int:
+    """
+    Write the records of a binary vault into a new vault.json file.
+
+    Args:
+        binary_path (str): Existing binary vault
+        json_path (str): JSON vault to create; must not exist yet
+        vault_key (bytes): The user's urlsafe-base64 vault key
+
+    Returns:
+        int: Number of records converted
+    """
+    from cryptography.fernet import Fernet
+
+    if os.path.exists(json_path):
+        raise FileExistsError(f"{json_path} already exists")
+    fernet = Fernet(vault_key)
+    source = BinaryStorage(binary_path, vault_key, group_commit=False)
+    try:
+        records = [{
+            "service": record["service"],
+            "username": record["username"],
+            "password": fernet.encrypt(record["password"].encode()).decode(),
+            "email": fernet.encrypt(record["email"].encode()).decode()
+        } for record in source.iter_credentials()]
+    finally:
+        source.close()
+    target = JsonStorage(json_path, group_commit=False)
+    count = target.put_many(records) if records else 0
+    logging.info(f"Converted {count} credentials from {binary_path} to {json_path}")
+    return count
@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from telemetry import metrics
+
+
+class DecryptedFieldCache:
+    """
+    Size-bounded LRU cache of decrypted vault fields.
+
+    Entries are keyed by the Fernet token, so a field is only decrypted again
+    once it has been pushed out of the cache. Plaintexts are held in
+    bytearrays that are overwritten with zeros when they are evicted or when
+    the cache is wiped (e.g. on logout).
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, bytearray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _zero(value: bytearray) -> None:
+        for i in range(len(value)):
+            value[i] = 0
+
+    def get(self, token: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(token)
+            if value is None:
+                return None
+            self._entries.move_to_end(token)
+            return value.decode()
+
+    def put(self, token: str, plaintext: bytes) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            old = self._entries.pop(token, None)
+            if old is not None:
+                self._zero(old)
+            self._entries[token] = bytearray(plaintext)
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._zero(evicted)
+
+    def decrypt(self, token: str, decrypt: Callable[[bytes], bytes]) -> str:
+        """Return the plaintext for token, calling decrypt only on a miss."""
+        value = self.get(token)
+        if value is not None:
+            self.hits += 1
+            metrics.increment('field_cache.hit')
+            return value
+        self.misses += 1
+        metrics.increment('field_cache.miss')
+        plaintext = decrypt(token.encode())
+        self.put(token, plaintext)
+        return plaintext.decode()
+
+    def wipe(self) -> None:
+        """Zero and drop every cached plaintext."""
+        with self._lock:
+            for value in self._entries.values():
+                self._zero(value)
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,70 @@
+import os
+import threading
+import time
+
+from telemetry import metrics
+
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """
+    Exclusive advisory lock shared by threads and processes.
+
+    The lock is taken on a separate ``<path>.lock`` file, so the protected
+    file itself can be replaced by rename while the lock is held. A thread
+    lock is taken first so threads of one process queue up in-process instead
+    of on the OS lock. The time spent waiting is recorded in last_wait.
+    """
+
+    def __init__(self, path: str):
+        self.lock_path = path + '.lock'
+        self._thread_lock = threading.RLock()
+        self._fd = None
+        self._depth = 0
+        self.last_wait = 0.0
+
+    def acquire(self) -> None:
+        start = time.perf_counter()
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                else:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            except Exception:
+                os.close(fd)
+                self._thread_lock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+        self.last_wait = time.perf_counter() - start
+        metrics.observe('lock.wait', self.last_wait)
+
+    def release(self) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            fd, self._fd = self._fd, None
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                else:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            finally:
+                os.close(fd)
+        self._thread_lock.release()
+
+    def __enter__(self) -> 'FileLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.release()
@@ -0,0 +1,127 @@
+import hashlib
+import hmac
+import logging
+import os
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from telemetry import metrics
+from user.passwordValidator import PasswordValidator
+
+# Risk weights used to rank entries in the report
+WEIGHT_BREACHED = 10
+WEIGHT_REUSED = 5
+WEIGHT_NEAR_DUPLICATE = 3
+WEIGHT_PER_WEAKNESS = 1
+MAX_LISTED_MATCHES = 10
+
+_LEET = str.maketrans({'0': 'o', '1': 'l', '3': 'e', '4': 'a', '5': 's', '7': 't',
+                       '@': 'a', '$': 's', '!': 'i', '|': 'l', '+': 't'})
+_EDGE_NOISE = re.compile(r'^[\W\d_]+|[\W\d_]+$')
+
+
+def _skeleton(password: str) -> str:
+    """Collapse trivial variations: case, leetspeak and leading/trailing digits or symbols."""
+    stripped = _EDGE_NOISE.sub('', password.lower())
+    return (stripped or password.lower()).translate(_LEET)
+
+
+def audit_vault(vault_manager, validator: Optional[PasswordValidator] = None,
+                batch_size: int = 256, workers: int = 4) -> List[Dict]:
+    """
+    Build a ranked password health report for a vault.
+
+    Passwords are decrypted in batches on a thread pool and checked in bulk
+    with PasswordValidator.validate_many. Reuse and near-duplicates are found
+    by grouping on HMACs under a random per-audit key (of the password and
+    of its skeleton), so no pairwise comparison is done and no plaintext is
+    kept as a dictionary key.
+
+    Returns:
+        Entries sorted by descending risk score, each with "service",
+        "username", "score", "weaknesses", "reused_with" and "similar_to".
+    """
+    validator = validator or PasswordValidator()
+    fernet = vault_manager.fernet
+    credentials = list(vault_manager.storage.iter_credentials())
+
+    def decrypt_batch(batch: List[Dict]) -> List[str]:
+        metrics.increment('crypto.decrypt_bulk', len(batch))
+        return [fernet.decrypt(c["password"].encode()).decode() for c in batch]
+
+    batches = [credentials[i:i + batch_size] for i in range(0, len(credentials), batch_size)]
+    audit_key = os.urandom(32)
+    weaknesses: List[List[str]] = []
+    exact_tags: List[bytes] = []
+    skeleton_tags: List[bytes] = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for passwords in pool.map(decrypt_batch, batches):
+            weaknesses.extend(errors for _, errors in validator.validate_many(passwords))
+            for password in passwords:
+                exact_tags.append(hmac.new(audit_key, password.encode(), hashlib.sha256).digest())
+                skeleton_tags.append(
+                    hmac.new(audit_key, b'skeleton:' + _skeleton(password).encode(), hashlib.sha256).digest()
+                )
+
+    exact_groups = defaultdict(list)
+    skeleton_groups = defaultdict(list)
+    for i, (exact, skeleton) in enumerate(zip(exact_tags, skeleton_tags)):
+        exact_groups[exact].append(i)
+        skeleton_groups[skeleton].append(i)
+
+    def labels(indices, keep) -> List[str]:
+        # Capped so a password shared by thousands of entries stays readable
+        matches = (j for j in indices if keep(j))
+        return [
+            f"{credentials[j]['service']} ({credentials[j]['username']})"
+            for _, j in zip(range(MAX_LISTED_MATCHES), matches)
+        ]
+
+    report = []
+    for i, cred in enumerate(credentials):
+        reused = labels(exact_groups[exact_tags[i]], lambda j: j != i)
+        similar = labels(
+            skeleton_groups[skeleton_tags[i]],
+            lambda j: j != i and exact_tags[j] != exact_tags[i]
+        )
+        breached = "Password appears in a known data breach" in weaknesses[i]
+        score = (
+            WEIGHT_BREACHED * breached
+            + WEIGHT_REUSED * bool(reused)
+            + WEIGHT_NEAR_DUPLICATE * bool(similar)
+            + WEIGHT_PER_WEAKNESS * (len(weaknesses[i]) - breached)
+        )
+        report.append({
+            "service": cred["service"],
+            "username": cred["username"],
+            "score": score,
+            "weaknesses": weaknesses[i],
+            "reused_with": reused,
+            "similar_to": similar
+        })
+
+    report.sort(key=lambda entry: (-entry["score"], entry["service"], entry["username"]))
+    logging.info(f"Audited {len(report)} credentials")
+    return report
+
+
+def format_report(report: List[Dict], limit: Optional[int] = 50) -> str:
+    """Render the riskiest entries of an audit report as a table."""
+    from tabulate import tabulate  # deferred: only needed for console output
+    rows = [
+        [
+            entry["service"],
+            entry["username"],
+            entry["score"],
+            "\n".join(dict.fromkeys(entry["weaknesses"])) or "-",
+            "\n".join(entry["reused_with"]) or "-",
+            "\n".join(entry["similar_to"]) or "-"
+        ]
+        for entry in report[:limit] if entry["score"] > 0
+    ]
+    if not rows:
+        return "No weak, reused or similar passwords found."
+    headers = ["Service", "Username", "Risk", "Weaknesses", "Reused With", "Similar To"]
+    return tabulate(rows, headers=headers, tablefmt="grid")
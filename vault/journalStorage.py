@@ -0,0 +1,326 @@
+import itertools
+import json
+import logging
+import os
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from telemetry import metrics
+from .fileLock import FileLock
+from .groupCommit import GroupCommitQueue
+from .storage import VaultStorage, credential_key
+
+
+class JournalStorage(VaultStorage):
+    """
+    Append-only, log-structured vault storage.
+
+    Every put or delete is appended to ``vault.journal`` as one JSON line and
+    fsynced, so a write costs the same no matter how large the vault is. The
+    live records are kept in an in-memory index that is rebuilt by replaying
+    the journal when the vault is opened. Superseded entries and tombstones
+    are dropped by compaction, which rewrites the journal to a temporary file
+    and atomically swaps it in.
+
+    Appends and compaction hold an advisory file lock. Before writing, a
+    process catches up on lines other processes appended (or reloads after
+    another process compacted), and concurrent writes within a process are
+    merged by a group-commit queue into one append and one fsync.
+    """
+
+    def __init__(self, path: str, compact_min_entries: int = 1000,
+                 compact_ratio: float = 0.5, background_compaction: bool = True,
+                 group_commit: bool = True):
+        """
+        Args:
+            path (str): Journal file location
+            compact_min_entries (int): Dead entries tolerated before compaction is considered
+            compact_ratio (float): Fraction of dead entries that triggers compaction
+            background_compaction (bool): Compact on a background thread instead of inline
+            group_commit (bool): Merge concurrent writes into shared appends
+        """
+        self.path = path
+        self.compact_min_entries = compact_min_entries
+        self.compact_ratio = compact_ratio
+        self.background_compaction = background_compaction
+        self.group_commit = group_commit
+
+        self._index: Dict[Tuple[str, str], Dict] = {}
+        self._entries = 0  # lines currently in the journal
+        self._offset = 0  # bytes of the journal reflected in the index
+        self._inode = None
+        self._handle = None
+        self._lock = threading.RLock()
+        self.file_lock = FileLock(path)
+        self.commit_queue = GroupCommitQueue(self._commit_batch)
+        self._compacting = False
+        self._compaction_thread: Optional[threading.Thread] = None
+        self._tail: Optional[List[bytes]] = None  # lines appended during a compaction
+
+        with self._lock, self.file_lock:
+            if not os.path.exists(self.path):
+                open(self.path, 'ab').close()
+                logging.info(f"Created new journal file: {self.path}")
+            self._refresh(locked=True)
+
+    def _reopen(self) -> None:
+        if self._handle is not None and not self._handle.closed:
+            self._handle.close()
+        self._handle = open(self.path, 'ab')
+        self._inode = os.fstat(self._handle.fileno()).st_ino
+
+    def _refresh(self, locked: bool = False) -> None:
+        """
+        Bring the in-memory index up to date with the journal on disk.
+
+        Lines appended by other processes are replayed; if the file was
+        replaced by another process's compaction, the index is rebuilt. Only
+        while holding the file lock is an incomplete final line treated as a
+        torn write and truncated; complete lines are never discarded.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            self._index = {}
+            self._entries = 0
+            self._offset = 0
+            self._reopen()
+        if stat.st_size == self._offset:
+            return
+
+        with metrics.timed('storage.journal.read'):
+            with open(self.path, 'rb') as file:
+                file.seek(self._offset)
+                data = file.read()
+        with metrics.timed('storage.journal.replay'):
+            consumed = self._replay(data)
+        self._offset += consumed
+
+        if locked and consumed < len(data):
+            logging.warning(f"Discarding incomplete tail of journal: {self.path}")
+            with open(self.path, 'r+b') as file:
+                file.truncate(self._offset)
+                file.flush()
+                os.fsync(file.fileno())
+
+    def _replay(self, data: bytes) -> int:
+        """
+        Apply the complete lines in data; return the number of bytes consumed.
+
+        A complete line that cannot be read is logged and skipped, so the
+        entries after it still count; only an unterminated final fragment is
+        left unconsumed.
+        """
+        consumed = 0
+        lines = data.split(b'\n')
+        for line in lines[:-1]:  # the last piece is the unterminated fragment, if any
+            consumed += len(line) + 1
+            self._entries += 1
+            try:
+                self._apply(json.loads(line))
+            except (ValueError, KeyError, TypeError) as e:
+                logging.error(f"Skipping unreadable entry at byte {self._offset + consumed - len(line) - 1} "
+                              f"of journal {self.path}: {str(e)}")
+                continue
+            if self._tail is not None:
+                self._tail.append(line + b'\n')
+        return consumed
+
+    def _apply(self, entry: Dict) -> None:
+        key = credential_key(entry["service"], entry["username"])
+        if entry["op"] == "put":
+            record = {
+                "service": entry["service"],
+                "username": entry["username"],
+                "password": entry["password"],
+                "email": entry["email"]
+            }
+            self._index.pop(key, None)  # keep insertion order of the latest put
+            self._index[key] = record
+        elif entry["op"] == "del":
+            self._index.pop(key, None)
+
+    def _append(self, entries: List[Dict]) -> None:
+        with metrics.timed('storage.journal.serialize'):
+            lines = [(json.dumps(entry, separators=(',', ':')) + '\n').encode() for entry in entries]
+            data = b''.join(lines)
+        with metrics.timed('storage.journal.append'):
+            self._handle.write(data)
+            self._handle.flush()
+            os.fsync(self._handle.fileno())
+        self._entries += len(lines)
+        self._offset += len(data)
+        if self._tail is not None:
+            self._tail.extend(lines)
+
+    def _commit_batch(self, operations: List[Tuple[str, list]]) -> List[int]:
+        """Append the entries for queued puts/deletes with a single fsync."""
+        with self._lock, self.file_lock:
+            self._guard_write()
+            self._refresh(locked=True)
+            present: Dict[Tuple[str, str], bool] = {}  # effect of earlier operations in the batch
+            entries = []
+            results = []
+            for kind, items in operations:
+                if kind == 'put':
+                    for record in items:
+                        entries.append({"op": "put", **record})
+                        present[credential_key(record["service"], record["username"])] = True
+                    results.append(len(items))
+                else:
+                    removed = 0
+                    for service, username in items:
+                        key = credential_key(service, username)
+                        if present.get(key, key in self._index):
+                            entries.append({"op": "del", "service": service, "username": username})
+                            present[key] = False
+                            removed += 1
+                    results.append(removed)
+            if entries:
+                self._append(entries)
+                for entry in entries:
+                    self._apply(entry)
+        self._maybe_compact()
+        return results
+
+    def _submit(self, operation: Tuple[str, list]) -> int:
+        if self.group_commit:
+            return self.commit_queue.submit(operation)
+        return self._commit_batch([operation])[0]
+
+    def list_credentials(self) -> List[Dict]:
+        with self._lock:
+            self._refresh()
+            return list(self._index.values())
+
+    def iter_credentials(self, offset: int = 0, limit: Optional[int] = None) -> Iterator[Dict]:
+        stop = None if limit is None else offset + limit
+        with self._lock:
+            self._refresh()
+            return iter(list(itertools.islice(self._index.values(), offset, stop)))
+
+    def get(self, service: str, username: str) -> Optional[Dict]:
+        with self._lock:
+            self._refresh()
+            return self._index.get(credential_key(service, username))
+
+    def put(self, record: Dict) -> None:
+        self.put_many([record])
+
+    def put_many(self, records: Iterable[Dict]) -> int:
+        """Append many records with a single fsync."""
+        return self._submit(('put', list(records)))
+
+    def delete(self, service: str, username: str) -> bool:
+        return self.delete_many([(service, username)]) > 0
+
+    def delete_many(self, keys: Iterable[Tuple[str, str]]) -> int:
+        """Append tombstones for many keys with a single fsync."""
+        return self._submit(('delete', list(dict.fromkeys(keys))))
+
+    def dead_entries(self) -> int:
+        """Number of journal lines that no longer describe a live record."""
+        with self._lock:
+            return self._entries - len(self._index)
+
+    def _maybe_compact(self) -> None:
+        with self._lock:
+            dead = self._entries - len(self._index)
+            if self._compacting or dead < self.compact_min_entries:
+                return
+            if dead < self._entries * self.compact_ratio:
+                return
+            self._compacting = True
+
+        if self.background_compaction:
+            self._compaction_thread = threading.Thread(target=self._compact, daemon=True)
+            self._compaction_thread.start()
+        else:
+            self._compact()
+
+    def compact(self) -> None:
+        """Rewrite the journal so it only holds the live records."""
+        with self._lock:
+            busy = self._compacting
+            thread = self._compaction_thread
+            self._compacting = True
+        if busy:
+            # Someone else is already compacting; wait for them instead.
+            if thread is not None and thread.is_alive():
+                thread.join()
+            return
+        self._compact()
+
+    def _compact(self) -> None:
+        with metrics.timed('storage.journal.compact'):
+            self._compact_to_file()
+
+    def _compact_to_file(self) -> None:
+        tmp_path = f'{self.path}.{os.getpid()}.compact'
+        try:
+            with self._lock, self.file_lock:
+                self._refresh(locked=True)
+                snapshot = list(self._index.values())
+                snapshot_inode = self._inode
+                self._tail = []
+
+            # The slow part runs without the locks so writers are not blocked.
+            with open(tmp_path, 'wb') as file:
+                for record in snapshot:
+                    entry = {"op": "put", **record}
+                    file.write((json.dumps(entry, separators=(',', ':')) + '\n').encode())
+                file.flush()
+                os.fsync(file.fileno())
+
+            with self._lock, self.file_lock:
+                # Carry over whatever was appended, by any process, meanwhile.
+                self._refresh(locked=True)
+                if self._inode != snapshot_inode:
+                    # Another process compacted first; its file already wins.
+                    os.remove(tmp_path)
+                    return
+                with open(tmp_path, 'ab') as file:
+                    for line in self._tail:
+                        file.write(line)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(tmp_path, self.path)
+                _fsync_directory(os.path.dirname(self.path))
+                self._entries = len(snapshot) + len(self._tail)
+                self._offset = os.path.getsize(self.path)
+                self._reopen()
+                logging.info(f"Compacted journal {self.path} to {self._entries} entries")
+        except Exception as e:
+            logging.error(f"Error compacting journal: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        finally:
+            with self._lock:
+                self._tail = None
+                self._compacting = False
+
+    def close(self) -> None:
+        thread = self._compaction_thread
+        if thread is not None and thread.is_alive():
+            thread.join()
+        with self._lock:
+            if self._handle is not None and not self._handle.closed:
+                self._handle.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._index)
+
+
+def _fsync_directory(directory: str) -> None:
+    """Persist a rename by syncing its directory (no-op where unsupported)."""
+    if os.name == 'nt':
+        return
+    fd = os.open(directory or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
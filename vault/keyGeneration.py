@@ -0,0 +1,81 @@
+"""
+Key generation of a vault.
+
+Every master password change gives the vault a new key. key.json in the
+user's vault directory names the key currently in use by its generation
+number and key check, so a process that still holds an older key (an API
+server, an agent or a menu opened before the change) refuses to open or
+write the vault instead of mixing records under two keys. A vault whose
+master password was never changed has no key.json and accepts its key.
+"""
+import json
+import os
+from typing import Dict, Optional, Tuple
+
+KEY_FILE = 'key.json'
+
+
+class StaleVaultKeyError(Exception):
+    """The vault key in use is not the vault's current key; the master password was changed."""
+
+
+def read_key_generation(user_dir: str) -> Optional[Dict]:
+    """The vault's {"generation", "key_check"}, or None if its key never changed."""
+    try:
+        with open(os.path.join(user_dir, KEY_FILE), 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def write_key_generation(user_dir: str, generation: int, key_check: str) -> None:
+    """Record the vault's current key; written before the vault file is switched to it."""
+    path = os.path.join(user_dir, KEY_FILE)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(fd, 'w') as file:
+        json.dump({"generation": generation, "key_check": key_check}, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+class KeyGenerationCheck:
+    """
+    Compares one vault key with the vault's key.json.
+
+    The file is re-read only when its inode, size or mtime changed, so the
+    check costs one stat per call.
+    """
+
+    def __init__(self, user_dir: str, key_check: str):
+        """
+        Args:
+            user_dir (str): The user's vault directory
+            key_check (str): Key check of the vault key in use
+        """
+        self.path = os.path.join(user_dir, KEY_FILE)
+        self.user_dir = user_dir
+        self.key_check = key_check
+        self._stamp: Optional[Tuple] = None
+        self._current = True
+
+    def is_current(self) -> bool:
+        try:
+            stat = os.stat(self.path)
+            stamp = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            stamp = None
+        if stamp != self._stamp:
+            record = read_key_generation(self.user_dir) if stamp is not None else None
+            self._current = record is None or record["key_check"] == self.key_check
+            self._stamp = stamp
+        return self._current
+
+    def require_current(self) -> None:
+        """
+        Raises:
+            StaleVaultKeyError: If the vault has moved on to another key
+        """
+        if not self.is_current():
+            raise StaleVaultKeyError("The master password was changed; log in again")
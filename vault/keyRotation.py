@@ -0,0 +1,307 @@
+"""
+Master password change with vault re-encryption.
+
+The vault is re-encrypted in streaming batches on a thread or process pool
+into a shadow file next to it. After every batch the shadow file is synced
+and a checkpoint records how far it got, so an interrupted rotation resumes
+where it stopped. When every record is done a complete new vault file is
+built, the checkpoint enters its switch phase, and
+UserHandling.finish_key_rotation renames the new vault over the old one and
+replaces the user's KDF material; a login completes that step if it was
+interrupted. Until the switch the old vault and master password stay valid.
+
+Each change bumps the key generation kept in the user's KDF record and in
+the vault's key.json (see keyGeneration), so processes still holding the
+old key stop using the vault. The vault's sync key is carried over, sealed
+with the new key, so sync directories keep working. An SQLite vault is only changed while no
+other process has it open. key.json covers the whole user directory, so a
+rotation is refused while the directory holds the vault in more than one
+storage format.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Iterator, List, Optional
+
+from cryptography.fernet import Fernet
+
+from telemetry import metrics
+from user.keyDerivation import key_cache, key_check
+from .journalStorage import _fsync_directory
+from .sqliteStorage import SQLiteStorage
+from .sync import SYNC_KEY_FILE, load_sync_key, write_sync_key
+from .transfer import _batches, _bounded_map
+from .vaultManager import VaultManager, STORAGE_BACKENDS
+
+ProgressCallback = Callable[[int, int], None]
+
+
+def _reencrypt_batch(old_key: Optional[bytes], new_key: bytes, batch: List[Dict]) -> List[Dict]:
+    """Re-encrypt password and email of a batch; old_key None means the fields are plaintext."""
+    old = Fernet(old_key) if old_key else None
+    new = Fernet(new_key)
+    records = []
+    for record in batch:
+        fields = {}
+        for name in ("password", "email"):
+            value = record[name].encode()
+            if old is not None:
+                value = old.decrypt(value)
+            fields[name] = new.encrypt(value).decode()
+        records.append({"service": record["service"], "username": record["username"], **fields})
+    return records
+
+
+def _write_json(path: str, data: Dict) -> None:
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(fd, 'w') as file:
+        json.dump(data, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+def _vault_stamp(path: str) -> List[int]:
+    stat = os.stat(path)
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+
+def _sqlite_stamp(path: str) -> List:
+    """
+    Size and digest of an SQLite database without its 100-byte header.
+
+    Opening the database switches it to WAL mode and leave_wal_mode switches
+    it back, and both rewrite the header and the mtime, so an interrupted
+    rotation compares the pages instead (taken after leave_wal_mode, when
+    every committed change is in the file).
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        file.seek(100)
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return [os.path.getsize(path), digest.hexdigest()]
+
+
+class KeyRotation:
+    """
+    One user's master password change, resumable from its checkpoint.
+
+    The checkpoint (in the user store's rotations directory) holds the new
+    KDF parameters with their key check, the shadow file's length and the
+    number of records done, never a key. Resuming needs both passwords
+    again; with a different new password, or if the vault was changed while
+    the rotation was interrupted, the rotation starts over.
+    """
+
+    def __init__(self, user_handling, username: str, vault_dir: str = 'userApps', storage: str = 'json',
+                 batch_size: int = 256, workers: int = 4, use_processes: bool = False):
+        """
+        Args:
+            user_handling: UserHandling of the user store holding the user
+            username (str): User whose master password changes
+            vault_dir (str): Base directory for user vaults
+            storage (str): The vault's storage engine, one of STORAGE_BACKENDS
+            batch_size (int): Records re-encrypted per task
+            workers (int): Pool size
+            use_processes (bool): Re-encrypt on a process pool instead of threads
+        """
+        if storage not in STORAGE_BACKENDS:
+            raise ValueError(f"Unknown storage backend: {storage}")
+        self.user_handling = user_handling
+        self.username = username
+        self.vault_dir = vault_dir
+        self.storage = storage
+        self.batch_size = batch_size
+        self.workers = workers
+        self.use_processes = use_processes
+        self.checkpoint_path = user_handling.rotation_checkpoint_path(username)
+        self.user_dir = os.path.join(vault_dir, username)
+        self.data_file = os.path.abspath(os.path.join(vault_dir, username, STORAGE_BACKENDS[storage][1]))
+        self.shadow_path = self.data_file + '.rotating'
+        self.rotated_path = self.data_file + '.rotated'
+        self.sync_key_path = os.path.abspath(os.path.join(vault_dir, username, SYNC_KEY_FILE))
+
+    def _load_checkpoint(self) -> Optional[Dict]:
+        try:
+            with open(self.checkpoint_path, 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def _save_checkpoint(self, checkpoint: Dict) -> None:
+        os.makedirs(os.path.dirname(self.checkpoint_path), exist_ok=True)
+        _write_json(self.checkpoint_path, checkpoint)
+
+    def _source_stamp(self) -> List:
+        if self.storage == 'sqlite':
+            return _sqlite_stamp(self.data_file)
+        return _vault_stamp(self.data_file)
+
+    def _check_single_format(self) -> None:
+        """Refuse unless this engine's file is the only vault in the user's directory."""
+        present = {name: file_name for name, (_, file_name) in STORAGE_BACKENDS.items()
+                   if os.path.exists(os.path.join(self.user_dir, file_name))}
+        if len(present) > 1:
+            raise ValueError(f"The vault of {self.username} exists in several formats "
+                             f"({', '.join(sorted(present.values()))}); remove the copies not in use "
+                             f"before changing the master password")
+        if present and self.storage not in present:
+            (name, file_name), = present.items()
+            raise ValueError(f"The vault of {self.username} is {file_name}; "
+                             f"change the master password with the {name} storage engine")
+
+    @staticmethod
+    def _derive(password: str, kdf: Dict) -> bytes:
+        matches = lambda candidate: hmac.compare_digest(key_check(candidate), kdf["key_check"])
+        return key_cache.derive(password, base64.b64decode(kdf["salt"]), kdf["iterations"], verify=matches)
+
+    def _start_or_resume(self, new_password: str) -> Dict:
+        """The stored checkpoint if it can be continued, otherwise a fresh one."""
+        checkpoint = self._load_checkpoint()
+        if checkpoint is not None and checkpoint.get("phase") == "reencrypt":
+            same_password = hmac.compare_digest(key_check(self._derive(new_password, checkpoint["new_kdf"])),
+                                                checkpoint["new_kdf"]["key_check"])
+            if (same_password and checkpoint["source_stamp"] == self._source_stamp()
+                    and os.path.exists(self.shadow_path)
+                    and os.path.getsize(self.shadow_path) >= checkpoint["shadow_offset"]):
+                logging.info(f"Resuming key rotation for {self.username} at record {checkpoint['done']}")
+                return checkpoint
+            logging.warning(f"Restarting interrupted key rotation for {self.username}")
+
+        new_kdf = self.user_handling._generate_master_key(new_password)
+        old_kdf = self.user_handling.store.get_user(self.username)["kdf"]
+        new_kdf["generation"] = old_kdf.get("generation", 0) + 1
+        checkpoint = {
+            "phase": "reencrypt",
+            "storage": self.storage,
+            "new_kdf": new_kdf,
+            "data_file": self.data_file,
+            "shadow_path": self.shadow_path,
+            "rotated_path": self.rotated_path,
+            "source_stamp": self._source_stamp(),
+            "done": 0,
+            "shadow_offset": 0,
+        }
+        fd = os.open(self.shadow_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.close(fd)
+        self._save_checkpoint(checkpoint)
+        return checkpoint
+
+    def _reencrypt(self, vault_manager: VaultManager, old_key: Optional[bytes], new_key: bytes,
+                   checkpoint: Dict, progress: Optional[ProgressCallback]) -> None:
+        """Stream the remaining records through the pool into the shadow file, checkpointing each batch."""
+        total = len(vault_manager.storage)
+        pool_class = ProcessPoolExecutor if self.use_processes else ThreadPoolExecutor
+        with open(self.shadow_path, 'r+b') as shadow, pool_class(max_workers=self.workers) as pool:
+            # Lines written after the last checkpoint are redone
+            shadow.truncate(checkpoint["shadow_offset"])
+            shadow.seek(checkpoint["shadow_offset"])
+            batches = _batches(vault_manager.storage.iter_credentials(checkpoint["done"]), self.batch_size)
+            tasks = _bounded_map(pool, partial(_reencrypt_batch, old_key, new_key), batches, self.workers * 2)
+            for records in tasks:
+                shadow.write(''.join(json.dumps(record) + '\n' for record in records).encode())
+                shadow.flush()
+                os.fsync(shadow.fileno())
+                checkpoint["done"] += len(records)
+                checkpoint["shadow_offset"] = shadow.tell()
+                self._save_checkpoint(checkpoint)
+                metrics.increment('vault.rotation.records', len(records))
+                if progress:
+                    progress(checkpoint["done"], total)
+
+    def _shadow_records(self, new_key: bytes, plaintext: bool) -> Iterator[Dict]:
+        fernet = Fernet(new_key)
+        with open(self.shadow_path, 'r') as file:
+            for line in file:
+                record = json.loads(line)
+                if plaintext:
+                    for name in ("password", "email"):
+                        record[name] = fernet.decrypt(record[name].encode()).decode()
+                yield record
+
+    def _build_rotated(self, new_key: bytes) -> int:
+        """Write the complete re-encrypted vault next to the old one."""
+        storage_class = STORAGE_BACKENDS[self.storage][0]
+        for path in (self.rotated_path, self.rotated_path + '-journal', self.rotated_path + '-wal'):
+            if os.path.exists(path):
+                os.remove(path)
+        if storage_class.encrypts_records:
+            rotated = storage_class(self.rotated_path, new_key)
+        else:
+            rotated = storage_class(self.rotated_path)
+        try:
+            count = rotated.put_many(self._shadow_records(new_key, storage_class.encrypts_records))
+        finally:
+            rotated.close()
+            if os.path.exists(self.rotated_path + '.lock'):
+                os.remove(self.rotated_path + '.lock')
+        return count
+
+    def run(self, old_password: str, new_password: str, progress: Optional[ProgressCallback] = None) -> Dict:
+        """
+        Change the master password and re-encrypt the vault.
+
+        Args:
+            old_password (str): Current master password
+            new_password (str): New master password
+            progress (callable): Called with (records done, total) after each batch
+
+        Returns:
+            Dict: records re-encrypted and the record the rotation resumed from
+        """
+        old_master = self.user_handling.verify_login(self.username, old_password)
+        if old_master is None:
+            raise ValueError("Invalid username or master password")
+        is_valid, errors = self.user_handling.password_validator.validate(new_password)
+        if not is_valid:
+            raise ValueError("New password does not meet requirements: " + "; ".join(errors))
+        self._check_single_format()
+
+        vault_manager = VaultManager(old_master, self.username, base_dir=self.vault_dir, storage=self.storage)
+        storage = vault_manager.storage
+        # Writers wait for the rotation instead of changing records it already copied
+        with storage.file_lock:
+            try:
+                if isinstance(storage, SQLiteStorage):
+                    try:
+                        storage.leave_wal_mode()
+                    except RuntimeError as e:
+                        raise ValueError(str(e))
+                checkpoint = self._start_or_resume(new_password)
+                resumed_from = checkpoint["done"]
+                new_key = self._derive(new_password, checkpoint["new_kdf"])
+                old_key = None if storage.encrypts_records else vault_manager._vault_key
+                with metrics.timed('vault.rotation', storage=self.storage):
+                    self._reencrypt(vault_manager, old_key, new_key, checkpoint, progress)
+                    records = self._build_rotated(new_key)
+                    write_sync_key(self.sync_key_path + '.rotated', new_key, load_sync_key(vault_manager))
+                    checkpoint["sync_key_path"] = self.sync_key_path
+                    _fsync_directory(os.path.dirname(self.data_file))
+            finally:
+                vault_manager.close()
+            checkpoint["phase"] = "switch"
+            self._save_checkpoint(checkpoint)
+            self.user_handling.finish_key_rotation(self.username)
+        return {"records": records, "resumed_from": resumed_from}
+
+
+def rotate_master_password(user_handling, username: str, old_password: str, new_password: str,
+                           vault_dir: str = 'userApps', storage: str = 'json', batch_size: int = 256,
+                           workers: int = 4, use_processes: bool = False,
+                           progress: Optional[ProgressCallback] = None) -> Dict:
+    """
+    Change a user's master password, re-encrypting their vault.
+
+    Runs KeyRotation for the user; calling it again with the same passwords
+    after an interruption continues the interrupted change.
+    """
+    rotation = KeyRotation(user_handling, username, vault_dir=vault_dir, storage=storage,
+                           batch_size=batch_size, workers=workers, use_processes=use_processes)
+    return rotation.run(old_password, new_password, progress)
@@ -0,0 +1,249 @@
+import bisect
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+Key = Tuple[str, str]  # (service, username)
+
+# Score bands; a fuzzy trigram match scores in (0, 1]
+EXACT_SCORE = 4.0
+PREFIX_SCORE = 3.0
+WORD_PREFIX_SCORE = 2.5
+SUBSTRING_SCORE = 2.0
+SERVICE_BONUS = 0.25  # a hit on the service outranks the same hit on the username
+MIN_FUZZY_SCORE = 0.5
+
+_WORD_SPLIT = re.compile(r'[^0-9a-z]+')
+
+
+def _normalize(text: str) -> str:
+    return text.casefold().strip()
+
+
+def _terms(text: str) -> Set[str]:
+    """The whole field plus each word in it."""
+    terms = {text}
+    terms.update(word for word in _WORD_SPLIT.split(text) if word)
+    return terms
+
+
+def _trigrams(term: str) -> Set[str]:
+    padded = f' {term} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _inner_trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _dice(a: Set[str], b: Set[str]) -> float:
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+class SearchIndex:
+    """
+    In-memory search index over the plaintext service and username fields.
+
+    Every field and every word in it is indexed three ways: an exact-match
+    table, a sorted term list searched with bisect for prefix/autocomplete
+    queries, and a trigram index (trigram -> entry ids) for substring and
+    fuzzy queries. All three are updated per entry on add/remove, so the
+    index never has to be rebuilt while the vault is open. Passwords and
+    emails are never indexed.
+
+    Queries walk the match bands from best to worst and stop as soon as
+    enough results are found, so a query that matches most of the vault
+    still only looks at a handful of entries.
+    """
+
+    def __init__(self, records: Iterable[Dict] = ()):
+        self._keys: List[Optional[Key]] = []  # entry id -> key (None once removed)
+        self._ids: Dict[Key, int] = {}
+        self._fields: Dict[int, Tuple[str, str]] = {}  # entry id -> normalized (service, username)
+        self._exact: Dict[str, Set[int]] = {}
+        self._trigrams: Dict[str, Set[int]] = {}
+        self._terms: List[Tuple[str, int]] = []  # sorted (term, entry id)
+        self.add_many(records)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, key: Key) -> bool:
+        return key in self._ids
+
+    def _insert(self, key: Key) -> Optional[List[Tuple[str, int]]]:
+        """Index key everywhere except the term list; return its terms."""
+        if key in self._ids:
+            return None
+        entry = len(self._keys)
+        self._keys.append(key)
+        self._ids[key] = entry
+        fields = (_normalize(key[0]), _normalize(key[1]))
+        self._fields[entry] = fields
+        terms = _terms(fields[0]) | _terms(fields[1])
+        for field in fields:
+            self._exact.setdefault(field, set()).add(entry)
+        for gram in set().union(*map(_trigrams, terms)):
+            self._trigrams.setdefault(gram, set()).add(entry)
+        return [(term, entry) for term in terms]
+
+    def add(self, service: str, username: str) -> None:
+        """Index one entry (no-op if it is already indexed)."""
+        for item in self._insert((service, username)) or ():
+            bisect.insort(self._terms, item)
+
+    def add_many(self, records: Iterable[Dict]) -> None:
+        """Index many entries, sorting the term list once instead of per entry."""
+        added = []
+        for record in records:
+            added.extend(self._insert((record["service"], record["username"])) or ())
+        if len(added) > 64:
+            self._terms.extend(added)
+            self._terms.sort()
+        else:
+            for item in added:
+                bisect.insort(self._terms, item)
+
+    def remove(self, service: str, username: str) -> bool:
+        """Drop one entry from the index. Returns False if it was not indexed."""
+        entry = self._ids.pop((service, username), None)
+        if entry is None:
+            return False
+        self._keys[entry] = None
+        fields = self._fields.pop(entry)
+        for field in fields:
+            self._discard(self._exact, field, entry)
+        terms = _terms(fields[0]) | _terms(fields[1])
+        for gram in set().union(*map(_trigrams, terms)):
+            self._discard(self._trigrams, gram, entry)
+        for term in terms:
+            position = bisect.bisect_left(self._terms, (term, entry))
+            if position < len(self._terms) and self._terms[position] == (term, entry):
+                del self._terms[position]
+        return True
+
+    @staticmethod
+    def _discard(table: Dict[str, Set[int]], name: str, entry: int) -> None:
+        postings = table.get(name)
+        if postings is not None:
+            postings.discard(entry)
+            if not postings:
+                del table[name]
+
+    def clear(self) -> None:
+        self._keys.clear()
+        self._ids.clear()
+        self._fields.clear()
+        self._exact.clear()
+        self._trigrams.clear()
+        self._terms.clear()
+
+    def _prefix_entries(self, prefix: str, limit: int, found: Dict[int, None]) -> None:
+        """Add up to limit entries with a term starting with prefix to found."""
+        position = bisect.bisect_left(self._terms, (prefix,))
+        end = len(found) + limit
+        while position < len(self._terms) and len(found) < end:
+            term, entry = self._terms[position]
+            if not term.startswith(prefix):
+                break
+            found[entry] = None
+            position += 1
+
+    def _substring_entries(self, query: str, limit: int, found: Dict[int, None]) -> None:
+        """Add up to limit entries containing query to found (rarest trigram first)."""
+        postings = sorted((self._trigrams.get(gram, set()) for gram in _inner_trigrams(query)), key=len)
+        if not postings or not postings[0]:
+            return
+        end = len(found) + limit
+        rarest, others = postings[0], postings[1:]
+        for entry in rarest:
+            if entry in found or not all(entry in other for other in others):
+                continue
+            if any(query in field for field in self._fields[entry]):
+                found[entry] = None
+                if len(found) >= end:
+                    return
+
+    def _fuzzy_entries(self, grams: Set[str], min_score: float, limit: int,
+                       found: Dict[int, None]) -> None:
+        """Add the limit entries sharing the most trigrams with the query to found."""
+        # Dice >= min_score needs at least `shared` common trigrams, so any
+        # such entry appears in one of the len(grams) - shared + 1 rarest lists
+        shared = max(1, math.ceil(min_score * len(grams) / (2 - min_score)))
+        postings = sorted((self._trigrams.get(gram, set()) for gram in grams), key=len)
+        candidates = set().union(*postings[:len(grams) - shared + 1])
+        counts: Counter = Counter()
+        for gram_postings in postings:
+            counts.update(candidates & gram_postings)
+        for entry, count in counts.most_common(limit):
+            if count < shared:
+                break
+            found[entry] = None
+
+    def _score(self, entry: int, query: str, grams: Set[str]) -> float:
+        best = 0.0
+        for field, bonus in zip(self._fields[entry], (SERVICE_BONUS, 0.0)):
+            if field == query:
+                score = EXACT_SCORE
+            elif field.startswith(query):
+                score = PREFIX_SCORE
+            elif any(word.startswith(query) for word in _terms(field)):
+                score = WORD_PREFIX_SCORE
+            elif query in field:
+                score = SUBSTRING_SCORE
+            elif grams:
+                score = max(_dice(grams, _trigrams(term)) for term in _terms(field))
+            else:
+                score = 0.0
+            if score > 0:
+                best = max(best, score + bonus)
+        return best
+
+    def _ranked(self, entries: Iterable[int], query: str, grams: Set[str],
+                limit: int, min_score: float) -> List[Tuple[str, str, float]]:
+        scored = []
+        for entry in entries:
+            score = self._score(entry, query, grams)
+            if score >= min_score:
+                key = self._keys[entry]
+                scored.append((-score, len(key[0]), key))
+        scored.sort()
+        return [(key[0], key[1], -negated) for negated, _, key in scored[:limit]]
+
+    def complete(self, prefix: str, limit: int = 10) -> List[Key]:
+        """Autocomplete: entries whose service, username or a word in them starts with prefix."""
+        prefix = _normalize(prefix)
+        if not prefix:
+            return []
+        found: Dict[int, None] = {}
+        self._prefix_entries(prefix, limit, found)
+        return [(service, username) for service, username, _ in
+                self._ranked(found, prefix, set(), limit, 0.0)]
+
+    def search(self, query: str, limit: int = 10,
+               min_score: float = MIN_FUZZY_SCORE) -> List[Tuple[str, str, float]]:
+        """
+        Ranked substring and fuzzy search.
+
+        Exact matches rank first, then prefix, word-prefix and substring
+        matches, then fuzzy matches by trigram overlap (Dice coefficient of
+        at least min_score). Hits on the service rank above the same kind of
+        hit on the username. Queries shorter than three characters only
+        match exactly or by prefix.
+
+        Returns:
+            List of (service, username, score), best first
+        """
+        query = _normalize(query)
+        if not query:
+            return []
+        grams = _trigrams(query) if len(query) >= 3 else set()
+
+        found: Dict[int, None] = dict.fromkeys(self._exact.get(query, ()))
+        self._prefix_entries(query, limit * 2, found)
+        if len(found) < limit and grams:
+            self._substring_entries(query, limit * 2, found)
+        if len(found) < limit and grams:
+            self._fuzzy_entries(grams, min_score, limit * 4, found)
+        return self._ranked(found, query, grams, limit, min_score)
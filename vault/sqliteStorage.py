@@ -0,0 +1,197 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from telemetry import metrics
+from .fileLock import FileLock
+from .storage import VaultStorage
+
+
+class SQLiteStorage(VaultStorage):
+    """
+    SQLite-backed vault storage.
+
+    The database runs in WAL mode and keeps a unique index on
+    (service, username), so point lookups and deletes are index seeks instead
+    of scans over every credential. Bulk writes run inside one transaction.
+
+    Writes and opening also hold a file lock next to the database, so a
+    master password change can keep other processes from connecting while
+    it replaces the file (see leave_wal_mode).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self.file_lock = FileLock(path)
+        with self.file_lock:
+            self._connect()
+
+    def _connect(self) -> None:
+        # Wait on other processes' write locks instead of failing with "database is locked"
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS credentials (
+                    id INTEGER PRIMARY KEY,
+                    service TEXT NOT NULL,
+                    username TEXT NOT NULL,
+                    password TEXT NOT NULL,
+                    email TEXT NOT NULL
+                )"""
+            )
+            self._conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_credentials_service_username "
+                "ON credentials (service, username)"
+            )
+
+    @staticmethod
+    def _row_to_record(row) -> Dict:
+        return {"service": row[0], "username": row[1], "password": row[2], "email": row[3]}
+
+    def list_credentials(self) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT service, username, password, email FROM credentials ORDER BY id"
+            ).fetchall()
+        return [self._row_to_record(row) for row in rows]
+
+    def iter_credentials(self, offset: int = 0, limit: Optional[int] = None) -> Iterator[Dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT service, username, password, email FROM credentials "
+                "ORDER BY id LIMIT ? OFFSET ?",
+                (-1 if limit is None else limit, offset)
+            ).fetchall()
+        return (self._row_to_record(row) for row in rows)
+
+    def get(self, service: str, username: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT service, username, password, email FROM credentials "
+                "WHERE service = ? AND username = ?",
+                (service, username)
+            ).fetchone()
+        return self._row_to_record(row) if row else None
+
+    def put(self, record: Dict) -> None:
+        self.put_many([record])
+
+    def put_many(self, records: Iterable[Dict]) -> int:
+        """Insert or replace many records in a single transaction."""
+        rows = [
+            (r["service"], r["username"], r["password"], r["email"])
+            for r in records
+        ]
+        with metrics.timed('storage.sqlite.write'), self._lock, self.file_lock, self._conn:
+            self._guard_write()
+            self._conn.executemany(
+                "INSERT INTO credentials (service, username, password, email) "
+                "VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (service, username) DO UPDATE SET "
+                "password = excluded.password, email = excluded.email",
+                rows
+            )
+        return len(rows)
+
+    def delete(self, service: str, username: str) -> bool:
+        with metrics.timed('storage.sqlite.write'), self._lock, self.file_lock, self._conn:
+            self._guard_write()
+            cursor = self._conn.execute(
+                "DELETE FROM credentials WHERE service = ? AND username = ?",
+                (service, username)
+            )
+        return cursor.rowcount > 0
+
+    def delete_many(self, keys: Iterable) -> int:
+        """Delete many (service, username) pairs in a single transaction."""
+        with metrics.timed('storage.sqlite.write'), self._lock, self.file_lock, self._conn:
+            self._guard_write()
+            cursor = self._conn.executemany(
+                "DELETE FROM credentials WHERE service = ? AND username = ?",
+                list(keys)
+            )
+        return cursor.rowcount
+
+    def leave_wal_mode(self, timeout: float = 1.0) -> None:
+        """
+        Fold the write-ahead log into the database file and stop using one.
+
+        SQLite only allows this while no other connection has the database
+        open, so afterwards (with file_lock held, which keeps new
+        connections out) the file can be replaced without another process
+        keeping a vault.db-wal that would be applied to the new file.
+
+        Raises:
+            RuntimeError: If another connection has the database open
+        """
+        with self._lock:
+            self._conn.execute(f"PRAGMA busy_timeout = {int(timeout * 1000)}")
+            try:
+                mode = self._conn.execute("PRAGMA journal_mode=DELETE").fetchone()[0]
+            except sqlite3.OperationalError:
+                mode = 'wal'
+            finally:
+                self._conn.execute("PRAGMA busy_timeout = 30000")
+        if mode.lower() != 'delete':
+            raise RuntimeError(f"{self.path} is open in another process; close it and try again")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM credentials").fetchone()[0]
+
+
+def migrate_json_vault(json_path: str, db_path: str) -> int:
+    """
+    Copy the credentials of one ``vault.json`` into a SQLite vault.
+
+    The JSON file is left in place. Returns the number of records migrated.
+    """
+    with open(json_path, 'r') as file:
+        data = json.load(file)
+    # Build the database under a temporary name so an interrupted migration
+    # never leaves a half-filled vault.db behind.
+    tmp_path = db_path + '.migrating'
+    storage = SQLiteStorage(tmp_path)
+    try:
+        count = storage.put_many(data.get("credentials", []))
+        storage.close()
+        os.replace(tmp_path, db_path)
+    except Exception:
+        storage.close()
+        for path in (tmp_path, tmp_path + '-wal', tmp_path + '-shm'):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    logging.info(f"Migrated {count} credentials from {json_path} to {db_path}")
+    return count
+
+
+def migrate_user_vaults(base_dir: str = 'userApps') -> Dict[str, int]:
+    """
+    Migrate every ``<base_dir>/<user>/vault.json`` that has no ``vault.db`` yet.
+
+    Returns a mapping of username to the number of records migrated.
+    """
+    migrated = {}
+    if not os.path.isdir(base_dir):
+        return migrated
+    for username in sorted(os.listdir(base_dir)):
+        user_dir = os.path.join(base_dir, username)
+        json_path = os.path.join(user_dir, 'vault.json')
+        db_path = os.path.join(user_dir, 'vault.db')
+        if os.path.isfile(json_path) and not os.path.exists(db_path):
+            try:
+                migrated[username] = migrate_json_vault(json_path, db_path)
+            except Exception as e:
+                logging.error(f"Error migrating vault for {username}: {str(e)}")
+    return migrated
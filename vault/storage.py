@@ -0,0 +1,198 @@
+import itertools
+import json
+import logging
+import os
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from telemetry import metrics
+from .fileLock import FileLock
+from .groupCommit import GroupCommitQueue
+
+
+def credential_key(service: str, username: str) -> Tuple[str, str]:
+    """Return the (service, username) key a credential is stored under."""
+    return (service, username)
+
+
+class VaultStorage:
+    """
+    Base class for the storage engines that sit behind VaultManager.
+
+    Records are plain dicts with the keys ``service``, ``username``,
+    ``password`` and ``email``; password and email are already encrypted by
+    the time they reach the storage layer. Each (service, username) pair
+    holds at most one record, a second put replaces the first.
+
+    Engines that set encrypts_records encrypt whole records themselves and
+    are handed password and email in plaintext instead.
+
+    write_guard, if set, is called before every write with the engine's
+    write lock held and may raise to refuse it; VaultManager uses it to
+    refuse writes under a vault key that was replaced by a password change.
+    """
+
+    encrypts_records = False
+    write_guard: Optional[Callable[[], None]] = None
+
+    def _guard_write(self) -> None:
+        if self.write_guard is not None:
+            self.write_guard()
+
+    def list_credentials(self) -> List[Dict]:
+        """Return every stored credential record."""
+        raise NotImplementedError
+
+    def iter_credentials(self, offset: int = 0, limit: Optional[int] = None) -> Iterator[Dict]:
+        """Yield stored records starting at offset, at most limit of them."""
+        stop = None if limit is None else offset + limit
+        return itertools.islice(self.list_credentials(), offset, stop)
+
+    def get(self, service: str, username: str) -> Optional[Dict]:
+        """Return the record stored for (service, username), if any."""
+        raise NotImplementedError
+
+    def put(self, record: Dict) -> None:
+        """Insert or replace a single credential record."""
+        raise NotImplementedError
+
+    def delete(self, service: str, username: str) -> bool:
+        """Remove the record for (service, username). Returns True if it existed."""
+        raise NotImplementedError
+
+    def put_many(self, records: Iterable[Dict]) -> int:
+        """Insert or replace many records. Returns the number written."""
+        count = 0
+        for record in records:
+            self.put(record)
+            count += 1
+        return count
+
+    def delete_many(self, keys: Iterable[Tuple[str, str]]) -> int:
+        """Remove many (service, username) pairs. Returns the number removed."""
+        return sum(1 for service, username in keys if self.delete(service, username))
+
+    def close(self) -> None:
+        """Release any file handles held by the storage engine."""
+
+    def __len__(self) -> int:
+        return len(self.list_credentials())
+
+
+class PlaintextFields:
+    """
+    Stands in for the vault's Fernet instance when the storage engine
+    encrypts whole records: fields pass through unchanged.
+    """
+
+    def encrypt(self, data: bytes) -> bytes:
+        return data
+
+    def decrypt(self, token: bytes) -> bytes:
+        return token
+
+
+class JsonStorage(VaultStorage):
+    """
+    The original single-document ``vault.json`` layout.
+
+    Writers hold an advisory file lock, re-read the current document, apply
+    their changes and atomically rename a new document into place, so
+    concurrent threads and processes never lose each other's updates.
+    Readers need no lock because the file is only ever replaced whole.
+    Concurrent writes within a process are merged by a group-commit queue
+    into a single rewrite.
+    """
+
+    def __init__(self, path: str, group_commit: bool = True):
+        self.path = path
+        self.group_commit = group_commit
+        self.file_lock = FileLock(path)
+        self.commit_queue = GroupCommitQueue(self._commit_batch)
+        with self.file_lock:
+            if not os.path.exists(self.path):
+                self._write({"credentials": []})
+                logging.info(f"Created new vault file: {self.path}")
+            else:
+                # Verify file is readable and has valid JSON
+                self._read()
+
+    def _read(self) -> Dict:
+        with metrics.timed('storage.json.read'):
+            with open(self.path, 'r') as file:
+                text = file.read()
+        with metrics.timed('storage.json.parse'):
+            return json.loads(text)
+
+    def _write(self, data: Dict) -> None:
+        # Write a sibling file and rename it over the vault so a crash
+        # mid-write never leaves a truncated vault.json behind.
+        with metrics.timed('storage.json.serialize'):
+            text = json.dumps(data, indent=4)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with metrics.timed('storage.json.write'):
+            with open(tmp_path, 'w') as file:
+                file.write(text)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.path)
+
+    def _commit_batch(self, operations: List[Tuple[str, list]]) -> List[int]:
+        """Apply queued puts/deletes with one locked read-modify-rename."""
+        with self.file_lock:
+            self._guard_write()
+            data = self._read()
+            stored = data.get("credentials", [])
+            existing = {credential_key(cred["service"], cred["username"]) for cred in stored}
+            # Keys touched by this batch -> their new record, or None once deleted.
+            # Only entries of these keys are rewritten; every other entry (including
+            # duplicates left by older versions) stays as it is.
+            touched: Dict[Tuple[str, str], Optional[Dict]] = {}
+            results = []
+            for kind, items in operations:
+                if kind == 'put':
+                    for record in items:
+                        key = credential_key(record["service"], record["username"])
+                        touched.pop(key, None)  # a replaced entry moves to the end
+                        touched[key] = record
+                    results.append(len(items))
+                else:
+                    removed = 0
+                    for key in items:
+                        present = touched[key] is not None if key in touched else key in existing
+                        if present:
+                            touched[key] = None
+                            removed += 1
+                    results.append(removed)
+            if touched:
+                data["credentials"] = [
+                    cred for cred in stored
+                    if credential_key(cred["service"], cred["username"]) not in touched
+                ] + [record for record in touched.values() if record is not None]
+                self._write(data)
+        return results
+
+    def _submit(self, operation: Tuple[str, list]) -> int:
+        if self.group_commit:
+            return self.commit_queue.submit(operation)
+        return self._commit_batch([operation])[0]
+
+    def list_credentials(self) -> List[Dict]:
+        return self._read().get("credentials", [])
+
+    def get(self, service: str, username: str) -> Optional[Dict]:
+        for cred in self.list_credentials():
+            if cred["service"] == service and cred["username"] == username:
+                return cred
+        return None
+
+    def put(self, record: Dict) -> None:
+        self.put_many([record])
+
+    def put_many(self, records: Iterable[Dict]) -> int:
+        return self._submit(('put', list(records)))
+
+    def delete(self, service: str, username: str) -> bool:
+        return self.delete_many([(service, username)]) > 0
+
+    def delete_many(self, keys: Iterable[Tuple[str, str]]) -> int:
+        return self._submit(('delete', list(dict.fromkeys(keys))))
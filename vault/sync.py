@@ -0,0 +1,532 @@
+"""
+Record-level delta synchronisation between vault replicas.
+
+Every credential gets a record id (a keyed HMAC of service and username, so
+replicas agree on it without revealing the names), a Lamport clock value and
+the id of the replica that wrote that version. Deletions leave tombstones.
+Replicas compare a Merkle tree over these versions, descend only into
+subtrees whose hashes differ, and move just the records that changed, each
+sealed with the vault's sync key; the sync server never sees a name or a
+password. Concurrent edits of the same record are resolved by the highest
+(clock, replica id), which every replica computes the same way.
+
+The sync key is derived from the first vault key. A master password change
+keeps it, sealed with the new vault key in the user's sync-key file, so
+record ids and seals survive the change. A server is bound to the key check
+of the first replica that syncs with it, and a replica with another sync key
+is refused before it changes anything.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from telemetry import metrics
+
+HEX_DIGITS = '0123456789abcdef'
+MERKLE_DEPTH = 4  # 65536 leaves: about one record per leaf at 50k records
+EMPTY_HASH = '0' * 32
+STATE_FILE = 'sync-state.json'
+SYNC_KEY_FILE = 'sync-key'
+
+
+def load_sync_key(vault_manager) -> bytes:
+    """
+    The vault's sync key: the one kept in sync-key by a master password
+    change, or else the one derived from the vault key.
+
+    Raises:
+        ValueError: If sync-key was sealed with another vault key
+    """
+    path = os.path.join(vault_manager.user_dir, SYNC_KEY_FILE)
+    try:
+        with open(path, 'rb') as file:
+            token = file.read()
+    except FileNotFoundError:
+        return vault_manager.derive_subkey('sync-v1')
+    try:
+        return Fernet(vault_manager._vault_key).decrypt(token)
+    except InvalidToken:
+        raise ValueError(f"{path} was sealed with another vault key")
+
+
+def write_sync_key(path: str, vault_key: bytes, sync_key: bytes) -> None:
+    """Seal a sync key with a vault key into path, readable by its owner only."""
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(fd, 'wb') as file:
+        file.write(Fernet(vault_key).encrypt(sync_key))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+def version_hash(record_id: str, clock: int, replica: str, deleted: bool) -> str:
+    return hashlib.sha256(f'{record_id}:{clock}:{replica}:{int(deleted)}'.encode()).hexdigest()[:32]
+
+
+def newer(a: Tuple[int, str], b: Optional[Tuple[int, str]]) -> bool:
+    """True if version a = (clock, replica) wins over b (None: no version)."""
+    return b is None or tuple(a) > tuple(b)
+
+
+class MerkleTree:
+    """
+    Hash tree over record versions, keyed by the hex digits of record ids.
+
+    A node is named by an id prefix; leaves are the prefixes of length depth
+    and hold the version hashes of the records under them. Hashes are
+    computed on demand and cached; an update only invalidates the path from
+    its leaf to the root. Empty subtrees hash to EMPTY_HASH.
+    """
+
+    def __init__(self, depth: int = MERKLE_DEPTH):
+        self.depth = depth
+        self._leaves: Dict[str, Dict[str, str]] = {}
+        self._counts: Dict[str, int] = {}
+        self._cache: Dict[str, str] = {}
+
+    def update(self, record_id: str, vhash: Optional[str]) -> None:
+        """Set (or with None remove) the version hash of a record."""
+        leaf = self._leaves.setdefault(record_id[:self.depth], {})
+        delta = (vhash is not None) - (record_id in leaf)
+        if vhash is None:
+            leaf.pop(record_id, None)
+        else:
+            leaf[record_id] = vhash
+        for length in range(self.depth + 1):
+            prefix = record_id[:length]
+            self._cache.pop(prefix, None)
+            if delta:
+                self._counts[prefix] = self._counts.get(prefix, 0) + delta
+
+    def hash(self, prefix: str = '') -> str:
+        cached = self._cache.get(prefix)
+        if cached is not None:
+            return cached
+        if not self._counts.get(prefix):
+            return EMPTY_HASH
+        if len(prefix) == self.depth:
+            leaf = self._leaves[prefix]
+            material = ''.join(f'{rid}{leaf[rid]}' for rid in sorted(leaf))
+        else:
+            material = ''.join(self.children(prefix))
+        value = hashlib.sha256(material.encode()).hexdigest()[:32]
+        self._cache[prefix] = value
+        return value
+
+    def children(self, prefix: str) -> List[str]:
+        return [self.hash(prefix + digit) for digit in HEX_DIGITS]
+
+    def leaf(self, prefix: str) -> Dict[str, str]:
+        return dict(self._leaves.get(prefix, {}))
+
+
+class SyncStore:
+    """
+    Record versions and sealed payloads as kept by a sync server.
+
+    Holds no keys: records are (clock, replica, deleted, blob) under an
+    opaque id. A push only replaces a stored version with a newer one, so
+    several replicas can push concurrently and the outcome is deterministic.
+    key_check identifies the sync key the records were made with.
+    """
+
+    def __init__(self, depth: int = MERKLE_DEPTH):
+        self.records: Dict[str, Dict] = {}
+        self.tree = MerkleTree(depth)
+        self.key_check: Optional[str] = None
+
+    def _load(self, record_id: str, record: Dict) -> None:
+        self.records[record_id] = record
+        self.tree.update(record_id, version_hash(record_id, record["clock"], record["replica"], record["deleted"]))
+
+    # Protocol requests; arguments and results are JSON-serialisable
+
+    def bind(self, key_check: str) -> str:
+        """Bind an unbound store to a replica's key check; returns the check the store is bound to."""
+        if self.key_check is None:
+            self.key_check = key_check
+            self._persist_key_check()
+        return self.key_check
+
+    def root(self) -> str:
+        return self.tree.hash('')
+
+    def children(self, prefixes: List[str]) -> Dict[str, List[str]]:
+        return {prefix: self.tree.children(prefix) for prefix in prefixes}
+
+    def leaves(self, prefixes: List[str]) -> Dict[str, Dict[str, List]]:
+        """Versions (clock, replica, deleted) of every record under each leaf prefix."""
+        return {prefix: {rid: [self.records[rid]["clock"], self.records[rid]["replica"], self.records[rid]["deleted"]]
+                         for rid in self.tree.leaf(prefix)}
+                for prefix in prefixes}
+
+    def fetch(self, record_ids: List[str]) -> Dict[str, Dict]:
+        return {rid: self.records[rid] for rid in record_ids if rid in self.records}
+
+    def push(self, records: Dict[str, Dict]) -> Dict[str, List[str]]:
+        """Store pushed versions that are newer than the stored ones."""
+        accepted, rejected = [], []
+        for rid, record in records.items():
+            current = self.records.get(rid)
+            if newer((record["clock"], record["replica"]),
+                     (current["clock"], current["replica"]) if current else None):
+                self._load(rid, record)
+                accepted.append(rid)
+            else:
+                rejected.append(rid)
+        self._persist(accepted)
+        return {"accepted": accepted, "rejected": rejected}
+
+    def _persist(self, record_ids: List[str]) -> None:
+        """Hook for stores that keep records on disk."""
+
+    def _persist_key_check(self) -> None:
+        """Hook for stores that keep records on disk."""
+
+
+class DirectorySyncServer(SyncStore):
+    """
+    Sync server stand-in kept in a directory, e.g. a shared or mounted folder.
+
+    Records live in an SQLite database (sync.db) in the directory, so several
+    processes can sync through the same folder; each request first picks up
+    commits made by other connections, and pushes compare and write inside
+    one immediate transaction.
+    """
+
+    def __init__(self, directory: str, depth: int = MERKLE_DEPTH):
+        import sqlite3
+
+        super().__init__(depth)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, 'sync.db')
+        self._connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS records (id TEXT PRIMARY KEY, clock INTEGER, replica TEXT, "
+            "deleted INTEGER, blob TEXT)"
+        )
+        self._connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self._data_version = None
+        self._refresh()
+
+    def _refresh(self) -> None:
+        """Reload the records if another connection committed since the last request."""
+        (data_version,) = self._connection.execute("PRAGMA data_version").fetchone()
+        if data_version == self._data_version:
+            return
+        self.records, self.tree = {}, MerkleTree(self.tree.depth)
+        for rid, clock, replica, deleted, blob in self._connection.execute("SELECT * FROM records"):
+            self._load(rid, {"clock": clock, "replica": replica, "deleted": bool(deleted), "blob": blob})
+        row = self._connection.execute("SELECT value FROM meta WHERE name = 'key_check'").fetchone()
+        self.key_check = row[0] if row else None
+        self._data_version = data_version
+
+    def bind(self, key_check: str) -> str:
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._refresh()
+            result = super().bind(key_check)
+            self._connection.execute("COMMIT")
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            self._data_version = None
+            raise
+        return result
+
+    def root(self) -> str:
+        self._refresh()
+        return super().root()
+
+    def children(self, prefixes: List[str]) -> Dict[str, List[str]]:
+        self._refresh()
+        return super().children(prefixes)
+
+    def leaves(self, prefixes: List[str]) -> Dict[str, Dict[str, List]]:
+        self._refresh()
+        return super().leaves(prefixes)
+
+    def fetch(self, record_ids: List[str]) -> Dict[str, Dict]:
+        self._refresh()
+        return super().fetch(record_ids)
+
+    def push(self, records: Dict[str, Dict]) -> Dict[str, List[str]]:
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._refresh()
+            result = super().push(records)
+            self._connection.execute("COMMIT")
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            self._data_version = None  # in-memory records may be ahead of the database
+            raise
+        return result
+
+    def _persist(self, record_ids: List[str]) -> None:
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)",
+            [(rid, self.records[rid]["clock"], self.records[rid]["replica"], int(self.records[rid]["deleted"]),
+              self.records[rid]["blob"]) for rid in record_ids]
+        )
+
+    def _persist_key_check(self) -> None:
+        self._connection.execute("INSERT OR REPLACE INTO meta VALUES ('key_check', ?)", (self.key_check,))
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+class Transport:
+    """
+    Client side of the sync protocol.
+
+    Calls the server's request methods with JSON-encoded arguments and
+    results, as a network transport would, and counts messages and bytes.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.messages = 0
+        self.bytes = 0
+
+    def call(self, method: str, *args):
+        request = json.dumps([method, *args])
+        reply = json.dumps(getattr(self.server, method)(*json.loads(request)[1:]))
+        self.messages += 1
+        self.bytes += len(request) + len(reply)
+        return json.loads(reply)
+
+
+class VaultReplica:
+    """
+    One vault's side of the sync protocol.
+
+    Record versions are kept in sync-state.json next to the vault. Local
+    changes are found by comparing a keyed digest of every stored record
+    with the state, which works whichever program or storage engine wrote
+    them; the scan is skipped while the vault files are unchanged. State
+    saved under another sync key is discarded.
+    """
+
+    def __init__(self, vault_manager, state_file: Optional[str] = None):
+        """
+        Args:
+            vault_manager: An unlocked VaultManager
+            state_file (str): Sync state path (default: sync-state.json in the user's directory)
+        """
+        self.vault_manager = vault_manager
+        self.state_file = state_file or os.path.join(vault_manager.user_dir, STATE_FILE)
+        key = load_sync_key(vault_manager)
+        self._id_key = hashlib.sha256(b'id' + key).digest()
+        self._seal = AESGCM(hashlib.sha256(b'seal' + key).digest())
+        self.key_check = hmac.new(self._id_key, b'naitevarnasse-sync-key-check', hashlib.sha256).hexdigest()
+        self.replica = os.urandom(8).hex()
+        self.clock = 0
+        self.versions: Dict[str, List] = {}  # id -> [clock, replica, deleted, digest]
+        self.stamp = None
+        self._keys: Optional[Dict[str, Tuple[str, str]]] = None
+        self.tree = MerkleTree()
+        self._load_state()
+
+    # Local state
+
+    def _load_state(self) -> None:
+        if not os.path.exists(self.state_file):
+            return
+        with open(self.state_file, 'r') as file:
+            state = json.load(file)
+        if state.get("key_check", self.key_check) != self.key_check:
+            # Record ids of another sync key mean nothing here; this replica starts over
+            logging.warning(f"Discarding sync state of {self.vault_manager.username} made under another sync key")
+            return
+        self.replica, self.clock = state["replica"], state["clock"]
+        self.stamp = state.get("stamp")
+        self.versions = state["versions"]
+        for rid, (clock, replica, deleted, _) in self.versions.items():
+            self.tree.update(rid, version_hash(rid, clock, replica, deleted))
+
+    def _save_state(self) -> None:
+        tmp_path = f'{self.state_file}.{os.getpid()}.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, 'w') as file:
+            json.dump({"replica": self.replica, "clock": self.clock, "stamp": self.stamp,
+                       "key_check": self.key_check, "versions": self.versions}, file)
+        os.replace(tmp_path, self.state_file)
+
+    def record_id(self, service: str, username: str) -> str:
+        message = service.encode() + b'\0' + username.encode()
+        return hmac.new(self._id_key, message, hashlib.sha256).hexdigest()[:32]
+
+    def _digest(self, stored: Dict) -> str:
+        message = json.dumps([stored["service"], stored["username"], stored["password"], stored["email"]])
+        return hmac.new(self._id_key, message.encode(), hashlib.sha256).hexdigest()[:32]
+
+    def _vault_stamp(self) -> List:
+        stamp = []
+        for path in (self.vault_manager.data_file, self.vault_manager.data_file + '-wal'):
+            try:
+                stat = os.stat(path)
+                stamp.append([stat.st_ino, stat.st_size, stat.st_mtime_ns])
+            except FileNotFoundError:
+                stamp.append(None)
+        return stamp
+
+    def _set_version(self, rid: str, clock: int, replica: str, deleted: bool, digest: Optional[str]) -> None:
+        self.versions[rid] = [clock, replica, deleted, digest]
+        self.tree.update(rid, version_hash(rid, clock, replica, deleted))
+
+    def scan(self) -> int:
+        """Give new versions to records changed or deleted locally. Returns how many changed."""
+        stamp = self._vault_stamp()
+        if stamp == self.stamp:
+            return 0
+        changed = 0
+        keys = {}
+        with metrics.timed('sync.scan'):
+            for stored in self.vault_manager.storage.iter_credentials():
+                rid = self.record_id(stored["service"], stored["username"])
+                keys[rid] = (stored["service"], stored["username"])
+                digest = self._digest(stored)
+                version = self.versions.get(rid)
+                if version is None or version[2] or version[3] != digest:
+                    self.clock += 1
+                    self._set_version(rid, self.clock, self.replica, False, digest)
+                    changed += 1
+            for rid, version in list(self.versions.items()):
+                if rid not in keys and not version[2]:
+                    self.clock += 1
+                    self._set_version(rid, self.clock, self.replica, True, None)
+                    changed += 1
+        self._keys = keys
+        self.stamp = stamp
+        return changed
+
+    def _local_keys(self) -> Dict[str, Tuple[str, str]]:
+        if self._keys is None:
+            self._keys = {self.record_id(c["service"], c["username"]): (c["service"], c["username"])
+                          for c in self.vault_manager.storage.iter_credentials()}
+        return self._keys
+
+    # Sealing
+
+    @staticmethod
+    def _associated_data(rid: str, clock: int, replica: str) -> bytes:
+        return f'{rid}:{clock}:{replica}'.encode()
+
+    def _sealed(self, record_ids: List[str]) -> Dict[str, Dict]:
+        """Current versions of records ready to push, live ones with their sealed payload."""
+        keys = self._local_keys()
+        live = {keys[rid]: rid for rid in record_ids if not self.versions[rid][2]}
+        if len(live) <= 16:
+            stored = (self.vault_manager.storage.get(*key) for key in live)
+        else:  # one pass over the vault instead of a lookup per record
+            stored = (c for c in self.vault_manager.storage.iter_credentials()
+                      if (c["service"], c["username"]) in live)
+        blobs = {}
+        for cred in stored:
+            rid = live[(cred["service"], cred["username"])]
+            clock, replica = self.versions[rid][:2]
+            nonce = os.urandom(12)
+            plaintext = json.dumps(self.vault_manager.decrypt_credentials(cred)).encode()
+            ciphertext = self._seal.encrypt(nonce, plaintext, self._associated_data(rid, clock, replica))
+            blobs[rid] = base64.b64encode(nonce + ciphertext).decode()
+        records = {}
+        for rid in record_ids:
+            clock, replica, deleted, _ = self.versions[rid]
+            records[rid] = {"clock": clock, "replica": replica, "deleted": deleted, "blob": blobs.get(rid)}
+        return records
+
+    def _unsealed(self, rid: str, record: Dict) -> Dict:
+        blob = base64.b64decode(record["blob"])
+        try:
+            cred = json.loads(self._seal.decrypt(blob[:12], blob[12:], self._associated_data(
+                rid, record["clock"], record["replica"])))
+        except InvalidTag:
+            raise ValueError(f"Sync record {rid} failed authentication")
+        if self.record_id(cred["service"], cred["username"]) != rid:
+            raise ValueError(f"Sync record {rid} does not match its id")
+        return cred
+
+    # Protocol
+
+    def _differing_leaves(self, transport: Transport) -> List[str]:
+        """Walk down both trees level by level, keeping only subtrees whose hashes differ."""
+        if transport.call('root') == self.tree.hash(''):
+            return []
+        frontier = ['']
+        for _ in range(self.tree.depth):
+            remote = transport.call('children', frontier)
+            frontier = [prefix + digit
+                        for prefix in frontier
+                        for digit, local_hash, remote_hash in zip(HEX_DIGITS, self.tree.children(prefix), remote[prefix])
+                        if local_hash != remote_hash]
+        return frontier
+
+    def sync(self, server) -> Dict:
+        """
+        Exchange changes with a sync server (a SyncStore or DirectorySyncServer).
+
+        Returns:
+            Dict with "local_changes" (versions created by the local scan),
+            "pulled", "pushed", "messages" and "bytes"
+
+        Raises:
+            ValueError: If the server holds records of another sync key
+        """
+        transport = server if isinstance(server, Transport) else Transport(server)
+        if transport.call('bind', self.key_check) != self.key_check:
+            raise ValueError("The sync directory holds records made with another sync key; "
+                             "sync to a new directory")
+        result = {"local_changes": self.scan(), "pulled": 0, "pushed": 0}
+        with metrics.timed('sync.sync'):
+            leaves = self._differing_leaves(transport)
+            pulls, pushes = [], []
+            if leaves:
+                remote = transport.call('leaves', leaves)
+                for prefix in leaves:
+                    remote_versions = remote[prefix]
+                    for rid in set(remote_versions) | set(self.tree.leaf(prefix)):
+                        theirs = remote_versions.get(rid)
+                        ours = self.versions.get(rid)
+                        if theirs is not None:
+                            self.clock = max(self.clock, theirs[0])
+                        if ours is not None and (theirs is None or newer(ours[:2], theirs[:2])):
+                            pushes.append(rid)
+                        elif theirs is not None and (ours is None or newer(theirs[:2], ours[:2])):
+                            pulls.append(rid)
+            if pulls:
+                self._apply(transport.call('fetch', pulls))
+                result["pulled"] = len(pulls)
+            if pushes:
+                reply = transport.call('push', self._sealed(pushes))
+                result["pushed"] = len(reply["accepted"])
+        self._save_state()
+        result.update(messages=transport.messages, bytes=transport.bytes)
+        logging.info(f"Synced vault for {self.vault_manager.username}: {result}")
+        return result
+
+    def _apply(self, rid_records: Dict[str, Dict]) -> None:
+        """Write pulled versions to the vault with one put and one delete."""
+        keys = self._local_keys()
+        live, dead = [], []
+        for rid, record in rid_records.items():
+            if record["deleted"]:
+                if rid in keys:
+                    dead.append(keys.pop(rid))
+                self._set_version(rid, record["clock"], record["replica"], True, None)
+            else:
+                cred = self._unsealed(rid, record)
+                live.append((rid, record, cred))
+        self.vault_manager.remove_credentials(dead)
+        stored = self.vault_manager.store_credentials([cred for _, _, cred in live])
+        for (rid, record, cred), stored_record in zip(live, stored):
+            keys[rid] = (cred["service"], cred["username"])
+            self._set_version(rid, record["clock"], record["replica"], False, self._digest(stored_record))
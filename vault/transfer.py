@@ -0,0 +1,246 @@
+import csv
+import json
+import logging
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+from urllib.parse import urlparse
+
+from telemetry import metrics
+from .storage import credential_key
+
+IMPORT_FORMATS = ('csv', 'json', 'native')
+EXPORT_FORMATS = ('csv', 'json', 'native')
+
+# Column names used by browser and password-manager CSV exports
+_SERVICE_COLUMNS = ('name', 'title', 'service', 'url', 'login_uri', 'origin')
+_USERNAME_COLUMNS = ('username', 'login_username', 'login', 'user')
+_PASSWORD_COLUMNS = ('password', 'login_password')
+_EMAIL_COLUMNS = ('email', 'e-mail')
+
+ProgressCallback = Callable[[int], None]
+
+
+def _first(row: Dict, columns: Iterable[str]) -> str:
+    for column in columns:
+        value = row.get(column)
+        if value:
+            return value.strip()
+    return ''
+
+
+def _service_name(value: str) -> str:
+    """Reduce a URL to its host name; leave plain service names alone."""
+    if '://' in value:
+        host = urlparse(value).hostname or value
+        return host[4:] if host.startswith('www.') else host
+    return value
+
+
+def read_csv_credentials(path: str) -> Iterator[Dict]:
+    """
+    Stream plaintext credentials from a browser-style CSV export.
+
+    Chrome, Firefox, Edge and Bitwarden layouts are recognised by their
+    header row. The email falls back to the username when it looks like one.
+    """
+    with open(path, 'r', newline='', encoding='utf-8-sig') as file:
+        reader = csv.DictReader(file)
+        for row in reader:
+            row = {(k or '').strip().lower(): (v or '') for k, v in row.items()}
+            service = _service_name(_first(row, _SERVICE_COLUMNS))
+            username = _first(row, _USERNAME_COLUMNS)
+            email = _first(row, _EMAIL_COLUMNS) or (username if '@' in username else '')
+            yield {
+                "service": service,
+                "username": username,
+                "password": _first(row, _PASSWORD_COLUMNS),
+                "email": email
+            }
+
+
+def read_json_credentials(path: str) -> Iterator[Dict]:
+    """Stream plaintext credentials from a JSON list or {"credentials": [...]}."""
+    with open(path, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+    if isinstance(data, dict):
+        data = data.get("credentials", [])
+    for entry in data:
+        yield {
+            "service": entry.get("service", ''),
+            "username": entry.get("username", ''),
+            "password": entry.get("password", ''),
+            "email": entry.get("email", '')
+        }
+
+
+def _batches(items: Iterable, size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _bounded_map(pool: ThreadPoolExecutor, fn: Callable, items: Iterable, window: int) -> Iterator:
+    """Like pool.map, but only keeps `window` tasks in flight so input is streamed."""
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def import_credentials(vault_manager, path: str, fmt: Optional[str] = None,
+                       replace_existing: bool = False, batch_size: int = 256,
+                       workers: int = 4, progress: Optional[ProgressCallback] = None) -> Dict:
+    """
+    Import credentials from a file into the vault in one atomic commit.
+
+    The input is streamed and encrypted in batches on a thread pool; nothing
+    is written until every record is ready, then the whole set is stored with
+    a single VaultManager.store_credentials call (one put_many, the search
+    index and the audit log).
+
+    Args:
+        vault_manager: An unlocked VaultManager
+        path (str): File to import
+        fmt (str): 'csv', 'json' or 'native' (default: guessed from extension)
+        replace_existing (bool): Overwrite entries whose (service, username) already exists
+        batch_size (int): Records encrypted per task
+        workers (int): Encryption threads
+        progress: Called with the number of records processed so far
+
+    Returns:
+        Dict with the counts "imported", "duplicates" and "invalid"
+    """
+    fmt = fmt or ('csv' if path.lower().endswith('.csv') else 'json')
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"Unknown import format: {fmt}")
+    if fmt == 'native' and vault_manager.storage.encrypts_records:
+        raise ValueError("Native files hold Fernet tokens; convert the vault to json storage first")
+
+    storage = vault_manager.storage
+    existing = {credential_key(c["service"], c["username"]) for c in storage.iter_credentials()}
+    seen = set()
+    result = {"imported": 0, "duplicates": 0, "invalid": 0}
+
+    def accepted(records: Iterable[Dict]) -> Iterator[Dict]:
+        for record in records:
+            if not record["service"] or not record["password"]:
+                result["invalid"] += 1
+                continue
+            key = credential_key(record["service"], record["username"])
+            if key in seen or (key in existing and not replace_existing):
+                result["duplicates"] += 1
+                continue
+            seen.add(key)
+            yield record
+
+    fernet = vault_manager.fernet
+
+    def encrypt_batch(batch: List[Dict]) -> List[Dict]:
+        metrics.increment('crypto.encrypt_bulk', 2 * len(batch))
+        return [{
+            "service": r["service"],
+            "username": r["username"],
+            "password": fernet.encrypt(r["password"].encode()).decode(),
+            "email": fernet.encrypt(r["email"].encode()).decode()
+        } for r in batch]
+
+    if fmt == 'native':
+        # Already encrypted with this vault's key; check one token up front.
+        with open(path, 'r') as file:
+            records = list(accepted(json.load(file).get("credentials", [])))
+        if records:
+            fernet.decrypt(records[0]["password"].encode())
+        encrypted = records
+        if progress:
+            progress(len(encrypted))
+    else:
+        reader = read_csv_credentials if fmt == 'csv' else read_json_credentials
+        encrypted = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            batches = _batches(accepted(reader(path)), batch_size)
+            for batch in _bounded_map(pool, encrypt_batch, batches, workers * 2):
+                encrypted.extend(batch)
+                if progress:
+                    progress(len(encrypted))
+
+    result["imported"] = len(vault_manager.store_credentials(encrypted, encrypted=True))
+    logging.info(
+        f"Imported {result['imported']} credentials from {path} "
+        f"({result['duplicates']} duplicates, {result['invalid']} invalid)"
+    )
+    return result
+
+
+def export_credentials(vault_manager, path: str, fmt: str = 'csv', batch_size: int = 256,
+                       workers: int = 4, progress: Optional[ProgressCallback] = None) -> int:
+    """
+    Stream the vault to a file. Returns the number of records written.
+
+    'csv' and 'json' write plaintext; 'native' copies the encrypted records
+    as they are stored. The file is written under a temporary name with
+    owner-only permissions and renamed into place when complete.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if fmt == 'native' and vault_manager.storage.encrypts_records:
+        raise ValueError("Native files hold Fernet tokens; convert the vault to json storage first")
+
+    fernet = vault_manager.fernet
+
+    def decrypt_batch(batch: List[Dict]) -> List[Dict]:
+        metrics.increment('crypto.decrypt_bulk', 2 * len(batch))
+        return [{
+            "service": r["service"],
+            "username": r["username"],
+            "password": fernet.decrypt(r["password"].encode()).decode(),
+            "email": fernet.decrypt(r["email"].encode()).decode()
+        } for r in batch]
+
+    tmp_path = path + '.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    count = 0
+    try:
+        with open(fd, 'w', newline='', encoding='utf-8') as file, \
+                ThreadPoolExecutor(max_workers=workers) as pool:
+            batches = _batches(vault_manager.storage.iter_credentials(), batch_size)
+            if fmt != 'native':
+                batches = _bounded_map(pool, decrypt_batch, batches, workers * 2)
+
+            if fmt == 'csv':
+                writer = csv.DictWriter(file, fieldnames=["service", "username", "password", "email"])
+                writer.writeheader()
+            else:
+                file.write('{"credentials": [\n')
+
+            for batch in batches:
+                if fmt == 'csv':
+                    writer.writerows(batch)
+                else:
+                    file.write(''.join(
+                        (',\n' if count + i else '') + json.dumps(record)
+                        for i, record in enumerate(batch)
+                    ))
+                count += len(batch)
+                if progress:
+                    progress(count)
+
+            if fmt != 'csv':
+                file.write('\n]}\n')
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    logging.info(f"Exported {count} credentials to {path} as {fmt}")
+    return count
@@ -1,16 +1,35 @@
-import bcrypt
-import json
+import hashlib
+import hmac
 import logging
 import os
-from typing import Dict
-from tabulate import tabulate
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 from cryptography.fernet import Fernet
-import base64
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from user.keyDerivation import is_fernet_key, key_cache, key_check, LEGACY_SALT, LEGACY_ITERATIONS
+from telemetry import metrics
+from audit import auditLog
+from .storage import VaultStorage, JsonStorage, PlaintextFields
+from .journalStorage import JournalStorage
+from .sqliteStorage import SQLiteStorage
+from .binaryStorage import BinaryStorage
+from .fieldCache import DecryptedFieldCache
+from .keyGeneration import KeyGenerationCheck
+from .searchIndex import SearchIndex
+
+# Storage engine name -> (class, file name inside the user's directory)
+STORAGE_BACKENDS = {
+    'json': (JsonStorage, 'vault.json'),
+    'journal': (JournalStorage, 'vault.journal'),
+    'sqlite': (SQLiteStorage, 'vault.db'),
+    'binary': (BinaryStorage, 'vault.nvb'),
+}
+
+VAULT_COLUMNS = ("service", "username", "password", "email")
+VAULT_HEADERS = {"service": "Service", "username": "Username", "password": "Password", "email": "Email"}
+ENCRYPTED_COLUMNS = ("password", "email")
 
 class VaultManager:
-    def __init__(self, master_key: str, username: str, base_dir: str = 'userApps'):
+    def __init__(self, master_key: str, username: str, base_dir: str = 'userApps',
+                 storage: str = 'json', field_cache_size: int = 512):
         """
         Initialize VaultManager with user-specific vault file in userApps directory.
         
@@ -18,30 +37,36 @@ class VaultManager:
             master_key (str): User's master key for encryption
             username (str): Username to create user-specific vault
             base_dir (str): Base directory for user vaults (default: 'userApps')
+            storage (str): Storage engine, one of STORAGE_BACKENDS (default: 'json')
+            field_cache_size (int): Decrypted fields kept in memory (default: 512)
         """
+        if storage not in STORAGE_BACKENDS:
+            raise ValueError(f"Unknown storage backend: {storage}")
         self.username = username
         self.base_dir = base_dir
         self.user_dir = os.path.join(self.base_dir, username)
-        self.data_file = os.path.join(self.user_dir, 'vault.json')
+        self.storage_backend = storage
+        self.data_file = os.path.join(self.user_dir, STORAGE_BACKENDS[storage][1])
+        self.storage: VaultStorage = None
+        self._search_index: Optional[SearchIndex] = None
         
-        # Initialize encryption
-        self.fernet = self._initialize_encryption(master_key)
+        # Initialize encryption; engines that encrypt whole records get plaintext fields
+        vault_key = self._derive_vault_key(master_key)
+        self._vault_key = vault_key
+        if STORAGE_BACKENDS[storage][0].encrypts_records:
+            self.fernet = PlaintextFields()
+        else:
+            self.fernet = Fernet(vault_key)
+        self.field_cache = DecryptedFieldCache(field_cache_size)
+        self._audit_key: Optional[bytes] = None
         
-        # Set up logging with user-specific log file
-        self.log_file = os.path.join(self.user_dir, 'vault.log')
-        self._setup_logging()
-        
-        # Initialize directory structure and vault
+        # Vault changes are recorded per user in the audit log (audit/auditLog.py)
         self._initialize_directory_structure()
-        self._initialize_vault()
-
-    def _setup_logging(self) -> None:
-        """Set up logging with user-specific log file."""
-        logging.basicConfig(
-            filename=self.log_file,
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s'
-        )
+        # A key replaced by a master password change may neither open nor write the vault
+        self._key_generation = KeyGenerationCheck(self.user_dir, key_check(vault_key))
+        self._key_generation.require_current()
+        self._initialize_vault(vault_key)
+        self.storage.write_guard = self._key_generation.require_current
 
     def _initialize_directory_structure(self) -> None:
         """Create necessary directory structure for user vault."""
@@ -60,56 +85,194 @@ class VaultManager:
             logging.error(f"Error creating directory structure: {str(e)}")
             raise
 
-    def _initialize_encryption(self, master_key: str) -> Fernet:
-        """Initialize encryption with user's master key."""
-        salt = b'salt_'  # In production, use a secure random salt
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100000,
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(master_key.encode()))
-        return Fernet(key)
-
-    def _initialize_vault(self) -> None:
-        """Initialize user's vault file if it doesn't exist."""
+    def _derive_vault_key(self, master_key: str) -> bytes:
+        """
+        Turn the user's master key into the vault key.
+
+        UserHandling.verify_login hands over an already derived key, which is
+        used as is. Anything else is treated as a passphrase and stretched with
+        the legacy fixed-salt parameters through the shared key cache, so
+        re-opening the same vault does not pay for PBKDF2 again.
+        """
+        with metrics.timed('vault.init_encryption'):
+            if is_fernet_key(master_key):
+                return master_key.encode()
+            return key_cache.derive(master_key, LEGACY_SALT, LEGACY_ITERATIONS)
+
+    def derive_subkey(self, purpose: str) -> bytes:
+        """Independent 32 byte key for another use of the vault key (e.g. sync), via HKDF."""
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+        return HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                    info=f'naitevarnasse-{purpose}'.encode()).derive(self._vault_key)
+
+    def _entry_tag(self, service: str, username: str) -> str:
+        """Keyed tag naming an entry in the audit log without revealing its service or account."""
+        if self._audit_key is None:
+            self._audit_key = self.derive_subkey('audit')
+        message = f'{service}\0{username}'.encode()
+        return hmac.new(self._audit_key, message, hashlib.sha256).hexdigest()[:16]
+
+    def _initialize_vault(self, vault_key: bytes) -> None:
+        """Open the user's vault through the configured storage engine."""
         try:
-            if not os.path.exists(self.data_file):
-                with open(self.data_file, 'w') as file:
-                    json.dump({"credentials": []}, file)
-                logging.info(f"Created new vault file for user {self.username}")
+            storage_class = STORAGE_BACKENDS[self.storage_backend][0]
+            if storage_class.encrypts_records:
+                self.storage = storage_class(self.data_file, vault_key)
             else:
-                # Verify file is readable and has valid JSON
-                with open(self.data_file, 'r') as file:
-                    json.load(file)
-                    
+                self.storage = storage_class(self.data_file)
         except Exception as e:
             logging.error(f"Error initializing vault: {str(e)}")
             raise
 
-    def display_vault(self, mask_passwords: bool = True) -> None:
-        """Display vault contents with optional password masking."""
+    def key_is_current(self) -> bool:
+        """False once the master password was changed after this vault was opened."""
+        return self._key_generation.is_current()
+
+    def close(self) -> None:
+        """Wipe decrypted fields from memory and close the storage engine."""
+        self.field_cache.wipe()
+        self._search_index = None
+        if self.storage is not None:
+            self.storage.close()
+
+    def _decrypt(self, token: bytes) -> bytes:
+        with metrics.timed('crypto.decrypt'):
+            return self.fernet.decrypt(token)
+
+    def _encrypt(self, value: str) -> str:
+        with metrics.timed('crypto.encrypt'):
+            return self.fernet.encrypt(value.encode()).decode()
+
+    def _decrypt_field(self, token: str) -> str:
+        if self.storage.encrypts_records:
+            return token
+        return self.field_cache.decrypt(token, self._decrypt)
+
+    def _row(self, cred: Dict, columns: Sequence[str], mask_passwords: bool) -> List[str]:
+        row = []
+        for column in columns:
+            if column == "password" and mask_passwords:
+                row.append("********")
+            elif column in ENCRYPTED_COLUMNS:
+                row.append(self._decrypt_field(cred[column]))
+            else:
+                row.append(cred[column])
+        return row
+
+    def iter_rows(self, columns: Sequence[str] = VAULT_COLUMNS, mask_passwords: bool = True,
+                  offset: int = 0, limit: Optional[int] = None) -> Iterator[List[str]]:
+        """
+        Lazily yield vault rows, decrypting only the requested columns.
+
+        Args:
+            columns: Fields to include, in order (default: all four)
+            mask_passwords (bool): Show the password column as asterisks
+            offset (int): Index of the first credential to yield
+            limit (int): Maximum number of rows, None for all
+        """
+        for cred in self.storage.iter_credentials(offset, limit):
+            yield self._row(cred, columns, mask_passwords)
+
+    def get_page(self, page: int = 0, page_size: int = 20, mask_passwords: bool = True,
+                 columns: Sequence[str] = VAULT_COLUMNS) -> Tuple[List[List[str]], int]:
+        """Return the rows of one page and the total number of pages."""
+        total_pages = max(1, -(-len(self.storage) // page_size))
+        page = min(max(page, 0), total_pages - 1)
+        rows = list(self.iter_rows(columns, mask_passwords, page * page_size, page_size))
+        return rows, total_pages
+
+    def get_credentials(self, service: str, username: str) -> Optional[Dict]:
+        """Return one decrypted credential, or None if it does not exist."""
+        cred = self.storage.get(service, username)
+        if cred is None:
+            return None
+        return self.decrypt_credentials(cred)
+
+    def decrypt_credentials(self, cred: Dict) -> Dict:
+        """Decrypted copy of a stored credential record."""
+        return dict(zip(VAULT_COLUMNS, self._row(cred, VAULT_COLUMNS, mask_passwords=False)))
+
+    @property
+    def search_index(self) -> SearchIndex:
+        """Search index over service/username, built on first use and kept up to date."""
+        if self._search_index is None:
+            self._search_index = SearchIndex(self.storage.iter_credentials())
+        return self._search_index
+
+    @property
+    def search_index_built(self) -> bool:
+        return self._search_index is not None
+
+    def invalidate_search_index(self) -> None:
+        """Drop the search index, e.g. after another process changed the vault; it is rebuilt on next use."""
+        self._search_index = None
+
+    def index_credentials(self, records: Sequence[Dict]) -> None:
+        """Add records just written to storage to the search index; indexed entries are skipped."""
+        if self._search_index is not None:
+            self._search_index.add_many(records)
+
+    def search(self, query: str, limit: int = 10, mask_passwords: bool = True,
+               columns: Sequence[str] = VAULT_COLUMNS) -> List[List[str]]:
+        """
+        Find credentials by service or username, best match first.
+
+        Matches may be exact, by prefix, by substring or fuzzy (typos); see
+        SearchIndex.search. Only the returned rows are decrypted.
+
+        Args:
+            query (str): Text to look for
+            limit (int): Maximum number of rows
+            mask_passwords (bool): Show the password column as asterisks
+            columns: Fields to include, in order (default: all four)
+        """
+        rows = []
+        with metrics.timed('vault.search'):
+            matches = self.search_index.search(query, limit)
+        for service, username, _ in matches:
+            cred = self.storage.get(service, username)
+            if cred is not None:
+                rows.append(self._row(cred, columns, mask_passwords))
+        return rows
+
+    def complete(self, prefix: str, limit: int = 10) -> List[Tuple[str, str]]:
+        """Autocomplete (service, username) pairs from a prefix."""
+        return self.search_index.complete(prefix, limit)
+
+    def display_search(self, query: str, limit: int = 10, mask_passwords: bool = True) -> int:
+        """
+        Display the best matches for a search query.
+
+        Returns:
+            int: Number of matches shown
+        """
+        from tabulate import tabulate  # deferred: only needed for console output
         try:
-            with open(self.data_file, 'r') as file:
-                data = json.load(file)
-            
-            credentials = data.get("credentials", [])
-            
-            headers = ["Service", "Username", "Password", "Email"]
-            rows = []
-            
-            for cred in credentials:
-                password_display = "********" if mask_passwords else \
-                                 self.fernet.decrypt(cred["password"].encode()).decode()
-                rows.append([
-                    cred["service"],
-                    cred["username"],
-                    password_display,
-                    self.fernet.decrypt(cred["email"].encode()).decode()
-                ])
-            
+            rows = self.search(query, limit, mask_passwords)
+            headers = [VAULT_HEADERS[column] for column in VAULT_COLUMNS]
             print(tabulate(rows, headers=headers, tablefmt="grid"))
+            return len(rows)
+        except Exception as e:
+            logging.error(f"Error searching vault: {str(e)}")
+            raise
+
+    def display_vault(self, mask_passwords: bool = True, page: int = 0,
+                      page_size: int = 20) -> int:
+        """
+        Display one page of vault contents with optional password masking.
+
+        Returns:
+            int: Total number of pages
+        """
+        from tabulate import tabulate
+        try:
+            rows, total_pages = self.get_page(page, page_size, mask_passwords)
+            headers = [VAULT_HEADERS[column] for column in VAULT_COLUMNS]
+            print(tabulate(rows, headers=headers, tablefmt="grid"))
+            print(f"Page {min(max(page, 0), total_pages - 1) + 1} of {total_pages}")
+            return total_pages
         except Exception as e:
             logging.error(f"Error displaying vault: {str(e)}")
             raise
@@ -117,23 +280,20 @@ class VaultManager:
     def add_credentials(self, username: str, password: str, email: str, service: str) -> bool:
         """Add new credentials to the user's vault."""
         try:
-            with open(self.data_file, 'r') as file:
-                data = json.load(file)
+            encrypted_password = self._encrypt(password)
+            encrypted_email = self._encrypt(email)
             
-            encrypted_password = self.fernet.encrypt(password.encode()).decode()
-            encrypted_email = self.fernet.encrypt(email.encode()).decode()
-            
-            data["credentials"].append({
+            self.storage.put({
                 "service": service,
                 "username": username,
                 "password": encrypted_password,
                 "email": encrypted_email
             })
-            
-            with open(self.data_file, 'w') as file:
-                json.dump(data, file, indent=4)
+            if self._search_index is not None:
+                self._search_index.add(service, username)
             
             logging.info(f"Added new credentials for service: {service}")
+            auditLog.record('credential_added', self.username, entry=self._entry_tag(service, username))
             return True
             
         except Exception as e:
@@ -143,19 +303,11 @@ class VaultManager:
     def delete_credentials(self, service: str, username: str) -> bool:
         """Delete credentials from the user's vault."""
         try:
-            with open(self.data_file, 'r') as file:
-                data = json.load(file)
-            
-            initial_length = len(data["credentials"])
-            data["credentials"] = [
-                cred for cred in data["credentials"]
-                if not (cred["service"] == service and cred["username"] == username)
-            ]
-            
-            if len(data["credentials"]) < initial_length:
-                with open(self.data_file, 'w') as file:
-                    json.dump(data, file, indent=4)
+            if self.storage.delete(service, username):
+                if self._search_index is not None:
+                    self._search_index.remove(service, username)
                 logging.info(f"Deleted credentials for service: {service}")
+                auditLog.record('credential_deleted', self.username, entry=self._entry_tag(service, username))
                 return True
             return False
             
@@ -163,4 +315,40 @@ class VaultManager:
             logging.error(f"Error deleting credentials: {str(e)}")
             return False
 
+    def store_credentials(self, records: Sequence[Dict], encrypted: bool = False) -> List[Dict]:
+        """
+        Add or replace many credentials with one storage write.
+
+        Args:
+            records: Credentials with plaintext password and email
+            encrypted (bool): The records already hold this vault's encrypted fields (e.g. an import)
+
+        Returns:
+            The records as stored (with password and email encrypted)
+        """
+        if encrypted:
+            stored = list(records)
+        else:
+            stored = [{
+                "service": r["service"],
+                "username": r["username"],
+                "password": self._encrypt(r["password"]),
+                "email": self._encrypt(r["email"])
+            } for r in records]
+        if stored:
+            self.storage.put_many(stored)
+            self.index_credentials(stored)
+            auditLog.record('credentials_stored', self.username, count=len(stored))
+        return stored
+
+    def remove_credentials(self, keys: Sequence[Tuple[str, str]]) -> int:
+        """Delete many (service, username) pairs with one storage write. Returns the number removed."""
+        removed = self.storage.delete_many(keys) if keys else 0
+        if self._search_index is not None:
+            for service, username in keys:
+                self._search_index.remove(service, username)
+        if removed:
+            auditLog.record('credentials_removed', self.username, count=removed)
+        return removed
+
 # Gonna transfer to GraphQL
\ No newline at end of file